@@ -0,0 +1,107 @@
+# -*-coding:utf-8 -*-
+
+"""
+ HTTP server on the AE port (conf["ae"]["port"]).
+
+ GET /metrics returns the metrics in Prometheus text format and
+ GET /metrics.json returns them in JSON. GET /telemetry[/<flight>] returns the
+ latest decoded telemetry of the primary (or named) vehicle with its version
+ as ETag, answering 304 to a matching If-None-Match. POST receives the oneM2M notifications
+ of the subscriptions with an http:// nu; each request runs in its own thread and
+ is answered before the notification is handled.
+"""
+
+import json, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import conf
+import metrics
+import muv_log
+import noti
+
+log = muv_log.get_logger('ae_http')
+
+server = None
+
+
+class AeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self.reply(200, 'text/plain; version=0.0.4', metrics.render_prometheus())
+        elif path == '/metrics.json':
+            self.reply(200, 'application/json', metrics.render_json())
+        elif path == '/telemetry' or path.startswith('/telemetry/'):
+            self.telemetry(path[len('/telemetry/'):])
+        else:
+            self.reply(404, 'text/plain', 'not found\n')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            jsonObj = json.loads(body)
+        except Exception as e:
+            self.reply(400, 'application/json', '', rsc=4000)
+            log.warning('[http_noti_action] body is not json: %s', e)
+            return
+
+        self.reply(200, 'application/json', '', rsc=2000)
+        try:
+            noti.http_noti_action(jsonObj)
+        except Exception as e:
+            log.warning('[http_noti_action] %s', e)
+
+    def telemetry(self, flight):
+        import vehicle
+
+        v = vehicle.vehicles.get(flight) if flight else vehicle.primary
+        if v is None:
+            self.reply(404, 'text/plain', 'no vehicle\n')
+            return
+
+        version, text = v.telemetry.json()
+        etag = '"{}"'.format(version)
+        if self.headers.get('If-None-Match') == etag:
+            self.reply(304, 'application/json', '', etag=etag)
+        else:
+            self.reply(200, 'application/json', text, etag=etag)
+
+    def reply(self, status, content_type, body, rsc=None, etag=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if rsc is not None:
+            self.send_header('X-M2M-RSC', str(rsc))
+            self.send_header('X-M2M-RI', self.headers.get('X-M2M-RI', ''))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class AeServer(ThreadingHTTPServer):
+    # bursts of notifications overflow the default listen backlog of 5
+    request_queue_size = 64
+
+
+def start():
+    global server
+
+    if server is not None:
+        return
+
+    try:
+        server = AeServer(('0.0.0.0', int(conf.conf['ae']['port'])), AeHandler)
+    except OSError as e:
+        log.error('http_server can not listen on %s port: %s', conf.conf['ae']['port'], e)
+        return
+
+    t = threading.Thread(target=server.serve_forever, name='ae_http', daemon=True)
+    t.start()
+    log.info('http_server running at %s port', conf.conf['ae']['port'])
@@ -0,0 +1,154 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Message rate of the local MUV topics with and without delta publishing.
+
+ Replays a recorded flight (a tlog or .mavraw of --capture, a tlog of bench/mavgen.py, or a sortie
+ of the flight recorder) through the TAS decoder with the MQTT clients stubbed,
+ once publishing full messages and once in delta mode, on the clock of the
+ recording. Reports messages and bytes per topic and checks that a subscriber
+ applying the deltas sees the same contents as with full messages.
+
+    python3 bench/bench_delta.py --tlog capture/2024-05-01T10-00-00.tlog
+    python3 bench/bench_delta.py --sortie 2024-05-01T10:00:00000 --log-dir flight_log
+    python3 bench/bench_delta.py --duration 600
+"""
+
+import argparse, json, os, sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import bench_encoding
+import bench_ingest
+import mavgen
+import conf
+import flight_log
+import mav_capture
+import muv_codec
+import thyme
+import thyme_tas_mav as tas_mav
+
+
+class RecordingClock:
+    # time.monotonic() of muv_codec follows the recording instead of the replay speed
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+def load_frames(args):
+    if args.tlog:
+        return list(mav_capture.read_capture(args.tlog))
+    if args.sortie:
+        return [(t / 1e6, frame) for t, frame in flight_log.query(args.sortie, log_dir=args.log_dir)]
+
+    return mavgen.generate(args.duration, args.rate, seed=args.seed)
+
+
+def publish(frames, delta):
+    conf.conf['muv']['delta'] = delta
+    muv_codec.init()
+    clock = RecordingClock()
+    muv_codec.time = clock
+    thyme.muv_mqtt_client = bench_encoding.RecordingClient()
+
+    for t, frame in frames:
+        clock.now = t
+        tas_mav.mavPortIngest(frame)
+
+    return thyme.muv_mqtt_client.messages
+
+
+def summary(messages):
+    topics = {}
+    for topic, payload in messages:
+        name = topic.rsplit('/', 1)[1]
+        count, size = topics.get(name, (0, 0))
+        topics[name] = (count + 1, size + len(payload))
+
+    return {name: {'messages': count, 'bytes': size} for name, (count, size) in topics.items()}
+
+
+def check(full, delta):
+    """
+    Applies the deltas like a subscriber and compares with the full messages.
+    Returns the number of mismatches.
+    """
+
+    state = {}
+    seqs = {}
+    delta_at = {}
+    for topic, payload in delta:
+        message = json.loads(payload)
+        if seqs.get(topic, 0) + 1 != message['seq']:
+            raise ValueError('gap on {} at {}'.format(topic, message['seq']))
+        seqs[topic] = message['seq']
+        state.setdefault(topic, {}).update(message['fields'])
+        delta_at.setdefault(topic, []).append(dict(state[topic]))
+
+    # every full message either changed something (one delta) or repeated the previous one
+    ignore = conf.conf['muv']['delta_ignore']
+
+    def distinct(contents):
+        contents = [{k: v for k, v in c.items() if k not in ignore} for c in contents]
+        return [c for i, c in enumerate(contents) if i == 0 or c != contents[i - 1]]
+
+    mismatches = 0
+    for topic in delta_at:
+        if distinct(json.loads(payload) for t, payload in full if t == topic) != distinct(delta_at[topic]):
+            mismatches += 1
+
+    return mismatches
+
+
+def frame_sysid(frames):
+    # system id of the first v1 frame, so that the 'self' route rule sends the frames to the decoder
+    for t, frame in frames:
+        if frame[0] == 0xfe:
+            return frame[3]
+        if frame[0] == 0xfd:
+            return frame[5]
+
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tlog', default='', help='recorded flight as tlog or .mavraw')
+    parser.add_argument('--sortie', default='', help='recorded flight of the flight recorder')
+    parser.add_argument('--log-dir', default='./flight_log')
+    parser.add_argument('--duration', type=float, default=600, help='seconds of synthetic flight without a recording')
+    parser.add_argument('--rate', type=float, default=0)
+    parser.add_argument('--keyframe-interval', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    if len(frames) == 0:
+        print('no frames')
+        return
+    bench_ingest.setup(argparse.Namespace(cse_latency=0.0, sysid=frame_sysid(frames)))
+    conf.conf['muv']['keyframe_interval'] = args.keyframe_interval
+
+    full = publish(frames, False)
+    delta = publish(frames, True)
+    results = {'full': summary(full), 'delta': summary(delta)}
+    mismatches = check(full, delta)
+
+    seconds = frames[-1][0] - frames[0][0]
+    print('flight: {:.0f} s, {} frames, keyframe every {} s'.format(seconds, len(frames), args.keyframe_interval))
+    print('{:22} {:>10} {:>10} {:>10} {:>10} {:>8}'.format('topic', 'full msg', 'delta msg', 'full B', 'delta B',
+                                                          'msg %'))
+    for name in results['full']:
+        f = results['full'][name]
+        d = results['delta'].get(name, {'messages': 0, 'bytes': 0})
+        print('{:22} {:>10} {:>10} {:>10} {:>10} {:>8.1f}'.format(
+            name, f['messages'], d['messages'], f['bytes'], d['bytes'], 100.0 * d['messages'] / f['messages']))
+    print('reconstruction mismatches: {}'.format(mismatches))
+
+
+if __name__ == '__main__':
+    main()
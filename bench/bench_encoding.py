@@ -0,0 +1,105 @@
+# -*-coding:utf-8 -*-
+
+"""
+ JSON against packed struct encoding of the local MUV telemetry topics.
+
+ Runs a synthetic flight (bench/mavgen.py) through the TAS decoder with the
+ MQTT clients stubbed, keeps the decoded global_position_int and heartbeat
+ contents, and reports for each encoding of muv_codec the encode and decode
+ CPU time per message and the message size.
+
+    python3 bench/bench_encoding.py --duration 600 --repeat 5
+"""
+
+import argparse, json, os, sys, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import bench_ingest
+import mavgen
+import muv_codec
+import thyme
+import thyme_tas_mav as tas_mav
+
+
+class RecordingClient:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages.append((topic, payload))
+
+
+def decoded_messages(args):
+    bench_ingest.setup(argparse.Namespace(cse_latency=0.0, sysid=1))
+    thyme.muv_mqtt_client = RecordingClient()
+    for t, frame in mavgen.generate(args.duration, args.rate, seed=args.seed):
+        tas_mav.mavPortIngest(frame)
+
+    messages = []
+    for topic, payload in thyme.muv_mqtt_client.messages:
+        name = topic.rsplit('/', 1)[1]
+        if name in muv_codec.layouts:
+            messages.append((name, json.loads(payload)))
+
+    return messages
+
+
+def measure(messages, encoding, repeat):
+    encode = muv_codec.encoders[encoding]
+    decode = muv_codec.decoders[encoding]
+
+    encoded = [(name, encode(name, content)) for name, content in messages]
+    for (name, content), (name, payload) in zip(messages, encoded):
+        decoded = decode(name, payload)
+        if any(decoded[k] != content.get(k, 0) for k in decoded):
+            raise ValueError('{} {} does not round trip: {} {}'.format(encoding, name, content, decoded))
+
+    started = time.process_time()
+    for i in range(repeat):
+        for name, content in messages:
+            encode(name, content)
+    encode_cpu = time.process_time() - started
+
+    started = time.process_time()
+    for i in range(repeat):
+        for name, payload in encoded:
+            decode(name, payload)
+    decode_cpu = time.process_time() - started
+
+    count = len(messages) * repeat
+    sizes = {}
+    for name, payload in encoded:
+        sizes.setdefault(name, []).append(len(payload))
+
+    return {
+        'encode_us_per_message': encode_cpu / count * 1e6,
+        'decode_us_per_message': decode_cpu / count * 1e6,
+        'bytes_per_message': {name: sum(s) / len(s) for name, s in sizes.items()},
+        'bytes_total': sum(len(payload) for name, payload in encoded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=600, help='seconds of flight to generate')
+    parser.add_argument('--rate', type=float, default=0, help='frames per second (0: FC stream rates)')
+    parser.add_argument('--repeat', type=int, default=5, help='passes over the messages')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    messages = decoded_messages(args)
+    results = {encoding: measure(messages, encoding, args.repeat) for encoding in muv_codec.encoders}
+
+    print('messages: {}'.format(len(messages)))
+    print('{:8} {:>12} {:>12} {:>10} {:>10}'.format('encoding', 'encode us', 'decode us', 'gpi bytes', 'hb bytes'))
+    for encoding, result in results.items():
+        print('{:8} {:>12.2f} {:>12.2f} {:>10.1f} {:>10.1f}'.format(
+            encoding, result['encode_us_per_message'], result['decode_us_per_message'],
+            result['bytes_per_message'].get('global_position_int', 0), result['bytes_per_message'].get('heartbeat', 0)))
+    print(json.dumps({'config': vars(args), 'messages': len(messages), 'results': results}, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Throughput of the oneM2M HTTP notification receiver under burst load.
+
+ Starts the AE HTTP server in this process with the local MQTT client stubbed,
+ then sends bursts of m2m:sgn notifications from --senders threads and reports
+ notifications per second and response latency percentiles.
+
+    python3 bench/bench_http_noti.py --senders 8 --count 2000
+"""
+
+import argparse, http.client, json, os, sys, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import conf
+import ae_http
+import thyme
+
+
+class StubClient:
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self.lock:
+            self.count += 1
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def sender(port, count, body, latencies):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    for i in range(count):
+        started = time.perf_counter()
+        conn.request('POST', '/noti?ct=json', body, {'Content-Type': 'application/json', 'X-M2M-RI': str(i)})
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=19727)
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    conf.conf['ae']['port'] = str(args.port)
+    thyme.muv_mqtt_client = StubClient()
+    ae_http.start()
+
+    body = json.dumps({'m2m:sgn': {
+        'sur': 'Mobius/gcs/Mission_Data/drone/msw/container/sub_msw',
+        'nev': {'rep': {'m2m:cin': {'con': 'ff' * 32}}, 'net': 3}
+    }})
+
+    per_sender = args.count // args.senders
+    latencies = []
+    threads = [threading.Thread(target=sender, args=(args.port, per_sender, body, latencies))
+               for i in range(args.senders)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    deadline = time.monotonic() + 2
+    while thyme.muv_mqtt_client.count < per_sender * args.senders and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    latencies.sort()
+    result = {
+        'senders': args.senders,
+        'count': per_sender * args.senders,
+        'published': thyme.muv_mqtt_client.count,
+        'notifications_per_second': per_sender * args.senders / elapsed,
+        'latency_p50_ms': percentile(latencies, 50) * 1000,
+        'latency_p90_ms': percentile(latencies, 90) * 1000,
+        'latency_p99_ms': percentile(latencies, 99) * 1000,
+        'latency_max_ms': latencies[-1] * 1000 if latencies else 0.0
+    }
+    print(json.dumps(result, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
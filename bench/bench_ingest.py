@@ -0,0 +1,244 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Benchmark of the TAS ingest pipeline.
+
+ Feeds a synthetic FC stream (bench/mavgen.py) through the framer, the route
+ table, the raw MQTT sink, the Mobius aggregation and the local decoder, with
+ the MQTT clients and the CSE stubbed. The stream is cut into chunks the way
+ serial readline() returns them. Reports frames/s, CPU time per frame, memory
+ allocation per frame and per-frame latency percentiles (chunk arrival to the
+ end of dispatch), and stores them as JSON to compare between versions.
+
+    python3 bench/bench_ingest.py --duration 60 --rate 200 --v2 0.3 --corruption 0.01 --output new.json
+    python3 bench/bench_ingest.py --compare old.json --output new.json
+"""
+
+import argparse, json, os, platform, subprocess, sys, tempfile, threading, time, tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mavgen
+
+# the TAS modules read and write their json files in the working directory
+os.chdir(tempfile.mkdtemp())
+
+import thyme
+import frame_trace
+import http_adn
+import http_app
+import thyme_tas_mav as tas_mav
+import vehicle
+
+
+class StubClient:
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self.lock:
+            self.count += 1
+            self.bytes += len(payload)
+
+
+class StubCse:
+    def __init__(self, latency):
+        self.latency = latency
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def http_request(self, origin, path, method, ty, bodyString, prio='control'):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self.lock:
+            self.count += 1
+        if method == 'GET':
+            return 4004, {}
+        return 2001, {}
+
+
+def chunks(frames):
+    # serial readline() returns up to and including each b'\n'
+    result = []
+    pending = b''
+    for t, frame in frames:
+        data = pending + frame
+        start = 0
+        idx = data.find(b'\n')
+        while idx >= 0:
+            result.append((t, data[start:idx + 1]))
+            start = idx + 1
+            idx = data.find(b'\n', start)
+        pending = data[start:]
+    if pending:
+        result.append((frames[-1][0], pending))
+
+    return result
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def setup(args):
+    thyme.mqtt_client = StubClient()
+    thyme.muv_mqtt_client = StubClient()
+    cse = StubCse(args.cse_latency)
+    http_adn.http_request = cse.http_request
+
+    http_app.my_system_id = args.sysid
+    http_app.my_parent_cnt_name = '/Mobius/bench/Drone_Data/drone'
+    http_app.my_cnt_name = http_app.my_parent_cnt_name + '/' + http_app.my_sortie_name
+    http_app.muv_pub_fc_gpi_topic = http_app.my_parent_cnt_name + '/global_position_int'
+    http_app.muv_pub_fc_hb_topic = http_app.my_parent_cnt_name + '/heartbeat'
+    vehicle.start_primary(tas_mav.load_fc_model(), '', '')
+    tas_mav.mav_route.compile_routes(thyme.conf['route'], vehicle.system_ids())
+
+    return cse
+
+
+def run(data, realtime):
+    dispatch = tas_mav.mavPacketDispatch
+    latencies = []
+    arrival = [0.0]
+
+    def timed_dispatch(mavPacket, received, v, trace=None):
+        dispatch(mavPacket, received, v, trace)
+        latencies.append(time.perf_counter() - arrival[0])
+
+    tas_mav.mavPacketDispatch = timed_dispatch
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for t, chunk in data:
+        if realtime:
+            due = started + t
+            now = time.perf_counter()
+            if due > now:
+                time.sleep(due - now)
+            arrival[0] = due
+        else:
+            arrival[0] = time.perf_counter()
+        tas_mav.mavPortIngest(chunk)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    tas_mav.mavPacketDispatch = dispatch
+
+    return elapsed, cpu, latencies
+
+
+def measure_allocation(data):
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    for t, chunk in data:
+        tas_mav.mavPortIngest(chunk)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak - base, sys.getallocatedblocks() - blocks
+
+
+def trace_stages():
+    # mean of each stage of the frames traced and done so far
+    counter_copy, histogram_copy, gauge_copy = tas_mav.metrics.snapshot()
+    return {dict(labels)['stage']: counts[-1] / sum(counts[:-1]) * 1e6
+            for labels, counts in histogram_copy.get('trace_stage_seconds', {}).items()}
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ''
+
+
+def compare(result, baseline):
+    print('{:28} {:>14} {:>14} {:>8}'.format('metric', 'baseline', 'current', 'ratio'))
+    for key in ['frames_per_second', 'cpu_us_per_frame', 'alloc_peak_bytes_per_frame',
+                'latency_p50_us', 'latency_p99_us']:
+        old = baseline['results'].get(key, 0)
+        new = result['results'].get(key, 0)
+        print('{:28} {:>14.2f} {:>14.2f} {:>8.2f}'.format(key, old, new, new / old if old else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=60, help='seconds of flight to generate')
+    parser.add_argument('--rate', type=float, default=0, help='frames per second (0: FC stream rates)')
+    parser.add_argument('--v2', type=float, default=0.0, help='ratio of MAVLink v2 frames')
+    parser.add_argument('--corruption', type=float, default=0.0, help='ratio of corrupted frames')
+    parser.add_argument('--sysid', type=int, default=1)
+    parser.add_argument('--cse-latency', type=float, default=0.0, help='seconds per stubbed CSE request')
+    parser.add_argument('--realtime', action='store_true', help='feed the chunks at their stream time')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace-rate', type=float, default=0.0, help='ratio of frames traced through the stages')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    args = parser.parse_args()
+
+    frames = mavgen.generate(args.duration, args.rate, args.v2, args.corruption, args.sysid, seed=args.seed)
+    data = chunks(frames)
+    total_bytes = sum(len(chunk) for t, chunk in data)
+
+    cse = setup(args)
+    if args.trace_rate > 0:
+        thyme.conf['trace'].update(enable=True, rate=args.trace_rate)
+        frame_trace.init()
+    elapsed, cpu, latencies = run(data, args.realtime)
+    dispatched = len(latencies)
+    remote_publish = thyme.mqtt_client.count
+    local_publish = thyme.muv_mqtt_client.count
+    alloc_peak, alloc_blocks = measure_allocation(data)
+
+    latencies.sort()
+    result = {
+        'version': git_version(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'results': {
+            'frames_generated': len(frames),
+            'frames_dispatched': dispatched,
+            'bytes': total_bytes,
+            'chunks': len(data),
+            'elapsed': elapsed,
+            'frames_per_second': dispatched / elapsed if elapsed else 0.0,
+            'bytes_per_second': total_bytes / elapsed if elapsed else 0.0,
+            'cpu_us_per_frame': cpu / max(dispatched, 1) * 1e6,
+            'alloc_peak_bytes_per_frame': alloc_peak / max(dispatched, 1),
+            'alloc_retained_blocks_per_frame': alloc_blocks / max(dispatched, 1),
+            'latency_p50_us': percentile(latencies, 50) * 1e6,
+            'latency_p90_us': percentile(latencies, 90) * 1e6,
+            'latency_p99_us': percentile(latencies, 99) * 1e6,
+            'latency_max_us': latencies[-1] * 1e6 if latencies else 0.0,
+            'mqtt_remote_publish': remote_publish,
+            'mqtt_local_publish': local_publish,
+            'cse_requests': cse.count,
+            'trace_stage_us': trace_stages()
+        }
+    }
+
+    print(json.dumps(result, indent=4))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(result, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
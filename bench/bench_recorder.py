@@ -0,0 +1,102 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Per-frame cost of the flight recorder against plain buffered file writes.
+
+ Appends the frames of a synthetic flight (bench/mavgen.py) with the same record
+ layout to memory-mapped segments (flight_recorder) and to a file opened with
+ the default buffering, and reports the wall and CPU time per frame. Run it with
+ --dir on the SD card of the drone.
+
+    python3 bench/bench_recorder.py --dir /home/pi --duration 600 --rate 200
+"""
+
+import argparse, json, os, shutil, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import mavgen
+import conf
+import flight_recorder
+
+
+def run_recorder(frames, work_dir):
+    conf.conf['recorder']['path'] = os.path.join(work_dir, 'mmap')
+    flight_recorder.start()
+
+    latencies = []
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for t, frame in frames:
+        begin = time.perf_counter()
+        flight_recorder.record('bench', t, frame)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    flight_recorder.stop()
+
+    return elapsed, cpu, latencies
+
+
+def run_file(frames, work_dir):
+    path = os.path.join(work_dir, 'file.log')
+    base = int(time.time() * 1e6)
+
+    latencies = []
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    with open(path, 'ab') as f:
+        for t, frame in frames:
+            begin = time.perf_counter()
+            f.write(flight_recorder.RECORD.pack(base + int(t * 1e6), len(frame)) + frame)
+            latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    return elapsed, cpu, latencies
+
+
+def summary(count, elapsed, cpu, latencies):
+    latencies.sort()
+
+    return {
+        'ns_per_frame': elapsed / count * 1e9,
+        'cpu_ns_per_frame': cpu / count * 1e9,
+        'p99_ns': latencies[int(len(latencies) * 0.99)] * 1e9,
+        'max_ns': latencies[-1] * 1e9
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=None)
+    parser.add_argument('--duration', type=float, default=600)
+    parser.add_argument('--rate', type=float, default=200)
+    parser.add_argument('--segment-size', type=int, default=16 * 1024 * 1024)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    frames = mavgen.generate(args.duration, args.rate)
+    work_dir = tempfile.mkdtemp(dir=args.dir)
+    conf.conf['recorder']['segment_size'] = args.segment_size
+
+    try:
+        result = {
+            'frames': len(frames),
+            'bytes': sum(len(frame) for t, frame in frames),
+            'mmap_segments': summary(len(frames), *run_recorder(frames, work_dir)),
+            'buffered_file': summary(len(frames), *run_file(frames, work_dir))
+        }
+    finally:
+        shutil.rmtree(work_dir)
+
+    print(json.dumps(result, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
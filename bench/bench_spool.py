@@ -0,0 +1,106 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Write amplification and drain rate of the spool.
+
+ Spools CIN bodies the size of an aggregated telemetry CIN the way crtci does when
+ the CSE is unreachable, then drains them to a stubbed CSE. Run it with --dir on
+ the SD card of the drone; write_bytes is what the kernel sent to the device and
+ is only meaningful on a real block device (not tmpfs).
+
+    python3 bench/bench_spool.py --dir /home/pi --count 5000 --size 600
+"""
+
+import argparse, json, os, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import conf
+import http_adn
+import spool
+
+
+def proc_io():
+    result = {'wchar': 0, 'write_bytes': 0}
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                key, value = line.split(':')
+                if key in result:
+                    result[key] = int(value)
+    except Exception:
+        pass
+
+    return result
+
+
+def file_size(path):
+    size = 0
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(path + suffix):
+            size += os.path.getsize(path + suffix)
+
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=None)
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=600)
+    parser.add_argument('--commit-rows', type=int, default=None, help='conf spool commit_rows')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(dir=args.dir)
+    conf.conf['spool']['path'] = os.path.join(work_dir, 'spool.db')
+    conf.conf['spool']['retry'] = 3600
+    conf.conf['spool']['commit_interval'] = 3600
+    if args.commit_rows:
+        conf.conf['spool']['commit_rows'] = args.commit_rows
+
+    body = json.dumps({'m2m:cin': {'con': 'fe' * (args.size // 2)}})
+    payload = 0
+
+    spool.start()
+    before = proc_io()
+    started = time.monotonic()
+    for i in range(args.count):
+        spool.put('/Mobius/bench/Drone_Data/drone/sortie?rcn=0', '4', body, 'telemetry')
+        payload += len(body)
+    spool.flush()
+    put_time = time.monotonic() - started
+    after = proc_io()
+    size = file_size(conf.conf['spool']['path'])
+
+    http_adn.http_request = lambda origin, path, method, ty, bodyString, prio='control': (2001, {})
+    started = time.monotonic()
+    spool.cse_alive()
+    while spool.depth > 0:
+        time.sleep(0.01)
+    drain_time = time.monotonic() - started
+
+    result = {
+        'count': args.count,
+        'commit_rows': conf.conf['spool']['commit_rows'],
+        'payload_bytes': payload,
+        'put_per_second': args.count / put_time,
+        'file_bytes': size,
+        'wchar': after['wchar'] - before['wchar'],
+        'write_bytes': after['write_bytes'] - before['write_bytes'],
+        'amplification_wchar': (after['wchar'] - before['wchar']) / payload,
+        'amplification_device': (after['write_bytes'] - before['write_bytes']) / payload,
+        'drain_per_second': args.count / drain_time,
+        'stats': spool.stats()
+    }
+    print(json.dumps(result, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+    spool.db.close()
+    shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Startup time of thyme.py.
+
+ Imports the entry module in a fresh interpreter with -X importtime, --repeat
+ times, from an empty working directory, and reports the median time of the
+ interpreter, of the whole import and of the slowest modules (self and
+ cumulative), and which heavy optional dependencies got imported on the way.
+ --drop-caches (root, Linux) empties the page cache before each run, for the
+ cold start after a power cycle of the Pi. Results are stored as JSON to
+ compare between versions.
+
+    python3 bench/bench_startup.py --repeat 10 --output new.json
+    python3 bench/bench_startup.py --drop-caches --compare old.json
+"""
+
+import argparse, json, os, platform, re, statistics, subprocess, sys, tempfile, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+
+HEAVY = ['numpy', 'paho', 'serial', 'selenium', 'requests', 'asyncio', 'PySide2']
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def drop_caches():
+    subprocess.run(['sync'], check=False)
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def run_once(module, cwd, cold):
+    """
+    Returns (wall seconds of the interpreter, {module: (self us, cumulative us, depth)}).
+    """
+
+    if cold:
+        drop_caches()
+
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError('import {} failed:\n{}'.format(module, result.stderr[-2000:]))
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+
+    return wall, modules
+
+
+def median_of(runs, name, idx):
+    values = [modules[name][idx] for wall, modules in runs if name in modules]
+
+    return statistics.median(values) if values else 0
+
+
+def measure(args):
+    cwd = tempfile.mkdtemp(prefix='startup_')
+    run_once(args.module, cwd, False)  # compile the .pyc files once
+    runs = [run_once(args.module, cwd, args.drop_caches) for i in range(args.repeat)]
+
+    names = set()
+    for wall, modules in runs:
+        names.update(modules)
+    local = {os.path.splitext(f)[0] for f in os.listdir(REPO_DIR) if f.endswith('.py')}
+
+    table = {name: {'self_us': median_of(runs, name, 0), 'cumulative_us': median_of(runs, name, 1)}
+             for name in names}
+    top_level = [name for name in names if name.split('.')[0] in local or name.split('.')[0] in HEAVY]
+
+    return {
+        'wall_ms': statistics.median(wall for wall, modules in runs) * 1000,
+        'import_ms': table.get(args.module, {}).get('cumulative_us', 0) / 1000,
+        'modules': len(table),
+        'heavy_imported': sorted(h for h in HEAVY if h in names),
+        'slowest_self': sorted(([n, table[n]['self_us']] for n in names), key=lambda item: -item[1])[:args.top],
+        'project_cumulative': sorted(([n, table[n]['cumulative_us']] for n in top_level),
+                                     key=lambda item: -item[1])[:args.top],
+    }
+
+
+def compare(result, baseline):
+    print('{:28} {:>14} {:>14} {:>8}'.format('metric', 'baseline', 'current', 'ratio'))
+    for key in ['wall_ms', 'import_ms', 'modules']:
+        old = baseline['results'].get(key, 0)
+        new = result['results'].get(key, 0)
+        print('{:28} {:>14.2f} {:>14.2f} {:>8.2f}'.format(key, old, new, new / old if old else 0))
+    print('heavy imports: {} -> {}'.format(baseline['results']['heavy_imported'], result['results']['heavy_imported']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='thyme', help='module imported like thyme.py does at start')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15, help='modules listed')
+    parser.add_argument('--drop-caches', action='store_true', help='empty the page cache before each run (root)')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    args = parser.parse_args()
+
+    result = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'results': measure(args),
+    }
+
+    results = result['results']
+    print('interpreter {:.1f} ms, import {} {:.1f} ms, {} modules'.format(
+        results['wall_ms'], args.module, results['import_ms'], results['modules']))
+    print('heavy optional imports: {}'.format(', '.join(results['heavy_imported']) or 'none'))
+    print('{:40} {:>12}'.format('module (cumulative)', 'ms'))
+    for name, us in results['project_cumulative']:
+        print('{:40} {:>12.2f}'.format(name, us / 1000))
+    print('{:40} {:>12}'.format('module (self)', 'ms'))
+    for name, us in results['slowest_self']:
+        print('{:40} {:>12.2f}'.format(name, us / 1000))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(result, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Fleet load harness.
+
+ Runs the local CSE stand-in (local_cse.py) in this process and launches N nCube
+ instances (thyme.py --replay) against it, each in its own directory with its
+ own flight.json, approval entry, AE port, system id and synthetic FC stream
+ (bench/mavgen.py). Expects an MQTT broker at --broker for the local topics and
+ the CSE notifications. For each fleet size it reports the aggregate CIN rate,
+ the end-to-end latency per vehicle (aggregation timestamp of a frame to the
+ CIN arriving at the CSE) and the CPU and memory of each instance. --mode
+ session serves the whole fleet from one process (vehicle.py, vehicles.json)
+ to compare with one process per vehicle.
+
+    python3 bench/fleet.py --fleet 1,5,10,20 --duration 60 --rate 50 --output fleet.json
+    python3 bench/fleet.py --fleet 1,5,10,20 --mode session --output fleet_session.json
+"""
+
+import argparse, datetime, json, os, shutil, socket, subprocess, sys, tempfile, threading, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+WORK_DIR = tempfile.mkdtemp(prefix='fleet_')
+# conf reads flight.json in the working directory on import
+os.chdir(WORK_DIR)
+
+import mavgen
+import local_cse
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+lock = threading.Lock()
+latency = {}  # drone -> [seconds, ...]
+cin_count = {}  # drone -> CINs
+
+
+def observe(container, cin, received):
+    # /Mobius/<gcs>/Drone_Data/<drone>/<sortie>
+    path = container.split('/')
+    if len(path) < 6 or path[3] != 'Drone_Data' or not isinstance(cin.get('con'), dict):
+        return
+
+    drone = path[4]
+    ages = []
+    for key in cin['con']:
+        try:
+            ages.append(received - datetime.datetime.strptime(key + '000', '%Y-%m-%dT%H:%M:%S%f').timestamp())
+        except ValueError:
+            pass
+    with lock:
+        cin_count[drone] = cin_count.get(drone, 0) + 1
+        latency.setdefault(drone, []).extend(ages)
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def proc_usage(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as f:
+            stat = f.read().rsplit(')', 1)[1].split()
+        usage = {'cpu_s': (int(stat[11]) + int(stat[12])) / CLK_TCK}
+        with open('/proc/{}/status'.format(pid), 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:') or line.startswith('VmHWM:'):
+                    usage[line.split(':')[0].lower() + '_kb'] = int(line.split()[1])
+        with open('/proc/{}/io'.format(pid), 'r') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    usage['write_bytes'] = int(line.split()[1])
+        usage['threads'] = len(os.listdir('/proc/{}/task'.format(pid)))
+    except (OSError, PermissionError):
+        return None
+
+    return usage
+
+
+def broker_alive(host, port):
+    try:
+        socket.create_connection((host, port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def prepare(index, args):
+    """
+    Synthetic FC stream and approval entry of one vehicle. Returns (name, tlog path).
+    """
+
+    name = 'Fleet{:03d}'.format(index)
+    directory = os.path.join(WORK_DIR, name)
+    os.makedirs(directory, exist_ok=True)
+
+    sysid = index % 254 + 1
+    frames = mavgen.generate(args.duration, args.rate, sysid=sysid, arm_at=1.0, seed=index + 1)
+    tlog = os.path.join(directory, 'fc.tlog')
+    mavgen.write_tlog(tlog, frames)
+
+    drone_info = local_cse.default_drone_info(name, '127.0.0.1')
+    drone_info['system_id'] = sysid
+    local_cse.seed_approval(args.approval_gcs, name, drone_info)
+
+    return name, tlog
+
+
+def launch(index, name, tlog, args, extra=()):
+    # extra: (name, tlog) of the vehicles served by the same process (vehicles.json)
+    directory = os.path.join(WORK_DIR, name)
+    with open(os.path.join(directory, 'flight.json'), 'w') as f:
+        json.dump({'approval_gcs': args.approval_gcs, 'flight': name, 'approval_host': '127.0.0.1',
+                   'approval_port': args.cse_port, 'ae_port': args.ae_port + index}, f, indent='\t')
+    with open(os.path.join(directory, 'vehicles.json'), 'w') as f:
+        json.dump([{'flight': n, 'replay': t} for n, t in extra], f, indent='\t')
+
+    log_file = open(os.path.join(directory, 'thyme.log'), 'w')
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'thyme.py'), '--replay', tlog, '--loop'],
+                            cwd=directory, stdout=log_file, stderr=subprocess.STDOUT)
+
+    return name, proc, log_file
+
+
+def run(n, args):
+    fleet = [prepare(i, args) for i in range(n)]
+    if args.mode == 'session':
+        instances = [launch(0, fleet[0][0], fleet[0][1], args, fleet[1:])]
+    else:
+        instances = [launch(i, name, tlog, args) for i, (name, tlog) in enumerate(fleet)]
+
+    time.sleep(args.warmup)
+    with lock:
+        latency.clear()
+        cin_count.clear()
+    start_usage = {name: proc_usage(proc.pid) for name, proc, _ in instances}
+    started = time.time()
+
+    time.sleep(args.duration)
+
+    elapsed = time.time() - started
+    processes = {}
+    for name, proc, log_file in instances:
+        usage = proc_usage(proc.pid)
+        alive = proc.poll() is None and usage is not None and 'vmrss_kb' in usage
+        if alive and start_usage[name] is not None:
+            usage['cpu_pct'] = round(100 * (usage['cpu_s'] - start_usage[name]['cpu_s']) / elapsed, 1)
+        processes[name] = {'alive': alive, 'usage': usage}
+
+    vehicles = {}
+    for name, tlog in fleet:
+        with lock:
+            ages = list(latency.get(name, []))
+            cins = cin_count.get(name, 0)
+        vehicles[name] = {
+            'cin': cins,
+            'latency_p50_ms': None if len(ages) == 0 else round(percentile(ages, 50) * 1000, 1),
+            'latency_p99_ms': None if len(ages) == 0 else round(percentile(ages, 99) * 1000, 1),
+            'latency_max_ms': None if len(ages) == 0 else round(max(ages) * 1000, 1),
+        }
+
+    for name, proc, log_file in instances:
+        proc.terminate()
+    for name, proc, log_file in instances:
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log_file.close()
+
+    total = sum(v['cin'] for v in vehicles.values())
+    alive = [p['usage'] for p in processes.values() if p['alive']]
+    p99 = [v['latency_p99_ms'] for v in vehicles.values() if v['latency_p99_ms'] is not None]
+
+    return {
+        'vehicles': n,
+        'processes': len(instances),
+        'processes_alive': len(alive),
+        'cin_per_s': round(total / elapsed, 1),
+        'latency_p99_ms_worst': max(p99) if p99 else None,
+        'cpu_pct_total': round(sum(u.get('cpu_pct', 0) for u in alive), 1),
+        'rss_kb_total': sum(u['vmrss_kb'] for u in alive),
+        'rss_kb_per_vehicle': int(sum(u['vmrss_kb'] for u in alive) / n),
+        'per_vehicle': vehicles,
+        'per_process': processes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fleet', default='1,5,10,20', help='fleet sizes, comma separated')
+    parser.add_argument('--mode', default='process', choices=['process', 'session'],
+                        help='one process per vehicle, or one process serving all vehicles (vehicles.json)')
+    parser.add_argument('--duration', type=float, default=60, help='measured seconds per fleet size')
+    parser.add_argument('--warmup', type=float, default=15, help='seconds for approval and provisioning')
+    parser.add_argument('--rate', type=float, default=50, help='FC frames per second per vehicle')
+    parser.add_argument('--cse-port', type=int, default=17579)
+    parser.add_argument('--ae-port', type=int, default=19700, help='AE port of the first instance')
+    parser.add_argument('--approval-gcs', default='MUV')
+    parser.add_argument('--broker', default='127.0.0.1:1883')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency injected by the CSE stand-in')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='errors injected by the CSE stand-in')
+    parser.add_argument('--output', default='')
+    parser.add_argument('--keep', action='store_true', help='keep the instance directories')
+    args = parser.parse_args()
+
+    host, port = args.broker.split(':')
+    if not broker_alive(host, int(port)):
+        print('no MQTT broker at {}: the instances stop at the MQTT connection of provisioning'.format(args.broker))
+        sys.exit(1)
+
+    local_cse.observers.append(observe)
+    server = local_cse.start(args.cse_port, latency=args.latency, error_rate=args.error_rate, mqtt_host=host)
+
+    results = []
+    try:
+        for n in [int(x) for x in args.fleet.split(',')]:
+            result = run(n, args)
+            results.append(result)
+            print('{:>4} vehicles {:>3} processes  {:>8} CIN/s  p99 {} ms  cpu {}%  rss {} kB'.format(
+                n, result['processes_alive'], result['cin_per_s'], result['latency_p99_ms_worst'],
+                result['cpu_pct_total'], result['rss_kb_total']))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    report = {'mode': args.mode, 'rate': args.rate, 'duration': args.duration, 'cse_latency': args.latency, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
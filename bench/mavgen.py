@@ -0,0 +1,158 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Synthetic MAVLink stream of a flight controller.
+
+ Builds valid MAVLink v1/v2 frames (checksum with CRC_EXTRA, v2 payload
+ truncation) for the messages an ArduPilot FC streams to a companion computer,
+ at the usual stream rates scaled to a target frame rate, for a vehicle that
+ arms after a few seconds and flies a circle. A fraction of the frames can be
+ corrupted.
+
+    frames = generate(duration=60, rate=100, v2_ratio=0.5, corruption=0.01)
+    stream = b''.join(frame for t, frame in frames)
+
+ or, as a capture to replay with 'python3 thyme.py --replay flight.tlog':
+
+    python3 bench/mavgen.py flight.tlog --duration 600
+"""
+
+import argparse, math, random, struct, time
+
+# name: (msgid, crc_extra, struct format, stream rate in Hz)
+messages = {
+    'HEARTBEAT': (0, 50, '<IBBBBB', 1),
+    'SYS_STATUS': (1, 124, '<IIIHHhHHHHHHb', 2),
+    'SYSTEM_TIME': (2, 137, '<QI', 1),
+    'GPS_RAW_INT': (24, 24, '<QiiiHHHHBB', 2),
+    'ATTITUDE': (30, 39, '<Iffffff', 10),
+    'GLOBAL_POSITION_INT': (33, 104, '<IiiiihhhH', 5),
+    'VFR_HUD': (74, 20, '<ffffhH', 4),
+    'TIMESYNC': (111, 34, '<qq', 1),
+    'BATTERY_STATUS': (147, 154, '<iih10HhBBBb', 1)
+}
+
+
+def crc_accumulate(data, crc=0xffff):
+    for b in data:
+        tmp = b ^ (crc & 0xff)
+        tmp = (tmp ^ (tmp << 4)) & 0xff
+        crc = ((crc >> 8) ^ (tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xffff
+
+    return crc
+
+
+def pack_v1(seq, sysid, compid, msgid, crc_extra, payload):
+    header = struct.pack('<BBBBB', len(payload), seq, sysid, compid, msgid)
+    crc = crc_accumulate(bytes([crc_extra]), crc_accumulate(header + payload))
+
+    return b'\xfe' + header + payload + struct.pack('<H', crc)
+
+
+def pack_v2(seq, sysid, compid, msgid, crc_extra, payload):
+    payload = payload.rstrip(b'\x00') or payload[:1]
+    header = struct.pack('<BBBBBB', len(payload), 0, 0, seq, sysid, compid) + struct.pack('<I', msgid)[:3]
+    crc = crc_accumulate(bytes([crc_extra]), crc_accumulate(header + payload))
+
+    return b'\xfd' + header + payload + struct.pack('<H', crc)
+
+
+def fields(name, t, armed, rng):
+    lat = int((37.4036 + 0.0005 * math.sin(t / 30)) * 1e7)
+    lon = int((127.1029 + 0.0005 * math.cos(t / 30)) * 1e7)
+    relative_alt = int(20000 * min(1.0, t / 20)) if armed else 0
+    boot_ms = int(t * 1000) & 0xffffffff
+    battery = max(0, 100 - int(t / 36))
+
+    if name == 'HEARTBEAT':
+        return (4 if armed else 0, 2, 3, 0x59 | (0x80 if armed else 0), 4 if armed else 3, 3)
+    if name == 'SYS_STATUS':
+        return (0x2f, 0x2f, 0x2f, 300 + rng.randint(0, 50), 15800 - int(t), 1200, 0, 0, 0, 0, 0, 0, battery)
+    if name == 'SYSTEM_TIME':
+        return (int((1700000000 + t) * 1e6), boot_ms)
+    if name == 'GPS_RAW_INT':
+        return (int(t * 1e6), lat, lon, 50000 + relative_alt, 90, 120, 500, 9000, 3, 14)
+    if name == 'ATTITUDE':
+        return (boot_ms, 0.01 * rng.random(), 0.01 * rng.random(), t / 30 % (2 * math.pi) - math.pi,
+                0.001, 0.001, 0.001)
+    if name == 'GLOBAL_POSITION_INT':
+        return (boot_ms, lat, lon, 50000 + relative_alt, relative_alt, 500, 0, 0, int(t / 30 * 5729.6) % 36000)
+    if name == 'VFR_HUD':
+        return (5.0 if armed else 0.0, 5.0 if armed else 0.0, 50.0 + relative_alt / 1000, 0.0, int(t * 2) % 360,
+                55 if armed else 0)
+    if name == 'TIMESYNC':
+        return (0, int(t * 1e9))
+    if name == 'BATTERY_STATUS':
+        return (int(t * 3), int(t * 40), 3200, 3950, 3950, 3950, 3950, 65535, 65535, 65535, 65535, 65535, 65535,
+                1200, 0, 0, 1, battery)
+
+
+def corrupt(frame, rng):
+    kind = rng.randint(0, 2)
+    if kind == 0:  # bit error
+        idx = rng.randint(1, len(frame) - 1)
+        return frame[:idx] + bytes([frame[idx] ^ (1 << rng.randint(0, 7))]) + frame[idx + 1:]
+    if kind == 1:  # lost bytes
+        idx = rng.randint(1, len(frame) - 1)
+        return frame[:idx]
+
+    return bytes(rng.randint(0, 255) for i in range(rng.randint(1, 16))) + frame  # line noise
+
+
+def generate(duration=60.0, rate=0, v2_ratio=0.0, corruption=0.0, sysid=1, compid=1, arm_at=5.0, seed=1):
+    """
+    Returns a list of (time in seconds, bytes) in time order. rate is the target
+    number of frames per second (0 keeps the stream rates of the FC).
+    """
+
+    rng = random.Random(seed)
+    base_rate = sum(m[3] for m in messages.values())
+    scale = rate / base_rate if rate > 0 else 1.0
+
+    schedule = []
+    for name, (msgid, crc_extra, fmt, hz) in messages.items():
+        period = 1.0 / (hz * scale)
+        t = rng.random() * period
+        while t < duration:
+            schedule.append((t, name))
+            t += period
+    schedule.sort()
+
+    frames = []
+    seq = 0
+    for t, name in schedule:
+        msgid, crc_extra, fmt, hz = messages[name]
+        payload = struct.pack(fmt, *fields(name, t, t >= arm_at, rng))
+        if rng.random() < v2_ratio:
+            frame = pack_v2(seq, sysid, compid, msgid, crc_extra, payload)
+        else:
+            frame = pack_v1(seq, sysid, compid, msgid, crc_extra, payload)
+        if corruption > 0 and rng.random() < corruption:
+            frame = corrupt(frame, rng)
+        frames.append((t, frame))
+        seq = (seq + 1) & 0xff
+
+    return frames
+
+
+def write_tlog(path, frames, start=None):
+    if start is None:
+        start = time.time()
+
+    with open(path, 'wb') as f:
+        for t, frame in frames:
+            f.write(struct.pack('>Q', int((start + t) * 1e6)) + frame)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help='tlog file')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--rate', type=float, default=0)
+    parser.add_argument('--v2', type=float, default=0.0)
+    parser.add_argument('--corruption', type=float, default=0.0)
+    parser.add_argument('--sysid', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    write_tlog(args.output, generate(args.duration, args.rate, args.v2, args.corruption, args.sysid, seed=args.seed))
@@ -14,32 +14,49 @@ ae = {}
 cnt_arr = []
 sub_arr = []
 acp = {}
+route_arr = []
+upload = {}
+spool = {}
+log = {}
+capture = {}
+replay = {}
+recorder = {}
+vehicles = []
+muv = {}
+rollup = {}
+ledger = {}
+cache = {}
+clock = {}
+trace = {}
+profiler = {}
+early = {}
 
 conf["useprotocol"] = 'http'  # select one for 'http' or 'mqtt' or 'coap' or 'ws'
 
 # build cse
 
+ae_name = {}
+flight_missing = False
+try:
+    with open('./flight.json', 'r') as f:
+        ae_name = json.load(f)
+except:
+    ae_name["approval_gcs"] = 'MUV'
+    ae_name["flight"] = 'Dione'
+    flight_missing = True
+
+# "approval_host", "approval_port" and "ae_port" of flight.json point an instance to a local CSE (local_cse.py)
 approval_host = dict()
-approval_host["ip"] = '203.253.128.177'
+approval_host["ip"] = ae_name.get("approval_host", '203.253.128.177')
 
 cse["host"] = approval_host["ip"]
-cse["port"] = '7579'
+cse["port"] = str(ae_name.get("approval_port", '7579'))
 cse["name"] = 'Mobius'
 cse["id"] = '/Mobius2'
 cse["mqttport"] = '1883'
 cse["wsport"] = '7577'
 
 # build ae
-ae_name = {}
-try:
-    with open('./flight.json', 'r') as f:
-        ae_name = json.load(f)
-except:
-    ae_name["approval_gcs"] = 'MUV'
-    ae_name["flight"] = 'Dione'
-    with open('./flight.json', 'w', encoding='utf-8') as f:
-        json.dump(ae_name, f, indent="\t")
-
 ae["approval_gcs"] = ae_name["approval_gcs"]
 ae["name"] = ae_name["flight"]
 
@@ -47,7 +64,7 @@ ae["id"] = 'S' + ae["name"]
 
 ae["parent"] = '/' + cse["name"]
 ae["appid"] = str(uuid.uuid1())
-ae["port"] = '9727'
+ae["port"] = str(ae_name.get("ae_port", '9727'))
 ae["bodytype"] = 'json'  # select 'json' or 'xml' or 'cbor
 ae["tas_mav_port"] = '3105'
 ae["tas_sec_port"] = '3105'
@@ -106,6 +123,136 @@ count = 0
 # sub_arr[count++].nu = 'mqtt://' + cse.host + '/' + ae.id + '?ct=json' mqtt
 # -------- */
 
+# build route
+# sysid: number, list, 'self' (system_id of approval) or '*'
+# compid, msgid: number, list or '*'
+# sink: 'mqtt' (raw frame to GCS), 'mobius' (aggregated CIN), 'local' (decoder for MUV topics)
+route_arr.append({'sysid': 'self', 'compid': '*', 'msgid': '*', 'sink': ['mqtt', 'mobius', 'local']})
+route_arr.append({'sysid': '*', 'compid': '*', 'msgid': '*', 'sink': ['mqtt']})
+
+# build msw upload
+# batch: container path -> window (seconds) merging MSW messages into one CIN
+msw_upload = {}
+msw_upload["workers"] = 2
+msw_upload["queue_size"] = 1000
+msw_upload["batch"] = {}
+
+# build upload
+# priority: lower is served first, max_age: seconds before a queued write is dropped (0: never)
+upload["control"] = {'priority': 0, 'concurrency': 2, 'queue_size': 100, 'max_age': 0}
+upload["telemetry"] = {'priority': 1, 'concurrency': 2, 'queue_size': 50, 'max_age': 5}
+upload["msw"] = {'priority': 2, 'concurrency': 2, 'queue_size': 500, 'max_age': 0}
+
+# build spool
+# CIN writes failed by network error are kept in spool["path"] and sent again when the CSE answers
+# commit_rows, commit_interval: writes committed in one transaction (a crash loses at most these)
+spool["enable"] = True
+spool["path"] = './spool.db'
+spool["max_rows"] = 20000
+spool["max_bytes"] = 50 * 1024 * 1024
+spool["max_age"] = 24 * 60 * 60
+spool["commit_rows"] = 50
+spool["commit_interval"] = 1
+spool["batch"] = 100
+spool["concurrency"] = 4
+spool["retry"] = 5
+
+# build log
+# level: 'debug', 'info', 'warning' or 'error', file: '' for stdout
+# verbose: dump request and response bodies of http_adn
+log["level"] = 'info'
+log["file"] = ''
+log["verbose"] = False
+log["rate_interval"] = 10
+log["rate_burst"] = 5
+log["queue_size"] = 10000
+
+# build capture
+# enable: record the frames of the FC in capture["path"] as tlog files
+# raw: also record the bytes read from the FC, before the framer, as .mavraw files (only nCube replays them)
+capture["enable"] = False
+capture["raw"] = False
+capture["path"] = './capture'
+
+# build replay: set by 'python3 thyme.py --replay <capture or tlog>'
+# the frames of a tlog, or the reads of a .mavraw, are fed to the TAS instead of the serial port
+replay["path"] = ''
+replay["realtime"] = True
+replay["loop"] = False
+
+# build recorder
+# enable: record every frame of the FC in memory-mapped segments of recorder["path"] per sortie
+recorder["enable"] = False
+recorder["path"] = './flight_log'
+recorder["segment_size"] = 16 * 1024 * 1024
+recorder["flush_interval"] = 5
+
+# build muv
+# encoding of the decoded telemetry on the local MUV topics: 'json' or 'struct' (see muv_codec.py)
+muv["encoding"] = 'json'
+muv["schema_topic"] = 'schema'
+# delta: publish only the changed fields, with a full keyframe every keyframe_interval seconds (json only)
+muv["delta"] = False
+muv["keyframe_interval"] = 10
+muv["delta_ignore"] = {'time_boot_ms'}
+
+# build rollup
+# enable: post [min, max, mean, last] of position, altitude, speed and battery every window seconds
+# as one CIN to <Drone_Data>/<drone>/<container> (see rollup.py)
+rollup["enable"] = False
+rollup["window"] = 1
+rollup["container"] = 'rollup'
+
+# build ledger
+# flight time of each vehicle, kept here and synced to Life_Prediction/History in the background
+ledger["path"] = './flight_ledger.json'
+ledger["retry_interval"] = 5
+
+# build cache
+# enable: keep the answers of rtvae/rtvct for ttl seconds, up to max_entries paths (least recently used out)
+# a create, update or delete of this process under a path drops the cached answers of the path
+cache["enable"] = False
+cache["ttl"] = 5
+cache["max_entries"] = 256
+
+# build clock
+# window: seconds of frames the offset to the time_boot_ms of the autopilot is estimated from
+# aggr_time: key of the frames aggregated to Mobius, 'receive' (serial read) or 'fc' (sampled by the autopilot)
+clock["window"] = 10
+clock["aggr_time"] = 'receive'
+
+# build trace
+# enable: follow rate of the frames from the serial read to the CIN of their window (see frame_trace.py)
+# per-stage histograms on the metrics endpoint, the histograms and the latest keep traces in path at exit
+trace["enable"] = False
+trace["rate"] = 0.01
+trace["keep"] = 1000
+trace["path"] = './trace.json'
+
+# build profiler
+# sampling profiler toggled by the signal or by 'start'/'stop' on the topic of the local broker (see profiler.py)
+profiler["signal"] = 'SIGUSR2'
+profiler["topic"] = '/nCube/profiler'
+profiler["interval"] = 0.01
+profiler["depth"] = 64
+profiler["max_seconds"] = 300
+profiler["path"] = './profile'
+
+# build early
+# enable: open the FC link and publish the local MUV topics at boot with the approval cached in approval_cache,
+# before the CSE is provisioned; the frames of the remote MQTT and Mobius sinks wait until it is
+# policy: 'flush' sends the waiting frames (up to max_frames, not older than max_age seconds), 'drop' drops them
+early["enable"] = True
+early["approval_cache"] = './approval_cache.json'
+early["policy"] = 'flush'
+early["max_frames"] = 20000
+early["max_age"] = 60
+
+# build vehicles
+# more flight controllers served by this process besides the one of flight.json (see vehicle.py)
+# {'flight': approval name, 'port': serial port, 'baudrate': baudrate, 'replay': tlog fed instead of the port}
+# read from ./vehicles.json by init()
+
 # build acp: not complete
 acp["parent"] = '/' + cse["name"] + '/' + ae["name"]
 acp["name"] = 'acp-' + ae["name"]
@@ -116,8 +263,41 @@ conf["usesecure"] = 'disable'
 if conf["usesecure"] == 'enable':
     cse["mqttport"] = '8883'
 
+
+def init():
+    # writes the default flight.json for the user to edit, when there is none, and reads ./vehicles.json
+    global flight_missing
+
+    if flight_missing:
+        with open('./flight.json', 'w', encoding='utf-8') as f:
+            json.dump({"approval_gcs": ae["approval_gcs"], "flight": ae["name"]}, f, indent="\t")
+        flight_missing = False
+
+    try:
+        with open('./vehicles.json', 'r') as f:
+            vehicles[:] = json.load(f)
+    except FileNotFoundError:
+        pass
+
 conf["cse"] = cse
 conf["ae"] = ae
 conf["cnt"] = cnt_arr
 conf["sub"] = sub_arr
 conf["acp"] = acp
+conf["route"] = route_arr
+conf["msw_upload"] = msw_upload
+conf["upload"] = upload
+conf["spool"] = spool
+conf["log"] = log
+conf["capture"] = capture
+conf["replay"] = replay
+conf["recorder"] = recorder
+conf["vehicles"] = vehicles
+conf["muv"] = muv
+conf["rollup"] = rollup
+conf["ledger"] = ledger
+conf["cache"] = cache
+conf["clock"] = clock
+conf["trace"] = trace
+conf["profiler"] = profiler
+conf["early"] = early
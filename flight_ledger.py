@@ -0,0 +1,204 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Local ledger of the flight time of each vehicle.
+
+ A disarm adds the arming time to the ledger at once and persists it
+ (conf["ledger"]["path"], replaced atomically). The entry is then posted in the
+ background to /Mobius/Life_Prediction/History/<flight> as before:
+
+    {"total_flight_time": 5400, "arming_time": 600, "sortie_name": "2024-05-01T10:00:00000"}
+
+ Entries wait in the ledger until the CSE accepts them, so nothing is lost
+ while it is unreachable. The la CIN of the CSE is only read at startup by
+ reconcile(), which adopts the remote total when it is ahead of the ledger. Its
+ con is kept in the ledger, and each entry is posted merged into the last con,
+ so the other fields of the History CIN carry on from one sortie to the next.
+"""
+
+import json, os, threading
+
+import conf
+import http_adn
+import muv_log
+
+log = muv_log.get_logger('flight_ledger')
+
+HISTORY = '/Mobius/Life_Prediction/History'
+
+lock = threading.Lock()
+wakeup = threading.Event()
+ledger = None  # flight name -> {total_flight_time, sorties, synced, con, pending: [entry, ...]}
+sync_thread = None
+
+
+def load():
+    global ledger
+
+    with lock:
+        if ledger is not None:
+            return
+        try:
+            with open(conf.conf['ledger']['path'], 'r') as f:
+                ledger = json.load(f)
+        except FileNotFoundError:
+            ledger = {}
+        except ValueError as e:
+            log.error('ledger %s is broken, starting a new one: %s', conf.conf['ledger']['path'], e)
+            os.replace(conf.conf['ledger']['path'], conf.conf['ledger']['path'] + '.broken')
+            ledger = {}
+
+
+def save():
+    # called with the lock held
+    path = conf.conf['ledger']['path']
+    with open(path + '.tmp', 'w') as f:
+        json.dump(ledger, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def account(name):
+    # called with the lock held
+    entry = ledger.get(name)
+    if entry is None:
+        entry = ledger[name] = {'total_flight_time': 0, 'sorties': 0, 'synced': 0, 'pending': []}
+
+    return entry
+
+
+def total(name):
+    load()
+    with lock:
+        return account(name)['total_flight_time']
+
+
+def record(name, sortie_name, arming_time):
+    """
+    Adds a sortie of the vehicle. Returns its total flight time in seconds.
+    """
+
+    load()
+    with lock:
+        entry = account(name)
+        entry['total_flight_time'] += arming_time
+        entry['sorties'] += 1
+        entry['pending'].append({'total_flight_time': entry['total_flight_time'], 'arming_time': arming_time,
+                                 'sortie_name': sortie_name})
+        save()
+        result = entry['total_flight_time']
+
+    log.info('%s: sortie %s %d s, total %d s', name, sortie_name, arming_time, result)
+    # the sync starts with tas_ready(), once the CSE of the approval is provisioned
+    if sync_thread is not None:
+        wakeup.set()
+
+    return result
+
+
+def reconcile(name):
+    """
+    Reads the la CIN of the vehicle once and adopts its total when it is ahead
+    of the ledger (flights recorded by another companion computer).
+    """
+
+    load()
+    rsc, res_body, count = http_adn.rtvct(HISTORY + '/' + name + '/la', 0, refresh=True)
+    if rsc == 4004:
+        return True
+    if rsc != 2000:
+        return False
+
+    con = res_body['m2m:cin']['con']
+    remote = con.get('total_flight_time', 0)
+    with lock:
+        entry = account(name)
+        entry['con'] = con
+        if remote > entry['synced']:
+            ahead = remote - entry['synced']
+            entry['synced'] = remote
+            entry['total_flight_time'] += ahead
+            for pending in entry['pending']:
+                pending['total_flight_time'] += ahead
+            log.info('%s: CSE is %d s ahead, total %d s', name, ahead, entry['total_flight_time'])
+        elif remote < entry['synced']:
+            log.warning('%s: CSE total %d s is behind the ledger %d s', name, remote, entry['synced'])
+        save()
+
+    return True
+
+
+def sync_one(name):
+    """
+    Posts the oldest pending entry of the vehicle. Returns False when the CSE did not take it.
+    """
+
+    with lock:
+        pending = ledger[name]['pending']
+        if len(pending) == 0:
+            return True
+        cin = dict(ledger[name].get('con') or {})
+        cin.update(pending[0])
+
+    # the ledger keeps the entry until the CSE takes it, so it does not go to the spool too
+    rsc, res_body, parent, socket = http_adn.crtci(HISTORY + '/' + name + '?rcn=0', 0, cin, None, 'control', False)
+    if rsc == 4004:
+        http_adn.crtct(HISTORY + '?rcn=0', name, 0)
+        rsc, res_body, parent, socket = http_adn.crtci(HISTORY + '/' + name + '?rcn=0', 0, cin, None, 'control',
+                                                       False)
+    if rsc != 2001:
+        return False
+
+    with lock:
+        entry = ledger[name]
+        if len(entry['pending']) > 0 and entry['pending'][0]['sortie_name'] == cin['sortie_name']:
+            entry['pending'].pop(0)
+        entry['synced'] = max(entry['synced'], cin['total_flight_time'])
+        entry['con'] = cin
+        save()
+
+    return True
+
+
+def sync_loop():
+    reconciled = set()
+    while True:
+        wakeup.clear()
+        retry = False
+        with lock:
+            names = list(ledger.keys())
+        for name in names:
+            try:
+                if name not in reconciled:
+                    if not reconcile(name):
+                        retry = True
+                        continue
+                    reconciled.add(name)
+                while len(ledger[name]['pending']) > 0:
+                    if not sync_one(name):
+                        retry = True
+                        break
+            except Exception as e:
+                log.warning('%s: sync: %s', name, e)
+                retry = True
+
+        wakeup.wait(conf.conf['ledger']['retry_interval'] if retry else None)
+
+
+def start(name=None):
+    """
+    Starts the background sync; name adds a vehicle to reconcile at startup.
+    """
+
+    global sync_thread
+
+    load()
+    with lock:
+        if name is not None:
+            account(name)
+        if sync_thread is not None:
+            wakeup.set()
+            return
+        sync_thread = threading.Thread(target=sync_loop, name='flight_ledger', daemon=True)
+    sync_thread.start()
@@ -0,0 +1,303 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Index and query of the flight recorder segments.
+
+ Each segment gets a sidecar index (<segment>.idx) when the recorder closes it,
+ or on the first query if it has none (e.g. after a crash). The index holds
+ the offsets of the records of each msgid and the offset of the first record of
+ each time bucket, so a query maps the segment and reads only the matching
+ records.
+
+ index: header + bucket offsets (uint32) + (msgid, count) pairs (uint32) + record offsets (uint32) of each msgid
+
+    python3 flight_log.py list
+    python3 flight_log.py query 2021-06-01T10-12-3012 --msg GLOBAL_POSITION_INT --start 1622513550 --end 1622513600
+    python3 flight_log.py query disarm --msg HEARTBEAT --columns
+    python3 flight_log.py index flight_log/disarm.0000.seg
+"""
+
+import argparse, array, bisect, datetime, glob, mmap, os, struct, sys
+
+import conf
+import flight_recorder
+from pymavlinklib import common
+
+INDEX_MAGIC = b'NCFI'
+INDEX_VERSION = 1
+# magic, version, bucket length (us), first time, number of buckets, number of msgids, segment length
+INDEX_HEADER = struct.Struct('<4sHxxQqIIQ')
+BUCKET_US = 1000000
+
+msg_name = {msgid: name for name, msgid in common.mavlink.items() if isinstance(msgid, int)}
+
+
+def frame_msgid(frame):
+    if frame[0] == 0xfd:
+        return frame[7] | (frame[8] << 8) | (frame[9] << 16)
+
+    return frame[5]
+
+
+def frame_payload(frame):
+    if frame[0] == 0xfd:
+        return frame[10:10 + frame[1]]
+
+    return frame[6:6 + frame[1]]
+
+
+def records(mm, start, end):
+    """
+    Yields (offset, time, frame) of the records in [start, end) of a mapped segment.
+    """
+
+    offset = start
+    while offset + flight_recorder.RECORD.size <= end:
+        received, length = flight_recorder.RECORD.unpack_from(mm, offset)
+        if length == 0:
+            break
+        frame_start = offset + flight_recorder.RECORD.size
+        yield offset, received, mm[frame_start:frame_start + length]
+        offset = frame_start + length
+
+
+def read_header(mm):
+    magic, version, header_size, size, committed, count, first_time, last_time, sortie = \
+        flight_recorder.HEADER.unpack_from(mm, 0)
+    if magic != flight_recorder.MAGIC:
+        raise ValueError('not a flight recorder segment')
+
+    return {'size': size, 'committed': min(committed, len(mm)), 'count': count, 'first_time': first_time,
+            'last_time': last_time, 'sortie': sortie.rstrip(b'\x00').decode('utf-8')}
+
+
+def build_index(path, bucket_us=BUCKET_US):
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = read_header(mm)
+            first_time = header['first_time']
+            buckets = array.array('I')
+            offsets = {}
+            end = flight_recorder.HEADER_SIZE
+            for offset, received, frame in records(mm, flight_recorder.HEADER_SIZE, header['committed']):
+                if len(frame) < 6 or frame[0] not in (0xfe, 0xfd):
+                    break  # torn record after a crash
+                bucket = (received - first_time) // bucket_us
+                while len(buckets) <= bucket:
+                    buckets.append(offset)
+                msgid = frame_msgid(frame)
+                if offsets.get(msgid) is None:
+                    offsets[msgid] = array.array('I')
+                offsets[msgid].append(offset)
+                end = offset + flight_recorder.RECORD.size + len(frame)
+        finally:
+            mm.close()
+
+    with open(path + '.idx.tmp', 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, bucket_us, first_time, len(buckets), len(offsets), end))
+        f.write(buckets.tobytes())
+        for msgid in sorted(offsets):
+            f.write(struct.pack('<II', msgid, len(offsets[msgid])))
+        for msgid in sorted(offsets):
+            f.write(offsets[msgid].tobytes())
+    os.replace(path + '.idx.tmp', path + '.idx')
+
+
+def load_index(path):
+    if not os.path.exists(path + '.idx'):
+        build_index(path)
+
+    with open(path + '.idx', 'rb') as f:
+        data = f.read()
+
+    magic, version, bucket_us, first_time, bucket_count, msgid_count, end = INDEX_HEADER.unpack_from(data, 0)
+    if magic != INDEX_MAGIC:
+        raise ValueError('not a flight log index')
+
+    pos = INDEX_HEADER.size
+    buckets = array.array('I', data[pos:pos + bucket_count * 4])
+    pos += bucket_count * 4
+    counts = []
+    for i in range(msgid_count):
+        counts.append(struct.unpack_from('<II', data, pos))
+        pos += 8
+    offsets = {}
+    for msgid, count in counts:
+        offsets[msgid] = array.array('I', data[pos:pos + count * 4])
+        pos += count * 4
+
+    return {'bucket_us': bucket_us, 'first_time': first_time, 'end': end, 'buckets': buckets, 'offsets': offsets}
+
+
+def segments(sortie, log_dir=None):
+    if log_dir is None:
+        log_dir = conf.conf['recorder']['path']
+
+    return sorted(glob.glob(os.path.join(log_dir, glob.escape(flight_recorder.file_prefix(sortie)) + '.*.seg')))
+
+
+def sorties(log_dir=None):
+    if log_dir is None:
+        log_dir = conf.conf['recorder']['path']
+
+    result = {}
+    for path in sorted(glob.glob(os.path.join(log_dir, '*.seg'))):
+        result.setdefault(os.path.basename(path).rsplit('.', 2)[0], []).append(path)
+
+    return result
+
+
+def query_segment(path, msgid=None, start=None, end=None):
+    index = load_index(path)
+    bucket_us = index['bucket_us']
+    buckets = index['buckets']
+
+    first = flight_recorder.HEADER_SIZE
+    last = index['end']
+    if start is not None and len(buckets) > 0:
+        bucket = (start - index['first_time']) // bucket_us
+        if bucket >= len(buckets):
+            return
+        first = buckets[max(0, bucket)]
+    if end is not None and len(buckets) > 0:
+        bucket = (end - index['first_time']) // bucket_us + 1
+        if bucket < 0:
+            return
+        if bucket < len(buckets):
+            last = buckets[bucket]
+
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if msgid is None:
+                candidates = records(mm, first, last)
+            else:
+                offsets = index['offsets'].get(msgid, array.array('I'))
+                lo = bisect.bisect_left(offsets, first)
+                hi = bisect.bisect_left(offsets, last)
+                candidates = (read_record(mm, offset) for offset in offsets[lo:hi])
+
+            for offset, received, frame in candidates:
+                if start is not None and received < start:
+                    continue
+                if end is not None and received > end:
+                    if msgid is None:
+                        break
+                    continue
+                yield received, frame
+        finally:
+            mm.close()
+
+
+def read_record(mm, offset):
+    received, length = flight_recorder.RECORD.unpack_from(mm, offset)
+    frame_start = offset + flight_recorder.RECORD.size
+
+    return offset, received, mm[frame_start:frame_start + length]
+
+
+def query(sortie, msg=None, start=None, end=None, log_dir=None):
+    """
+    Yields (time in microseconds since the epoch, frame bytes) of a sortie.
+    msg is a message name or msgid, start and end are microseconds since the epoch.
+    """
+
+    msgid = msg
+    if isinstance(msg, str):
+        msgid = common.mavlink[msg]
+
+    for path in segments(sortie, log_dir):
+        for received, frame in query_segment(path, msgid, start, end):
+            yield received, frame
+
+
+def decode(name, payload):
+    fmt, fields = common.payload[name]
+    size = struct.calcsize(fmt)
+    if len(payload) < size:  # MAVLink 2 truncates trailing zero bytes
+        payload = bytes(payload) + bytes(size - len(payload))
+    values = struct.unpack_from(fmt, payload)
+
+    result = {}
+    idx = 0
+    for field in fields:
+        if field.endswith(']'):
+            field, count = field[:-1].split('[')
+            result[field] = list(values[idx:idx + int(count)])
+            idx += int(count)
+        else:
+            result[field] = values[idx]
+            idx += 1
+
+    return result
+
+
+def columns(sortie, msg, start=None, end=None, log_dir=None):
+    """
+    Returns {'time': [...], field: [...]} of the decoded messages of a sortie.
+    """
+
+    result = {'time': []}
+    for field in common.payload[msg][1]:
+        result[field.split('[')[0]] = []
+
+    for received, frame in query(sortie, msg, start, end, log_dir):
+        result['time'].append(received)
+        for field, value in decode(msg, frame_payload(frame)).items():
+            result[field].append(value)
+
+    return result
+
+
+def parse_time(value):
+    if value is None:
+        return None
+    try:
+        return int(float(value) * 1e6)
+    except ValueError:
+        return int(datetime.datetime.fromisoformat(value).timestamp() * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=None, help='directory of the segments (default: conf recorder path)')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('list')
+    query_parser = commands.add_parser('query')
+    query_parser.add_argument('sortie')
+    query_parser.add_argument('--msg', default=None, help='message name, e.g. GLOBAL_POSITION_INT')
+    query_parser.add_argument('--start', default=None, help='epoch seconds or ISO time')
+    query_parser.add_argument('--end', default=None, help='epoch seconds or ISO time')
+    query_parser.add_argument('--columns', action='store_true', help='print decoded fields as CSV')
+    index_parser = commands.add_parser('index')
+    index_parser.add_argument('segment', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for sortie, paths in sorties(args.dir).items():
+            print('{}\t{} segments'.format(sortie, len(paths)))
+    elif args.command == 'index':
+        for path in args.segment:
+            build_index(path)
+    elif args.command == 'query':
+        start = parse_time(args.start)
+        end = parse_time(args.end)
+        if args.columns:
+            if args.msg is None:
+                parser.error('--columns needs --msg')
+            result = columns(args.sortie, args.msg, start, end, args.dir)
+            names = list(result)
+            print(','.join(names))
+            for row in zip(*[result[name] for name in names]):
+                print(','.join(str(value) for value in row))
+        else:
+            for received, frame in query(args.sortie, args.msg, start, end, args.dir):
+                print('{}\t{}\t{}'.format(received, msg_name.get(frame_msgid(frame), frame_msgid(frame)),
+                                          bytes(frame).hex()))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
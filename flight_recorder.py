@@ -0,0 +1,237 @@
+# -*-coding:utf-8 -*-
+
+"""
+ On-board flight recorder.
+
+ Every MAVLink frame is appended to preallocated, memory-mapped segment files
+ named after the sortie (http_app.my_sortie_name), so recording costs a copy into
+ memory on the serial thread and the kernel writes the pages back. A segment
+ starts with a header holding the committed length; it is updated after each
+ record, so a crash of the process can only lose the record being written. The
+ pages are not synced after each record: a power loss loses what the kernel had
+ not written back yet, at most flush_interval seconds.
+
+ The recorder rotates to a new segment when one is full and when the sortie
+ changes. The next segment file is preallocated and mapped ahead by a background
+ thread (SPARE_NAME in recorder["path"]), so a rotation on the serial thread only
+ renames it and writes its header.
+
+ segment: header (HEADER_SIZE bytes) + records
+ record: time (int64, microseconds since the epoch) + length (uint16) + frame
+
+ flight_log.py indexes closed segments and queries them.
+"""
+
+import atexit, mmap, os, queue, struct, threading, time
+
+import conf
+import muv_log
+import flight_log
+
+log = muv_log.get_logger('recorder')
+
+MAGIC = b'NCFR'
+VERSION = 1
+HEADER_SIZE = 128
+# magic, version, header size, segment size, committed offset, frame count, first time, last time, sortie
+HEADER = struct.Struct('<4sHHQQQqq32s')
+# committed offset, frame count, first time, last time
+COMMITTED = struct.Struct('<QQqq')
+COMMITTED_OFFSET = 16
+RECORD = struct.Struct('<qH')
+SPARE_NAME = 'spare.tmp'
+
+lock = threading.Lock()
+segment = None
+spare = None  # preallocated and mapped next segment file, waiting for its sortie
+rotate_work = queue.Queue()  # segments to close, None to prepare the spare
+time_base = 0  # wall clock - monotonic clock, in microseconds
+
+
+def file_prefix(sortie):
+    return sortie.replace(':', '-').replace('/', '_')
+
+
+def preallocate(path, size):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+        mm = mmap.mmap(fd, size)
+        if hasattr(os, 'preadv'):
+            # the first write fault of a new mapping takes milliseconds; take it here (reading the
+            # zeros of the file into its header releases the GIL), not on the serial thread
+            with memoryview(mm) as view, view[:HEADER_SIZE] as header:
+                os.preadv(fd, [header], 0)
+    finally:
+        os.close(fd)
+
+    return mm
+
+
+class Segment:
+    def __init__(self, path, sortie, mm):
+        self.path = path
+        self.sortie = sortie
+        self.size = len(mm)
+        self.offset = HEADER_SIZE
+        self.count = 0
+        self.first_time = 0
+        self.mm = mm
+
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, HEADER_SIZE, self.size, self.offset, 0, 0, 0,
+                         sortie.encode('utf-8')[:32])
+
+    def append(self, received, frame):
+        end = self.offset + RECORD.size + len(frame)
+        if end > self.size:
+            return False
+
+        RECORD.pack_into(self.mm, self.offset, received, len(frame))
+        self.mm[self.offset + RECORD.size:end] = frame
+        if self.count == 0:
+            self.first_time = received
+        self.offset = end
+        self.count += 1
+        COMMITTED.pack_into(self.mm, COMMITTED_OFFSET, end, self.count, self.first_time, received)
+
+        return True
+
+    def flush(self):
+        try:
+            self.mm.flush()
+        except (ValueError, OSError):  # closed by rotation
+            pass
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        # give back the preallocated space that was not used
+        os.truncate(self.path, self.offset)
+        try:
+            flight_log.build_index(self.path)
+        except Exception as e:
+            log.warning('index of %s: %s', self.path, e)
+
+
+def segment_path(sortie, seq):
+    return os.path.join(conf.conf['recorder']['path'], '{}.{:04d}.seg'.format(file_prefix(sortie), seq))
+
+
+def spare_path():
+    return os.path.join(conf.conf['recorder']['path'], SPARE_NAME)
+
+
+def open_segment(sortie):
+    # called with lock held
+    global spare
+
+    size = int(conf.conf['recorder']['segment_size'])
+    seq = 0
+    while os.path.exists(segment_path(sortie, seq)):
+        seq += 1
+    path = segment_path(sortie, seq)
+
+    if spare is not None and len(spare) != size:  # segment_size changed
+        spare.close()
+        spare = None
+    if spare is not None:
+        mm = spare
+        spare = None
+        os.rename(spare_path(), path)
+    else:
+        # the spare is not ready yet (first segment, or rotations faster than the preallocation)
+        mm = preallocate(path, size)
+    rotate_work.put(None)
+
+    return Segment(path, sortie, mm)
+
+
+def prepare_spare():
+    global spare
+
+    with lock:
+        if spare is not None:
+            return
+    try:
+        mm = preallocate(spare_path(), int(conf.conf['recorder']['segment_size']))
+    except OSError as e:
+        log.warning('preallocation of %s: %s', spare_path(), e)
+        return
+    with lock:
+        spare = mm
+
+
+def rotate_loop():
+    # writing back a full segment and preallocating the next one take a while on an SD card;
+    # keep them off the serial thread
+    while True:
+        old = rotate_work.get()
+        try:
+            if old is None:
+                prepare_spare()
+            else:
+                old.close()
+        except Exception as e:
+            log.warning('rotation: %s', e)
+        finally:
+            rotate_work.task_done()
+
+
+def start():
+    global time_base
+
+    os.makedirs(conf.conf['recorder']['path'], exist_ok=True)
+    time_base = int(time.time() * 1e6) - int(time.monotonic() * 1e6)
+    # the first segment is ready before the first frame
+    prepare_spare()
+
+    t = threading.Thread(target=flush_loop, name='recorder', daemon=True)
+    t.start()
+    t = threading.Thread(target=rotate_loop, name='recorder-rotate', daemon=True)
+    t.start()
+    atexit.register(stop)
+
+
+def record(sortie, received, frame):
+    # received: time.monotonic() of the serial read, frame: bytes of one MAVLink frame
+    global segment
+
+    received = time_base + int(received * 1e6)
+    with lock:
+        if segment is None or segment.sortie != sortie:
+            old = segment
+            segment = open_segment(sortie)
+            if old is not None:
+                rotate_work.put(old)
+
+        if not segment.append(received, frame):
+            old = segment
+            segment = open_segment(sortie)
+            rotate_work.put(old)
+            segment.append(received, frame)
+
+
+def flush_loop():
+    while True:
+        time.sleep(conf.conf['recorder']['flush_interval'])
+        current = segment
+        if current is not None:
+            current.flush()
+
+
+def stop():
+    global segment, spare
+
+    # let the closes and the preallocation queued by the last rotations finish
+    rotate_work.join()
+    with lock:
+        if segment is not None:
+            segment.close()
+            segment = None
+        if spare is not None:
+            spare.close()
+            spare = None
+            os.remove(spare_path())
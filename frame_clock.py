@@ -0,0 +1,138 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Receive time of the MAVLink frames and the clock of the flight controller.
+
+ The framer stamps every frame with time.monotonic() of the serial read. The
+ aggregation of the Mobius topics maps it to the wall clock with one
+ time.time() per window, and timestamp() formats the keys with one strftime per
+ second:
+
+    2024-05-01T10:00:00123  (what datetime.now().strftime('%Y-%m-%dT%H:%M:%S%f')[:-3] gives)
+
+ FcClock of each vehicle estimates the offset between the monotonic clock and
+ the time_boot_ms of the autopilot from ATTITUDE, GLOBAL_POSITION_INT,
+ SYSTEM_TIME and TIMESYNC sent by the autopilot (component 1) of the vehicle
+ only, not by a gimbal, a companion computer or the GCS. The offset is the
+ smallest (receive time - boot time) of a window of conf["clock"]["window"]
+ seconds, the sample that waited least on the link.
+ With conf["clock"]["aggr_time"] = 'fc', the frames carrying a time_boot_ms are
+ aggregated at the time the autopilot sampled them instead of their receive time.
+"""
+
+import struct, time
+
+import conf
+from pymavlinklib import common
+
+UINT32 = struct.Struct('<I')
+TIMESYNC = struct.Struct('<qq')  # tc1, ts1 in ns
+
+# msgid: offset of the time_boot_ms in the payload
+boot_time_offset = {}
+for name in ['ATTITUDE', 'GLOBAL_POSITION_INT', 'SYSTEM_TIME']:
+    fmt, fields = common.payload[name]
+    boot_time_offset[common.mavlink[name]] = struct.calcsize(fmt[:fields.index('time_boot_ms') + 2]) - 4
+
+MSG_TIMESYNC = common.mavlink['TIMESYNC']
+COMPID_AUTOPILOT = 1
+clock_messages = set(boot_time_offset) | {MSG_TIMESYNC}
+
+second_text = (None, '')  # (epoch second, its '%Y-%m-%dT%H:%M:%S')
+
+
+def wall_base():
+    # wall clock - monotonic clock, in seconds
+    return time.time() - time.monotonic()
+
+
+def timestamp(wall_ms):
+    """
+    Aggregation key of a wall clock time in integer milliseconds.
+    """
+
+    global second_text
+
+    second, ms = divmod(wall_ms, 1000)
+    cached = second_text
+    if cached[0] != second:
+        cached = second_text = (second, time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(second)))
+
+    return cached[1] + '%03d' % ms
+
+
+def boot_ms(msgid, payload):
+    # time_boot_ms carried by the message, or None
+    if msgid == MSG_TIMESYNC:
+        if len(payload) < TIMESYNC.size:
+            return None
+        tc1, ts1 = TIMESYNC.unpack_from(payload)
+        # tc1 == 0: a request of the autopilot, ts1 is its own clock
+        return ts1 // 1000000 if tc1 == 0 and ts1 > 0 else None
+
+    offset = boot_time_offset[msgid]
+    if len(payload) < offset + 4:
+        return None
+
+    return UINT32.unpack_from(payload, offset)[0]
+
+
+class FcClock:
+    def __init__(self):
+        self.offset = None  # monotonic seconds at time_boot_ms 0
+        self.best = None  # smallest offset of the current window
+        self.window_end = 0.0
+        self.last_boot_ms = 0
+        self.samples = 0
+
+    def update(self, received, time_boot_ms):
+        if time_boot_ms + 1000 < self.last_boot_ms:  # the autopilot rebooted
+            self.offset = None
+            self.best = None
+        self.last_boot_ms = time_boot_ms
+        self.samples += 1
+
+        sample = received - time_boot_ms / 1000.0
+        if self.best is None or sample < self.best:
+            self.best = sample
+        if self.offset is None or sample < self.offset:
+            self.offset = sample
+        if received >= self.window_end:
+            # the best sample of the window, so that the estimate follows the drift of the autopilot clock
+            self.offset = self.best
+            self.best = None
+            self.window_end = received + conf.conf['clock']['window']
+
+    def monotonic(self, time_boot_ms):
+        # monotonic time of a time_boot_ms of the autopilot, None before the first estimate
+        if self.offset is None:
+            return None
+
+        return self.offset + time_boot_ms / 1000.0
+
+    def sample(self, received, frame, system_id):
+        """
+        Updates the estimate from a frame of the autopilot of system_id. Returns the
+        monotonic time the autopilot sampled the frame at, or received when it
+        carries no time_boot_ms or comes from another component.
+        """
+
+        if frame[0] == 0xfd:
+            msgid = frame[7] | (frame[8] << 8) | (frame[9] << 16)
+            sysid, compid, start = frame[5], frame[6], 10
+        else:
+            msgid = frame[5]
+            sysid, compid, start = frame[3], frame[4], 6
+        if msgid not in clock_messages or compid != COMPID_AUTOPILOT or sysid != int(system_id):
+            return received
+
+        ms = boot_ms(msgid, frame[start:start + frame[1]])
+        if ms is None:
+            return received
+        self.update(received, ms)
+        if msgid == MSG_TIMESYNC:
+            return received
+
+        sampled = self.monotonic(ms)
+        # never after the receive time, whatever the estimate
+        return received if sampled is None or sampled > received else sampled
@@ -0,0 +1,115 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Sampled tracing of the MAVLink frames through the TAS pipeline.
+
+ With conf["trace"]["enable"], about conf["trace"]["rate"] of the frames carry a
+ Trace marking the time.monotonic() of each stage they pass:
+
+    read        serial read (the receive time of the framer)
+    framed      cut out of the serial stream
+    mqtt        raw frame handed to the remote MQTT client
+    aggregated  added to the aggregation window of Mobius
+    decoded     decoded by the local parser (GLOBAL_POSITION_INT, HEARTBEAT)
+    published   decoded topic handed to the local MQTT client
+    cin         2001 of the CIN of its aggregation window
+
+ When the frame is done (its CIN answered, or at the end of the dispatch when
+ it is not aggregated) the time from the stage before (STAGE_FROM) is observed
+ in the trace_stage_seconds histogram of the metrics endpoint, and the time from
+ the serial read in trace_total_seconds. At exit the histograms and the latest
+ conf["trace"]["keep"] traces are written to conf["trace"]["path"].
+"""
+
+import atexit, collections, json, threading, time
+
+import conf
+import metrics
+import muv_log
+
+log = muv_log.get_logger('trace')
+
+STAGE_FROM = {'framed': 'read', 'mqtt': 'framed', 'aggregated': 'framed', 'decoded': 'framed',
+              'published': 'decoded', 'cin': 'aggregated'}
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0)
+
+every = 0  # one frame of every; 0: tracing off
+countdown = 0
+
+lock = threading.Lock()
+recent = collections.deque()
+
+
+class Trace:
+    __slots__ = ('vehicle', 'marks')
+
+    def __init__(self, vehicle, received):
+        self.vehicle = vehicle
+        self.marks = {'read': received}
+
+    def mark(self, stage):
+        self.marks[stage] = time.monotonic()
+
+
+def begin(vehicle, received):
+    """
+    Returns a Trace for the sampled frames, None for the others.
+    """
+
+    global countdown
+
+    countdown -= 1
+    if countdown > 0:
+        return None
+    countdown = every
+
+    return Trace(vehicle, received)
+
+
+def finish(trace):
+    marks = trace.marks
+    last = 'read'
+    for stage, at in marks.items():
+        if stage == 'read':
+            continue
+        metrics.observe('trace_stage_seconds', at - marks[STAGE_FROM[stage]], (('stage', stage),), BUCKETS)
+        if at > marks[last]:
+            last = stage
+    metrics.observe('trace_total_seconds', marks[last] - marks['read'], (('end', last),), BUCKETS)
+
+    with lock:
+        recent.append(trace)
+        if len(recent) > conf.conf['trace']['keep']:
+            recent.popleft()
+
+
+def dump():
+    counter_copy, histogram_copy, gauge_copy = metrics.snapshot()
+    result = {'buckets': BUCKETS, 'histograms': {}, 'traces': []}
+    for name in ('trace_stage_seconds', 'trace_total_seconds'):
+        for labels, counts in histogram_copy.get(name, {}).items():
+            result['histograms'][metrics.series_key(name, labels)] = {
+                'count': sum(counts[:-1]), 'sum': counts[-1], 'counts': counts[:-1]}
+
+    with lock:
+        for trace in recent:
+            read = trace.marks['read']
+            result['traces'].append({'vehicle': trace.vehicle,
+                                     'ms': {stage: round((at - read) * 1000, 3) for stage, at in trace.marks.items()}})
+
+    with open(conf.conf['trace']['path'], 'w') as f:
+        json.dump(result, f, indent=4)
+    log.info('%d traces written to %s', len(result['traces']), conf.conf['trace']['path'])
+
+
+def init():
+    global every
+    global countdown
+
+    if not conf.conf['trace']['enable'] or every > 0:
+        return
+
+    every = max(1, int(round(1 / conf.conf['trace']['rate'])))
+    countdown = every
+    atexit.register(dump)
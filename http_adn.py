@@ -5,12 +5,94 @@
 """
 
 import http.client as request
-import uuid, json, ssl
+import collections, copy, uuid, json, ssl, threading, time
 
 import conf
+import upload_scheduler
+import spool
+import muv_log
+import metrics
 
+log = muv_log.get_logger('http_adn')
+dump = muv_log.get_logger('dump')
 
-def http_request(origin, path, method, ty, bodyString):
+http_op = {'POST2': 'crtae', 'POST3': 'crtct', 'POST23': 'crtsub', 'POST4': 'crtci',
+           'GET': 'rtv', 'PUT': 'udt', 'DELETE': 'del'}
+
+# answers of rtvae/rtvct when conf["cache"]["enable"]: target -> (monotonic expiry, rsc, res_body)
+retrieve_cache = collections.OrderedDict()
+cache_lock = threading.Lock()
+
+
+def http_request(origin, path, method, ty, bodyString, prio='control'):
+    started = time.monotonic()
+    if method == 'GET':
+        rsc, res_body = send_request(origin, path, method, ty, bodyString)
+    else:
+        rsc, res_body = upload_scheduler.request(prio, send_request, origin, path, method, ty, bodyString)
+
+    op = http_op.get(method + str(ty) if method == 'POST' else method, method)
+    metrics.observe('http_request_seconds', time.monotonic() - started, (('op', op),))
+    metrics.inc('http_requests', 1, (('op', op), ('rsc', rsc)))
+
+    if rsc != 9999:
+        spool.cse_alive()
+    if method != 'GET' and len(retrieve_cache) > 0:
+        cache_invalidate(path)
+
+    return rsc, res_body
+
+
+def cache_path(target):
+    return target.split('?', 1)[0].rstrip('/')
+
+
+def cache_invalidate(path):
+    """
+    Drops the cached answers of path and of the resources under it (its la, ol and children).
+    """
+
+    path = cache_path(path)
+    with cache_lock:
+        for target in [t for t in retrieve_cache if cache_path(t) == path or t.startswith(path + '/')]:
+            del retrieve_cache[target]
+
+
+def cached_retrieve(target, refresh=False):
+    """
+    GET of target through the retrieve cache. refresh skips the cached answer and replaces it.
+    """
+
+    if not conf.conf['cache']['enable']:
+        return http_request(conf.conf['ae']['id'], target, 'GET', '', '')
+
+    now = time.monotonic()
+    if not refresh:
+        with cache_lock:
+            entry = retrieve_cache.get(target)
+            if entry is not None and entry[0] > now:
+                retrieve_cache.move_to_end(target)
+                metrics.inc('retrieve_cache', 1, (('result', 'hit'),))
+                return entry[1], copy.deepcopy(entry[2])
+    metrics.inc('retrieve_cache', 1, (('result', 'refresh' if refresh else 'miss'),))
+
+    rsc, res_body = http_request(conf.conf['ae']['id'], target, 'GET', '', '')
+    with cache_lock:
+        if rsc == 2000:
+            retrieve_cache[target] = (now + conf.conf['cache']['ttl'], rsc, copy.deepcopy(res_body))
+            retrieve_cache.move_to_end(target)
+            while len(retrieve_cache) > conf.conf['cache']['max_entries']:
+                retrieve_cache.popitem(last=False)
+        else:
+            retrieve_cache.pop(target, None)
+
+    return rsc, res_body
+
+
+metrics.gauge('retrieve_cache_entries', lambda: len(retrieve_cache))
+
+
+def send_request(origin, path, method, ty, bodyString):
     headers= {
         'Accept' : 'application/' + conf.conf['ae']['bodytype'],
         'X-M2M-RI' : str(uuid.uuid1()),
@@ -68,7 +150,8 @@ def http_request(origin, path, method, ty, bodyString):
         return 9999, jsonObj
 
 
-def crtae(parent, rn, api):
+def crtae(parent, rn, api, origin=None):
+    # origin: X-M2M-Origin of the AE, conf["ae"]["id"] by default
     results_ae = {}
 
     bodyString = ''
@@ -85,13 +168,13 @@ def crtae(parent, rn, api):
 
         bodyString = json.dumps(results_ae)
 
-    rsc, res_body = http_request(conf.conf['ae']['id'], parent, 'POST', '2', bodyString)
+    rsc, res_body = http_request(origin or conf.conf['ae']['id'], parent, 'POST', '2', bodyString)
 
     return rsc, res_body
 
 
-def rtvae(target):
-    rsc, res_body = http_request(conf.conf['ae']['id'], target, 'GET', '', '')
+def rtvae(target, refresh=False):
+    rsc, res_body = cached_retrieve(target, refresh)
 
     return rsc, res_body
 
@@ -119,7 +202,7 @@ def delae(target):
     return rsc, res_body
 
 
-def crtct(parent, rn, count):
+def crtct(parent, rn, count, origin=None):
     results_ct = {}
 
     bodyString = ''
@@ -132,17 +215,17 @@ def crtct(parent, rn, count):
         results_ct['m2m:cnt']['rn'] = rn
         results_ct['m2m:cnt']['lbl'] = [rn]
         bodyString = json.dumps(results_ct)
-        print(bodyString)
+        dump.debug('%s', bodyString)
 
-    rsc, res_body = http_request(conf.conf['ae']['id'], parent, 'POST', '3', bodyString)
-    print(str(count) + ' - ' + parent + '/' + rn + ' - x-m2m-rsc : ' + str(rsc) + ' <----')
-    print(res_body)
+    rsc, res_body = http_request(origin or conf.conf['ae']['id'], parent, 'POST', '3', bodyString)
+    log.info('%s - %s/%s - x-m2m-rsc : %s <----', count, parent, rn, rsc)
+    dump.debug('%s', res_body)
 
     return rsc, res_body, count
 
 
-def rtvct(target, count):
-    rsc, res_body = http_request(conf.conf['ae']['id'], target, 'GET', '', '')
+def rtvct(target, count, refresh=False):
+    rsc, res_body = cached_retrieve(target, refresh)
 
     return rsc, res_body, count
 
@@ -160,14 +243,14 @@ def udtct(target, lbl, count):
         bodyString = json.dumps(results_ct)
 
     rsc, res_body = http_request(conf.conf['ae']['id'], target, 'PUT', '', bodyString)
-    print(str(count) + ' - ' + target + ' - x-m2m-rsc : ' + str(rsc) + ' <----')
+    log.info('%s - %s - x-m2m-rsc : %s <----', count, target, rsc)
 
     return rsc, res_body, count
 
 
 def delct(target, count):
     rsc, res_body = http_request('Superman', target, 'DELETE', '', '')
-    print(str(count) + ' - ' + target + ' - x-m2m-rsc : ' + str(rsc) + ' <----')
+    log.info('%s - %s - x-m2m-rsc : %s <----', count, target, rsc)
 
     return rsc, res_body, count
 
@@ -186,24 +269,25 @@ def crtsub(parent, rn, nu, count):
         results_ss['m2m:sub']['nu'] = [nu]
         results_ss['m2m:sub']['nct'] = 2
         bodyString = json.dumps(results_ss)
-        print(bodyString)
+        dump.debug('%s', bodyString)
 
     rsc, res_body = http_request(conf.conf["ae"]["id"], parent, 'POST', '23', bodyString)
-    print(str(count) + ' - ' + parent + '/' + rn + ' - x-m2m-rsc : ' + str(rsc) + ' <----')
-    print(json.dumps(res_body))
+    log.info('%s - %s/%s - x-m2m-rsc : %s <----', count, parent, rn, rsc)
+    dump.debug('%s', res_body)
 
     return rsc, res_body, count
 
 
 def delsub(target, count):
     rsc, res_body = http_request('Superman', target, 'DELETE', '', '')
-    print(str(count) + ' - ' + target + ' - x-m2m-rsc : ' + str(rsc) + ' <----')
-    print(res_body)
+    log.info('%s - %s - x-m2m-rsc : %s <----', count, target, rsc)
+    dump.debug('%s', res_body)
 
     return rsc, res_body, count
 
 
-def crtci(parent, count, content_obj, socket):
+def crtci(parent, count, content_obj, socket, prio='telemetry', spool_failed=True):
+    # spool_failed: keep the CIN in the spool when the CSE can not be reached
     results_ci = {}
     bodyString = ''
     if conf.conf['ae']['bodytype'] == 'xml':
@@ -215,6 +299,8 @@ def crtci(parent, count, content_obj, socket):
         results_ci['m2m:cin']['con'] = content_obj
         bodyString = json.dumps(results_ci)
 
-    rsc, res_body = http_request(conf.conf['ae']['id'], parent, 'POST', '4', bodyString)
+    rsc, res_body = http_request(conf.conf['ae']['id'], parent, 'POST', '4', bodyString, prio)
+    if rsc == 9999 and spool_failed and conf.conf['spool']['enable'] and isinstance(res_body.get('dbg'), Exception):
+        spool.put(parent, '4', bodyString, prio)
 
     return rsc, res_body, parent, socket
\ No newline at end of file
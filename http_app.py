@@ -4,10 +4,8 @@
  Created by Wonseok Jung in KETI on 2021-03-16.
 """
 
-import paho.mqtt.client as mqtt
 from urllib.parse import urlparse
-import os, sys, shutil, platform, socket, random, time, subprocess, json, uuid
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import os, sys, shutil, platform, socket, time, subprocess, json, uuid
 
 import threading
 from functools import wraps
@@ -17,6 +15,11 @@ import conf
 import noti
 import thyme_tas_mav as tas_mav
 import http_adn
+import msw_upload
+import spool
+import ae_http
+import vehicle
+import profiler
 
 HTTP_SUBSCRIPTION_ENABLE = 0
 MQTT_SUBSCRIPTION_ENABLE = 0
@@ -112,18 +115,23 @@ def getType(p):
     return type
 
 
-# ready for mqtt
-for i in range(0, len(conf.conf['sub'])):
-    if conf.conf['sub'][i]['name'] is not None:
-        if urlparse(conf.conf['sub'][i]['nu']).scheme == 'http':
-            HTTP_SUBSCRIPTION_ENABLE = 1
-            if urlparse(conf.conf['sub'][i]['nu']).netloc == 'autoset':
-                conf.conf.sub[i]['nu'] = 'http://' + socket.gethostbyname(socket.gethostname()) + ':' + conf.conf['ae'][
-                    'port'] + urlparse(conf.conf['sub'][i]['nu'])['pathname']
-        elif urlparse(conf.conf['sub'][i]['nu']).scheme == 'mqtt':
-            MQTT_SUBSCRIPTION_ENABLE = 1
-        else:
-            print('notification uri of subscription is not supported')
+def init():
+    # ready for mqtt
+    global HTTP_SUBSCRIPTION_ENABLE
+    global MQTT_SUBSCRIPTION_ENABLE
+
+    for i in range(0, len(conf.conf['sub'])):
+        if conf.conf['sub'][i]['name'] is not None:
+            if urlparse(conf.conf['sub'][i]['nu']).scheme == 'http':
+                HTTP_SUBSCRIPTION_ENABLE = 1
+                if urlparse(conf.conf['sub'][i]['nu']).netloc == 'autoset':
+                    conf.conf.sub[i]['nu'] = 'http://' + socket.gethostbyname(socket.gethostname()) + ':' + \
+                                             conf.conf['ae']['port'] + urlparse(conf.conf['sub'][i]['nu'])['pathname']
+            elif urlparse(conf.conf['sub'][i]['nu']).scheme == 'mqtt':
+                MQTT_SUBSCRIPTION_ENABLE = 1
+            else:
+                print('notification uri of subscription is not supported')
+
 
 return_count = 0
 request_count = 0
@@ -132,9 +140,8 @@ request_count = 0
 def ready_for_notification():
     global noti_topic
     if HTTP_SUBSCRIPTION_ENABLE == 1:
-        server = HTTPServer(('0.0.0.0', int(conf.conf['ae']['port'])), BaseHTTPRequestHandler)
-        print('http_server running at {} port'.format(conf.conf['ae']['port']))
-        server.serve_forever()
+        # notifications are received by the http_server started at boot (ae_http)
+        ae_http.start()
 
     if MQTT_SUBSCRIPTION_ENABLE == 1:
         for i in range(0, len(conf.conf['sub'])):
@@ -362,6 +369,7 @@ def retrieve_my_cnt_name():
         '/Mobius/' + conf.conf['ae']['approval_gcs'] + '/approval/' + conf.conf['ae']['name'] + '/la', 0)
     if res == 2000:
         drone_info = res_body['m2m:cin']['con']
+        vehicle.save_approval(drone_info)
 
         conf.conf['sub'] = []
         conf.conf['cnt'] = []
@@ -625,6 +633,9 @@ def http_watchdog():
 
                 tas_mav.tas_ready()
 
+                if conf.conf['spool']['enable']:
+                    spool.start()
+
                 http_watchdog()
     elif thyme.sh_state == 'crtci':
         # print('[sh_state] : {}'.format(thyme.sh_state))
@@ -643,6 +654,10 @@ def fc_on_connect(client, userdata, flags, rc):
         thyme.mqtt_client.subscribe(noti_topic, 0)
         print('[mqtt_connect] noti_topic is subscribed:  ' + noti_topic)
 
+    for topic in vehicle.gcs_topics:
+        if topic != muv_sub_gcs_topic:
+            thyme.mqtt_client.subscribe(topic, 0)
+
 
 def fc_on_subscribe(client, userdata, mid, granted_qos):
     print("mqtt_client subscribed: " + str(mid) + " " + str(granted_qos))
@@ -655,6 +670,8 @@ def fc_on_message(client, userdata, msg):
     if msg.topic == muv_sub_gcs_topic:
         message = tas_mav.Hex(msg.payload)
         tas_mav.gcs_noti_handler(bytearray.fromhex(" ".join(message[i:i + 2] for i in range(0, len(message), 2))))
+    elif msg.topic in vehicle.gcs_topics:
+        tas_mav.gcs_noti_handler(msg.payload, vehicle.gcs_topics[msg.topic])
 
     else:
         if '/oneM2M/req/' in msg.topic:
@@ -675,6 +692,8 @@ def mqtt_connect(serverip):
     global noti_topic
 
     if thyme.mqtt_client is None:
+        import paho.mqtt.client as mqtt
+
         if conf.conf['usesecure'] == 'disable':
             thyme.mqtt_client = mqtt.Client(clean_session=True)
             thyme.mqtt_client.on_connect = fc_on_connect
@@ -701,6 +720,7 @@ def muv_on_connect(client, userdata, flags, rc):
     for idx in range(len(muv_sub_msw_topic)):
         thyme.muv_mqtt_client.subscribe(muv_sub_msw_topic[idx], 0)
         print('[muv_mqtt_connect] noti_topic[{0}]: {1}'.format(str(idx), muv_sub_msw_topic[idx]))
+    thyme.muv_mqtt_client.subscribe(conf.conf['profiler']['topic'], 0)
 
 
 def muv_on_subscribe(client, userdata, mid, granted_qos):
@@ -710,21 +730,26 @@ def muv_on_subscribe(client, userdata, mid, granted_qos):
 def muv_on_message(client, userdata, msg):
     message = str(msg.payload.decode("utf-8"))
 
+    if msg.topic == conf.conf['profiler']['topic']:
+        profiler.command(message)
+        return
+
     try:
         msg_obj = json.loads(message)
-        print(msg_obj)
-        send_to_Mobius(msg.topic, msg_obj, int(random.random() * 10))
-
     except Exception as e:
         msg_obj = message
-        send_to_Mobius(msg.topic, msg_obj, int(random.random() * 10))
-        # print(topic + ' - ' + msg_obj)
+
+    msw_upload.put(msg.topic, msg_obj)
 
 
 def muv_mqtt_connect(broker_ip, port):
     global muv_sub_msw_topic
 
     if thyme.muv_mqtt_client is None:
+        import paho.mqtt.client as mqtt
+
+        msw_upload.start()
+
         if conf.conf['usesecure'] == 'disable':
             thyme.muv_mqtt_client = mqtt.Client(clean_session=True)
             thyme.muv_mqtt_client.on_connect = muv_on_connect
@@ -743,7 +768,6 @@ def muv_mqtt_connect(broker_ip, port):
             thyme.muv_mqtt_client.connect(broker_ip, port, keepalive=10)
             thyme.muv_mqtt_client.loop_start()
             print('muv_mqtt_client connected to {}'.format(broker_ip))
-
-
-def send_to_Mobius(topic, content_each_obj, gap):
-    http_adn.crtci(topic + '?rcn=0', 0, content_each_obj, None)
+    else:
+        # connected at boot by tas_mav.tas_early(), before the MSW topics were known
+        muv_on_connect(thyme.muv_mqtt_client, None, None, 0)
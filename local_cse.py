@@ -0,0 +1,344 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Local stand-in of the Mobius CSE for tests and load benchmarks.
+
+ Implements what nCube-MUV uses: create/retrieve/update/delete of AE, CNT, SUB
+ and CIN over HTTP, /la and /ol of containers, and notifications of new CINs to
+ the subscriptions, either over HTTP or over the oneM2M MQTT binding
+ (/oneM2M/req/<cse>/<id>/json on the broker of the nu). The approval 'la' CIN that
+ retrieve_my_cnt_name() expects is seeded for each flight. Latency and errors can
+ be injected per request.
+
+    python3 local_cse.py --flight Dione --latency 0.05 --jitter 0.02 --error-rate 0.01
+
+ Set "approval_host" (and "approval_port") of flight.json to this machine. GET /__stats
+ returns request and CIN counts as JSON.
+"""
+
+import argparse, copy, datetime, json, random, threading, time, uuid
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import conf
+import muv_log
+
+log = muv_log.get_logger('local_cse')
+
+CSE_ID = '/Mobius2'
+CSE_NAME = 'Mobius'
+
+type_name = {'2': 'ae', '3': 'cnt', '4': 'cin', '23': 'sub'}
+http_status = {2000: 200, 2001: 201, 2002: 200, 2004: 200, 4000: 400, 4004: 404, 4105: 409, 5000: 500}
+
+lock = threading.RLock()
+resources = {}  # path -> resource
+children = {}  # path -> [child path, ...] in creation order
+
+options = {'latency': 0.0, 'jitter': 0.0, 'error_rate': 0.0, 'drop_rate': 0.0, 'mqtt_host': None}
+stats = {'requests': {}, 'cin': {}, 'notifications': 0, 'errors': 0, 'dropped': 0}
+
+mqtt_clients = {}
+
+observers = []  # fn(container, cin, received) called on every created CIN, for in-process harnesses
+
+
+def now_ct():
+    return datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+
+
+def create(parent, ty, body):
+    """
+    Returns (rsc, resource) of a create request under parent.
+    """
+
+    with lock:
+        if parent != '/' + CSE_NAME and resources.get(parent) is None:
+            return 4004, {'dbg': 'parent does not exist: ' + parent}
+
+        rn = body.get('rn')
+        if rn is None:
+            if ty == '4':
+                rn = '4-' + datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+            else:
+                rn = type_name[ty] + '-' + uuid.uuid4().hex[:8]
+        path = parent + '/' + rn
+        if resources.get(path) is not None:
+            return 4105, {'dbg': 'resource is already exist: ' + path}
+
+        resource = dict(body)
+        resource['rn'] = rn
+        resource['ty'] = int(ty)
+        resource['pi'] = parent
+        resource['ri'] = path
+        resource['ct'] = resource['lt'] = now_ct()
+        if ty == '2':
+            resource['aei'] = 'S' + rn
+        elif ty == '3':
+            resource['cni'] = 0
+        elif ty == '4':
+            resource['cs'] = len(json.dumps(resource.get('con', '')))
+            if resources.get(parent) is not None and resources[parent]['ty'] == 3:
+                resources[parent]['cni'] += 1
+            stats['cin'][parent] = stats['cin'].get(parent, 0) + 1
+
+        resources[path] = resource
+        children.setdefault(parent, []).append(path)
+
+    if ty == '4':
+        received = time.time()
+        for fn in observers:
+            fn(parent, resource, received)
+        notify(parent, resource)
+
+    return 2001, resource
+
+
+def retrieve(path):
+    with lock:
+        if path.endswith('/la') or path.endswith('/ol'):
+            cins = [p for p in children.get(path[:-3], []) if resources[p]['ty'] == 4]
+            if len(cins) == 0:
+                return 4004, {'dbg': 'resource does not exist'}
+            return 2000, resources[cins[-1] if path.endswith('/la') else cins[0]]
+
+        if resources.get(path) is None:
+            return 4004, {'dbg': 'resource does not exist'}
+
+        return 2000, resources[path]
+
+
+def update(path, body):
+    with lock:
+        if resources.get(path) is None:
+            return 4004, {'dbg': 'resource does not exist'}
+        resources[path].update(body)
+        resources[path]['lt'] = now_ct()
+
+        return 2004, resources[path]
+
+
+def delete(path):
+    with lock:
+        if resources.get(path) is None:
+            return 4004, {'dbg': 'resource does not exist'}
+
+        resource = resources[path]
+        pending = [path]
+        while len(pending) > 0:
+            p = pending.pop()
+            pending.extend(children.pop(p, []))
+            resources.pop(p, None)
+        if path in children.get(resource['pi'], []):
+            children[resource['pi']].remove(path)
+
+        return 2002, resource
+
+
+def notify(container, cin):
+    with lock:
+        subs = [resources[p] for p in children.get(container, []) if resources[p]['ty'] == 23]
+
+    for sub in subs:
+        sgn = {'m2m:sgn': {'sur': sub['ri'][1:], 'nev': {'rep': {'m2m:cin': cin}, 'net': 3}}}
+        for nu in sub.get('nu', []):
+            t = threading.Thread(target=send_notification, args=(nu, sgn), daemon=True)
+            t.start()
+
+
+def send_notification(nu, sgn):
+    url = urlparse(nu)
+    try:
+        if url.scheme == 'http':
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=5)
+            conn.request('POST', url.path or '/', json.dumps(sgn),
+                         {'Content-Type': 'application/json', 'X-M2M-RI': str(uuid.uuid1()), 'X-M2M-Origin': CSE_ID})
+            conn.getresponse().read()
+            conn.close()
+        elif url.scheme == 'mqtt':
+            target = url.path.strip('/')
+            rqp = {'op': 5, 'to': nu, 'fr': CSE_ID, 'rqi': str(uuid.uuid1()), 'pc': sgn}
+            topic = '/oneM2M/req/{}/{}/json'.format(CSE_ID.strip('/'), target)
+            mqtt_client(options['mqtt_host'] or url.hostname).publish(topic, json.dumps({'m2m:rqp': rqp}))
+        else:
+            return
+        with lock:
+            stats['notifications'] += 1
+    except Exception as e:
+        log.warning('notification to %s: %s', nu, e)
+
+
+def mqtt_client(host):
+    with lock:
+        client = mqtt_clients.get(host)
+        if client is None:
+            import paho.mqtt.client as mqtt
+
+            client = mqtt.Client(clean_session=True)
+            client.connect(host, int(conf.conf['cse']['mqttport']), keepalive=10)
+            client.loop_start()
+            mqtt_clients[host] = client
+
+    return client
+
+
+class CseHandler(BaseHTTPRequestHandler):
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        if url.path == '/__stats':
+            with lock:
+                self.reply(200, {}, json.dumps(stats))
+            return
+
+        op = method
+        if method == 'POST':
+            ty = ''
+            for param in self.headers.get('Content-Type', '').split(';'):
+                if param.strip().startswith('ty='):
+                    ty = param.strip()[3:]
+            op = 'POST' + ty
+        with lock:
+            stats['requests'][op] = stats['requests'].get(op, 0) + 1
+
+        delay = options['latency'] + random.random() * options['jitter']
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < options['drop_rate']:
+            with lock:
+                stats['dropped'] += 1
+            self.close_connection = True
+            return
+        if random.random() < options['error_rate']:
+            with lock:
+                stats['errors'] += 1
+            self.respond(5000, {'dbg': 'injected error'})
+            return
+
+        body = {}
+        length = int(self.headers.get('Content-Length', 0))
+        if length > 0:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except Exception:
+                self.respond(4000, {'dbg': 'body is not json'})
+                return
+
+        path = url.path.rstrip('/')
+        if method == 'GET':
+            rsc, resource = retrieve(path)
+        elif method == 'PUT':
+            rsc, resource = update(path, list(body.values())[0] if body else {})
+        elif method == 'DELETE':
+            rsc, resource = delete(path)
+        elif type_name.get(ty) is None:
+            rsc, resource = 4000, {'dbg': 'resource type is not supported: ' + ty}
+        else:
+            rsc, resource = create(path, ty, body.get('m2m:' + type_name[ty], {}))
+
+        if rsc >= 4000:
+            self.respond(rsc, resource)
+        else:
+            self.respond(rsc, {'m2m:' + type_name[str(resource['ty'])]: resource})
+
+    def respond(self, rsc, body):
+        self.reply(http_status.get(rsc, 500), {'X-M2M-RSC': str(rsc), 'X-M2M-RI': self.headers.get('X-M2M-RI', '')},
+                   json.dumps(body))
+
+    def reply(self, status, headers, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class CseServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+def seed(path, ty, body):
+    parent, rn = path.rsplit('/', 1)
+    body = dict(body)
+    body['rn'] = rn
+
+    return create(parent, ty, body)
+
+
+def seed_approval(approval_gcs, flight, drone_info):
+    for path in ['/Mobius/' + approval_gcs, '/Mobius/' + drone_info['gcs'], '/Mobius/Life_Prediction']:
+        seed(path, '2', {'api': 'local_cse', 'rr': True})
+    for path in ['/Mobius/' + approval_gcs + '/approval', '/Mobius/' + approval_gcs + '/approval/' + flight,
+                 '/Mobius/Life_Prediction/History']:
+        seed(path, '3', {})
+    create('/Mobius/' + approval_gcs + '/approval/' + flight, '4', {'con': copy.deepcopy(drone_info)})
+
+
+def default_drone_info(flight, host):
+    return {'gcs': 'KETI_MUV', 'drone': flight, 'host': host, 'type': 'pixhawk', 'system_id': 1}
+
+
+def start(port=7579, latency=0.0, jitter=0.0, error_rate=0.0, drop_rate=0.0, mqtt_host=None):
+    options.update({'latency': latency, 'jitter': jitter, 'error_rate': error_rate, 'drop_rate': drop_rate,
+                    'mqtt_host': mqtt_host})
+    server = CseServer(('0.0.0.0', port), CseHandler)
+    t = threading.Thread(target=server.serve_forever, name='local_cse', daemon=True)
+    t.start()
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=int(conf.conf['cse']['port']))
+    parser.add_argument('--host', default='127.0.0.1', help='CSE host written in the approval info')
+    parser.add_argument('--approval-gcs', default=conf.conf['ae']['approval_gcs'])
+    parser.add_argument('--flight', action='append', default=None, help='flight (AE) name, repeatable')
+    parser.add_argument('--approval', default=None, help='json file of {flight: drone_info}')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='ratio of requests answered 5000')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='ratio of requests closed without answer')
+    parser.add_argument('--mqtt-host', default=None, help='broker of the MQTT notifications (default: nu host)')
+    args = parser.parse_args()
+
+    muv_log.init()
+
+    approvals = {}
+    if args.approval:
+        with open(args.approval, 'r') as f:
+            approvals = json.load(f)
+    for flight in args.flight or ([] if approvals else [conf.conf['ae']['name']]):
+        approvals[flight] = default_drone_info(flight, args.host)
+    for flight, drone_info in approvals.items():
+        seed_approval(args.approval_gcs, flight, drone_info)
+
+    server = start(args.port, args.latency, args.jitter, args.error_rate, args.drop_rate, args.mqtt_host)
+    log.info('local_cse running at %s port with %d flights', args.port, len(approvals))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
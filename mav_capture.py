@@ -0,0 +1,160 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Capture and replay of the MAVLink stream of the flight controller.
+
+ Captures are tlog files: each frame is preceded by its receive time as a
+ big-endian uint64 of microseconds since the epoch, so they open in
+ MAVProxy/pymavlink tools. They hold the frames the framer passed on. With
+ conf["capture"]["raw"], a .mavraw file of the same name is written as well, of
+ the bytes read from the serial port before the framer: each read is preceded
+ by its receive time (uint64, microseconds) and its length (uint32). It keeps
+ what the framer drops (MAVLink v2 frames, noise, cut frames), to reproduce its
+ problems, but only nCube replays it. The receive time is taken from the
+ monotonic clock and mapped to the wall clock once when the capture starts, so
+ it does not jump with NTP.
+
+ Replay accepts both: it feeds the frames of a tlog (a capture, MAVProxy,
+ bench/mavgen.py) or the reads of a .mavraw to the framer (mavPortIngest) in
+ real time or as fast as possible, instead of the serial port.
+"""
+
+import atexit, datetime, os, struct, threading, time
+
+import conf
+import muv_log
+
+log = muv_log.get_logger('capture')
+
+capture_file = None
+raw_file = None
+capture_base = 0  # wall clock - monotonic clock, in microseconds
+
+TLOG_TIME = struct.Struct('>Q')
+RAW_HEADER = struct.Struct('>QI')
+
+
+def start_capture():
+    global capture_file
+    global raw_file
+    global capture_base
+
+    if capture_file is not None:
+        return
+
+    os.makedirs(conf.conf['capture']['path'], exist_ok=True)
+    name = os.path.join(conf.conf['capture']['path'], datetime.datetime.now().strftime('%Y-%m-%dT%H%M%S'))
+    capture_base = int(time.time() * 1e6) - int(time.monotonic() * 1e6)
+    if conf.conf['capture']['raw']:
+        raw_file = open(name + '.mavraw', 'ab', buffering=64 * 1024)
+    capture_file = open(name + '.tlog', 'ab', buffering=64 * 1024)
+    atexit.register(stop_capture)
+    log.info('capture to %s.tlog%s', name, ' and .mavraw' if raw_file is not None else '')
+
+
+def stop_capture():
+    global capture_file
+    global raw_file
+
+    if capture_file is not None:
+        capture_file.close()
+        capture_file = None
+    if raw_file is not None:
+        raw_file.close()
+        raw_file = None
+
+
+def capture(received, frame):
+    # received: time.monotonic() of the serial read, frame: bytes of one MAVLink frame
+    capture_file.write(TLOG_TIME.pack(capture_base + int(received * 1e6)) + frame)
+
+
+def capture_raw(received, data):
+    # received: time.monotonic() of the serial read, data: the bytes it returned
+    raw_file.write(RAW_HEADER.pack(capture_base + int(received * 1e6), len(data)) + data)
+
+
+def frame_length(data, offset):
+    if data[offset] == 0xfd:
+        length = 10 + data[offset + 1] + 2
+        if data[offset + 2] & 0x01:  # signed
+            length += 13
+        return length
+
+    return 6 + data[offset + 1] + 2
+
+
+def read_tlog(path):
+    """
+    Yields (time in seconds since the epoch, frame bytes) of a tlog file.
+    """
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offset = 0
+    while offset + 10 <= len(data):
+        usec = TLOG_TIME.unpack_from(data, offset)[0]
+        offset += 8
+        if data[offset] not in (0xfe, 0xfd):
+            log.warning('tlog %s: no frame at %d', path, offset)
+            break
+        length = frame_length(data, offset)
+        yield usec / 1e6, data[offset:offset + length]
+        offset += length
+
+
+def read_raw(path):
+    """
+    Yields (time in seconds since the epoch, bytes of one serial read) of a .mavraw file.
+    """
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offset = 0
+    while offset + RAW_HEADER.size <= len(data):
+        usec, length = RAW_HEADER.unpack_from(data, offset)
+        offset += RAW_HEADER.size
+        if offset + length > len(data):
+            log.warning('capture %s: read cut at %d', path, offset)
+            break
+        yield usec / 1e6, data[offset:offset + length]
+        offset += length
+
+
+def read_capture(path):
+    # frames of a tlog, or reads of a .mavraw capture
+    return read_raw(path) if path.endswith('.mavraw') else read_tlog(path)
+
+
+def replay(path, realtime=True, loop=False, v=None):
+    import thyme_tas_mav as tas_mav
+
+    while True:
+        count = 0
+        started = None
+        first = None
+        for t, data in read_capture(path):
+            if realtime:
+                if started is None:
+                    started = time.monotonic()
+                    first = t
+                delay = (t - first) - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            tas_mav.mavPortIngest(data, v)
+            count += 1
+
+        log.info('replay of %s: %d reads', path, count)
+        if not loop:
+            break
+
+
+def start_replay(v=None, path=None):
+    # v: the vehicle fed by the tlog, path: conf["replay"]["path"] by default
+    replay_conf = conf.conf['replay']
+    t = threading.Thread(target=replay, args=(path or replay_conf['path'], replay_conf['realtime'],
+                                              replay_conf['loop'], v),
+                         name='replay' if v is None else 'replay-' + v.name)
+    t.start()
@@ -0,0 +1,152 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Routing table for MAVLink frames received from the flight controller.
+
+ conf["route"] is a list of rules checked in order; the first rule matching
+ (sysid, compid, msgid) decides the sinks of the frame. compile_routes() turns
+ the rules into lookup tables once, so route_of() costs two index operations.
+"""
+
+import muv_log
+
+log = muv_log.get_logger('route')
+
+ROUTE_MQTT = 0x01  # raw frame to the GCS over the Mobius broker
+ROUTE_MOBIUS = 0x02  # aggregated CIN in the sortie container
+ROUTE_LOCAL = 0x04  # local decoder and MUV topics
+
+ROUTE_ALL = ROUTE_MQTT | ROUTE_MOBIUS | ROUTE_LOCAL
+
+sink_mask = {
+    'mqtt': ROUTE_MQTT,
+    'mobius': ROUTE_MOBIUS,
+    'local': ROUTE_LOCAL
+}
+
+# routes[0]: (sysid << 8 | compid) -> index of routes[1]
+# routes[1]: list of (mask of msgid 0~255, mask of msgid over 255, mask of other msgid over 255)
+routes = (bytearray(256 * 256), [(bytearray([ROUTE_ALL] * 256), {}, ROUTE_ALL)])
+
+# system ids of 'self', until a frame of one of them is routed
+self_ids = set()
+self_seen = True
+foreign_warned = set()
+
+
+def rule_values(key, system_id):
+    if key is None or key == '*':
+        return None
+    if key == 'self':
+        # system_id: the one of the approval, or a list when the process serves several vehicles
+        if isinstance(system_id, (list, tuple, set)):
+            return set(int(s) for s in system_id)
+        return {int(system_id)}
+    if isinstance(key, list):
+        return set(int(k) for k in key)
+    return {int(key)}
+
+
+def rule_mask(sinks):
+    mask = 0
+    for sink in sinks:
+        mask |= sink_mask[sink]
+
+    return mask
+
+
+def compile_routes(rules, system_id):
+    global routes
+    global self_ids
+    global self_seen
+
+    compiled = []
+    sysids = set()
+    compids = set()
+    ext_msgids = set()
+    for rule in rules:
+        sysid = rule_values(rule.get('sysid'), system_id)
+        compid = rule_values(rule.get('compid'), system_id)
+        msgid = rule_values(rule.get('msgid'), system_id)
+        compiled.append((sysid, compid, msgid, rule_mask(rule.get('sink', []))))
+        if sysid is not None:
+            sysids |= sysid
+        if compid is not None:
+            compids |= compid
+        if msgid is not None:
+            ext_msgids |= set(m for m in msgid if m > 0xff)
+
+    def first_match(sys_id, comp_id, msg_id):
+        for sysid, compid, msgid, mask in compiled:
+            if sysid is not None and sys_id not in sysid:
+                continue
+            if compid is not None and comp_id not in compid:
+                continue
+            if msgid is not None and msg_id not in msgid:
+                continue
+            return mask
+        return 0
+
+    index = bytearray(256 * 256)
+    tables = []
+    table_of_class = {}
+    for sys_id in range(256):
+        sys_class = sys_id if sys_id in sysids else None
+        for comp_id in range(256):
+            comp_class = comp_id if comp_id in compids else None
+            table_no = table_of_class.get((sys_class, comp_class))
+            if table_no is None:
+                if len(tables) == 256:
+                    raise ValueError('too many distinct (sysid, compid) classes in route rules')
+                masks = bytearray(first_match(sys_id, comp_id, msg_id) for msg_id in range(256))
+                ext = {}
+                for msg_id in ext_msgids:
+                    ext[msg_id] = first_match(sys_id, comp_id, msg_id)
+                table_no = len(tables)
+                tables.append((masks, ext, first_match(sys_id, comp_id, -1)))
+                table_of_class[(sys_class, comp_class)] = table_no
+            index[(sys_id << 8) | comp_id] = table_no
+
+    routes = (index, tables)
+    if any(rule.get('sysid') == 'self' for rule in rules):
+        self_ids = rule_values('self', system_id)
+        self_seen = False
+    else:
+        self_ids = set()
+        self_seen = True
+
+    return len(tables)
+
+
+def watch_self(sys_id, comp_id, msg_id):
+    global self_seen
+
+    if sys_id in self_ids:
+        self_seen = True
+    elif msg_id == 0 and comp_id == 1 and sys_id not in foreign_warned:
+        # HEARTBEAT of an autopilot that the 'self' rules do not name
+        foreign_warned.add(sys_id)
+        log.warning('heartbeat of the autopilot of system %d, but the route rules of \'self\' expect system %s: '
+                    'its frames go only where the other rules send them, check system_id of the approval',
+                    sys_id, sorted(self_ids))
+
+
+def route_of(mavPacket):
+    if mavPacket[0:2] == 'fd':
+        sys_id = int(mavPacket[10:12], 16)
+        comp_id = int(mavPacket[12:14], 16)
+        msg_id = int(mavPacket[18:20] + mavPacket[16:18] + mavPacket[14:16], 16)
+    else:
+        sys_id = int(mavPacket[6:8], 16)
+        comp_id = int(mavPacket[8:10], 16)
+        msg_id = int(mavPacket[10:12], 16)
+
+    if not self_seen:
+        watch_self(sys_id, comp_id, msg_id)
+
+    index, tables = routes
+    table = tables[index[(sys_id << 8) | comp_id]]
+    if msg_id < 0x100:
+        return table[0][msg_id]
+
+    return table[1].get(msg_id, table[2])
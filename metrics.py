@@ -0,0 +1,166 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Counters, gauges and histograms of nCube-MUV, rendered as Prometheus text or
+ JSON by the HTTP server on the AE port.
+
+ labels are a tuple of (name, value) pairs, e.g. (('sink', 'mqtt'),).
+"""
+
+import json, threading, time
+
+PREFIX = 'ncube_'
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+lock = threading.Lock()
+started = time.time()
+
+counters = {}  # name -> {labels: value}
+histograms = {}  # name -> {labels: [count of each bucket..., count of +Inf, sum]}
+histogram_buckets = {}  # name -> buckets
+gauges = {}  # name -> function returning a number or {labels: value}
+
+last_json = [time.monotonic(), {}]
+
+
+def inc(name, value=1, labels=()):
+    with lock:
+        series = counters.get(name)
+        if series is None:
+            series = counters[name] = {}
+        series[labels] = series.get(labels, 0) + value
+
+
+def observe(name, value, labels=(), buckets=BUCKETS):
+    with lock:
+        series = histograms.get(name)
+        if series is None:
+            series = histograms[name] = {}
+            histogram_buckets[name] = buckets
+        counts = series.get(labels)
+        if counts is None:
+            counts = series[labels] = [0] * (len(buckets) + 2)
+        for idx, bound in enumerate(buckets):
+            if value <= bound:
+                counts[idx] += 1
+                break
+        else:
+            counts[len(buckets)] += 1
+        counts[-1] += value
+
+
+def gauge(name, fn):
+    gauges[name] = fn
+
+
+def gauge_values(fn):
+    try:
+        value = fn()
+    except Exception:
+        return {}
+    if isinstance(value, dict):
+        return value
+
+    return {(): value}
+
+
+def label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if len(pairs) == 0:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+def copy_series():
+    # called with lock held
+    counter_copy = {name: dict(series) for name, series in counters.items()}
+    histogram_copy = {name: {labels: list(counts) for labels, counts in series.items()}
+                      for name, series in histograms.items()}
+
+    return counter_copy, histogram_copy
+
+
+def snapshot():
+    with lock:
+        counter_copy, histogram_copy = copy_series()
+    gauge_copy = {name: gauge_values(fn) for name, fn in list(gauges.items())}
+
+    return counter_copy, histogram_copy, gauge_copy
+
+
+def render_prometheus():
+    counter_copy, histogram_copy, gauge_copy = snapshot()
+    lines = []
+
+    for name, series in sorted(counter_copy.items()):
+        lines.append('# TYPE {}{}_total counter'.format(PREFIX, name))
+        for labels, value in series.items():
+            lines.append('{}{}_total{} {}'.format(PREFIX, name, label_text(labels), value))
+
+    for name, series in sorted(gauge_copy.items()):
+        lines.append('# TYPE {}{} gauge'.format(PREFIX, name))
+        for labels, value in series.items():
+            lines.append('{}{}{} {}'.format(PREFIX, name, label_text(labels), value))
+
+    for name, series in sorted(histogram_copy.items()):
+        buckets = histogram_buckets[name]
+        lines.append('# TYPE {}{} histogram'.format(PREFIX, name))
+        for labels, counts in series.items():
+            cumulative = 0
+            for idx, bound in enumerate(buckets):
+                cumulative += counts[idx]
+                lines.append('{}{}_bucket{} {}'.format(PREFIX, name, label_text(labels, (('le', bound),)), cumulative))
+            cumulative += counts[len(buckets)]
+            lines.append('{}{}_bucket{} {}'.format(PREFIX, name, label_text(labels, (('le', '+Inf'),)), cumulative))
+            lines.append('{}{}_sum{} {}'.format(PREFIX, name, label_text(labels), counts[-1]))
+            lines.append('{}{}_count{} {}'.format(PREFIX, name, label_text(labels), cumulative))
+
+    return '\n'.join(lines) + '\n'
+
+
+def series_key(name, labels):
+    if len(labels) == 0:
+        return name
+
+    return name + label_text(labels)
+
+
+def render_json():
+    # the counters are copied and compared with last_json under one hold of the lock, so
+    # concurrent scrapes see increasing snapshots and never a negative rate
+    with lock:
+        counter_copy, histogram_copy = copy_series()
+
+        now = time.monotonic()
+        interval = max(now - last_json[0], 1e-6)
+        result = {'uptime': time.time() - started, 'interval': interval,
+                  'counters': {}, 'rates': {}, 'gauges': {}, 'histograms': {}}
+
+        totals = {}
+        for name, series in counter_copy.items():
+            for labels, value in series.items():
+                key = series_key(name, labels)
+                totals[key] = value
+                result['counters'][key] = value
+                result['rates'][key] = (value - last_json[1].get(key, 0)) / interval
+        last_json[0] = now
+        last_json[1] = totals
+    gauge_copy = {name: gauge_values(fn) for name, fn in list(gauges.items())}
+
+    for name, series in gauge_copy.items():
+        for labels, value in series.items():
+            result['gauges'][series_key(name, labels)] = value
+
+    for name, series in histogram_copy.items():
+        buckets = histogram_buckets[name]
+        for labels, counts in series.items():
+            count = sum(counts[:-1])
+            result['histograms'][series_key(name, labels)] = {
+                'count': count,
+                'sum': counts[-1],
+                'avg': counts[-1] / count if count else 0.0,
+                'buckets': dict(zip([str(b) for b in buckets] + ['+Inf'], counts[:-1]))
+            }
+
+    return json.dumps(result)
@@ -0,0 +1,102 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Uploader of MSW messages to Mobius.
+
+ Messages are queued and drained by a pool of workers. A topic is always handled
+ by the same worker, so the messages of a topic are uploaded in order. Containers
+ listed in conf["msw_upload"]["batch"] collect messages for a window and upload
+ them as one CIN, in the same {timestamp: content} form as the FC aggregation.
+"""
+
+import datetime, queue, threading, time
+
+import conf
+import http_adn
+import metrics
+import muv_log
+
+log = muv_log.get_logger('msw_upload')
+
+worker_queues = []
+batch_window_of_topic = {}
+
+dropped_count = 0
+
+
+def start():
+    if len(worker_queues) > 0:
+        return
+
+    for idx in range(max(1, int(conf.conf['msw_upload']['workers']))):
+        q = queue.Queue(int(conf.conf['msw_upload']['queue_size']))
+        worker_queues.append(q)
+        t = threading.Thread(target=msw_worker, args=(q,), name='msw_upload-{}'.format(idx), daemon=True)
+        t.start()
+
+
+def put(topic, content):
+    global dropped_count
+
+    q = worker_queues[hash(topic) % len(worker_queues)]
+    try:
+        q.put_nowait((topic, content))
+    except queue.Full:
+        dropped_count += 1
+        log.warning('queue of %s is full, message dropped (%d dropped)', topic, dropped_count)
+
+
+def queue_depth():
+    return sum(q.qsize() for q in worker_queues)
+
+
+metrics.gauge('msw_upload_queue_depth', queue_depth)
+metrics.gauge('msw_upload_dropped', lambda: dropped_count)
+
+
+def batch_window(topic):
+    window = batch_window_of_topic.get(topic)
+    if window is None:
+        window = 0
+        matched = ''
+        for container, seconds in conf.conf['msw_upload']['batch'].items():
+            if (topic == container or topic.startswith(container + '/')) and len(container) > len(matched):
+                matched = container
+                window = seconds
+        batch_window_of_topic[topic] = window
+
+    return window
+
+
+def upload(topic, content):
+    http_adn.crtci(topic + '?rcn=0', 0, content, None, 'msw')
+
+
+def msw_worker(q):
+    pending = {}  # topic -> [deadline, {timestamp: content}]
+
+    while True:
+        timeout = None
+        if len(pending) > 0:
+            timeout = max(0, min(batch[0] for batch in pending.values()) - time.monotonic())
+
+        try:
+            topic, content = q.get(timeout=timeout)
+            window = batch_window(topic)
+            if window > 0:
+                if pending.get(topic) is None:
+                    pending[topic] = [time.monotonic() + window, {}]
+                timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%f')[:-3]
+                batch = pending[topic][1]
+                key = timestamp
+                while key in batch:
+                    key = timestamp + '_' + str(len(batch))
+                batch[key] = content
+            else:
+                upload(topic, content)
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        for topic in [t for t, batch in pending.items() if batch[0] <= now]:
+            upload(topic, pending.pop(topic)[1])
@@ -0,0 +1,126 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Encoding of the decoded telemetry published on the local MUV topics.
+
+ conf["muv"]["encoding"] is 'json' (default) or 'struct'. With 'struct', each
+ topic carries a fixed little-endian layout instead of a JSON object, and the
+ layouts are published as JSON on the retained topic
+ <Drone_Data>/<drone>/schema so an MSW can build its decoder:
+
+    {"global_position_int": {"format": "<iiiiihhhH", "fields": ["time_boot_ms", ...]}, ...}
+
+ The values are the ones the JSON carries, so the one byte fields of HEARTBEAT
+ are signed like the decoder returns them.
+
+ With conf["muv"]["delta"] (JSON only) a topic carries only the fields changed
+ since its previous message, nothing when none changed, and a full keyframe
+ every conf["muv"]["keyframe_interval"] seconds:
+
+    {"seq": 42, "keyframe": false, "fields": {"time_boot_ms": 81250, "lat": 374036120}}
+
+ seq counts the messages of the topic, so a subscriber that sees a gap waits for
+ the next keyframe. A change of the fields in conf["muv"]["delta_ignore"] (the
+ time_boot_ms of a stationary position) alone publishes nothing.
+"""
+
+import json, struct, time
+
+import conf
+
+# name: (struct format, fields in the order of the format)
+layouts = {
+    'global_position_int': ('<iiiiihhhH', ('time_boot_ms', 'lat', 'lon', 'alt', 'relative_alt', 'vx', 'vy', 'vz',
+                                           'hdg')),
+    'heartbeat': ('<ibbbbb', ('custom_mode', 'type', 'autopilot', 'base_mode', 'system_status', 'mavlink_version')),
+}
+
+structs = {name: (struct.Struct(fmt), fields) for name, (fmt, fields) in layouts.items()}
+
+
+def encode_json(name, content):
+    return json.dumps(content)
+
+
+def encode_struct(name, content):
+    packer, fields = structs[name]
+
+    return packer.pack(*[content.get(field, 0) for field in fields])
+
+
+def decode_json(name, payload):
+    return json.loads(payload)
+
+
+def decode_struct(name, payload):
+    packer, fields = structs[name]
+
+    return dict(zip(fields, packer.unpack(payload)))
+
+
+encoders = {'json': encode_json, 'struct': encode_struct}
+decoders = {'json': decode_json, 'struct': decode_struct}
+
+encode = encode_json
+
+deltas = {}  # topic -> [last content, seq, monotonic time of the next keyframe]
+
+
+def payload_full(topic, name, content):
+    return encode(name, content)
+
+
+def payload_delta(topic, name, content):
+    now = time.monotonic()
+    state = deltas.get(topic)
+    if state is None:
+        state = deltas[topic] = [{}, 0, now]
+
+    last = state[0]
+    keyframe = now >= state[2]
+    if keyframe:
+        changed = dict(content)
+        state[2] = now + conf.conf['muv']['keyframe_interval']
+    else:
+        changed = {key: value for key, value in content.items() if last.get(key) != value}
+        if len(changed.keys() - conf.conf['muv']['delta_ignore']) == 0:
+            return None
+    last.update(changed)
+    state[1] += 1
+
+    return json.dumps({'seq': state[1], 'keyframe': keyframe, 'fields': changed})
+
+
+# payload(topic, name, content) returns what to publish on topic, or None to publish nothing
+payload = payload_full
+mode = None  # (encoding, delta) of the last init()
+
+
+def init():
+    # called by tas_early() and again by tas_ready() while the topics are published,
+    # so the delta sequences restart only when the encoding changes
+    global encode
+    global payload
+    global mode
+
+    if mode == (conf.conf['muv']['encoding'], conf.conf['muv']['delta']):
+        return
+    mode = (conf.conf['muv']['encoding'], conf.conf['muv']['delta'])
+
+    encode = encoders[conf.conf['muv']['encoding']]
+    if conf.conf['muv']['delta'] and conf.conf['muv']['encoding'] == 'json':
+        payload = payload_delta
+    else:
+        payload = payload_full
+    deltas.clear()
+
+
+def schema():
+    return json.dumps({name: {'format': fmt, 'fields': list(fields)} for name, (fmt, fields) in layouts.items()})
+
+
+def publish_schema(client, parent_cnt_name):
+    if conf.conf['muv']['encoding'] == 'json':
+        return
+
+    client.publish(parent_cnt_name + '/' + conf.conf['muv']['schema_topic'], schema(), retain=True)
@@ -0,0 +1,95 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Logging of nCube-MUV.
+
+ Records are put in a queue and written by a listener thread, so a slow console
+ or journal never blocks the serial or MQTT threads. Each call site is limited to
+ conf["log"]["rate_burst"] records per rate_interval seconds, and the number of
+ suppressed records is added to the next record of that call site. Dumps of
+ request and response bodies go to the 'dump' logger, which is enabled only when
+ conf["log"]["verbose"] is True.
+"""
+
+import atexit, logging, logging.handlers, queue, sys, threading, time
+
+import conf
+
+listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval, burst):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                suppressed = site[2] if site is not None else 0
+                self.sites[key] = [now, 1, 0]
+                if suppressed > 0:
+                    record.msg = str(record.msg) + ' [{} suppressed]'.format(suppressed)
+                return True
+
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+
+            site[2] += 1
+            return False
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    # the message is formatted by the listener thread, not by the caller
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def get_logger(name):
+    return logging.getLogger('nCube.' + name)
+
+
+def init():
+    global listener
+
+    if listener is not None:
+        return
+
+    log_conf = conf.conf['log']
+
+    if log_conf['file']:
+        handler = logging.FileHandler(log_conf['file'])
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+
+    log_queue = queue.Queue(int(log_conf['queue_size']))
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(float(log_conf['rate_interval']), int(log_conf['rate_burst'])))
+
+    root = logging.getLogger('nCube')
+    root.setLevel(log_conf['level'].upper())
+    root.addHandler(queue_handler)
+    root.propagate = False
+
+    if log_conf['verbose']:
+        get_logger('dump').setLevel(logging.DEBUG)
+    else:
+        get_logger('dump').setLevel(logging.CRITICAL + 1)
+
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
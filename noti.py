@@ -5,7 +5,9 @@
 """
 import json
 
-import thyme, conf, http_app
+import thyme, conf, http_app, muv_log, metrics
+
+log = muv_log.get_logger('noti')
 
 
 def parse_sgn(rqi, pc):
@@ -23,7 +25,7 @@ def parse_sgn(rqi, pc):
             sgnObj = pc['singleNotification']
 
         if nmtype == 'long':
-            print('oneM2M spec. define only short name for resource')
+            log.warning('oneM2M spec. define only short name for resource')
         else:
             if sgnObj.get('sur') is not None:
                 if sgnObj['sur'][0] != '/':
@@ -39,26 +41,26 @@ def parse_sgn(rqi, pc):
                     if sgnObj['nev']['rep'].get('cin') is not None:
                         cinObj = sgnObj['nev']['rep']['cin']
                     else:
-                        print('[mqtt_noti_action] m2m:cin is none')
+                        log.warning('[mqtt_noti_action] m2m:cin is none')
                         cinObj = None
                 else:
-                    print(
+                    log.warning(
                         '[mqtt_noti_action] rep tag of m2m:sgn.nev is none. m2m:notification format mismatch with '
                         'oneM2M spec.')
                     cinObj = None
             elif sgnObj.get('sud') is not None:
-                print('[mqtt_noti_action] received notification of verification')
+                log.info('[mqtt_noti_action] received notification of verification')
                 cinObj = {'sud': sgnObj['sud']}
             elif sgnObj.get('vrq') is not None:
-                print('[mqtt_noti_action] received notification of verification')
+                log.info('[mqtt_noti_action] received notification of verification')
                 cinObj = {'vrq': sgnObj['vrq']}
             else:
-                print(
+                log.warning(
                     '[mqtt_noti_action] nev tag of m2m:sgn is none. m2m:notification format mismatch with oneM2M spec.')
                 cinObj = None
     else:
-        print('[mqtt_noti_action] m2m:sgn tag is none. m2m:notification format mismatch with oneM2M spec.')
-        print(pc)
+        log.warning('[mqtt_noti_action] m2m:sgn tag is none. m2m:notification format mismatch with oneM2M spec.')
+        log.debug('%s', pc)
 
     return path_arr, cinObj, rqi
 
@@ -121,14 +123,42 @@ def mqtt_noti_action(topic_arr, jsonObj):
             if (cinObj.get("sud") or cinObj.get("vrq")):
                 pass
             else:
-                print('mqtt ' + bodytype + ' notification <----')
-                print('mqtt response - 2001 ---->')
+                log.debug('mqtt %s notification <----', bodytype)
+                log.debug('mqtt response - 2001 ---->')
 
-                if http_app.getType(cinObj["con"] == 'string'):
-                    thyme.muv_mqtt_client.publish('/'.join(path_arr).replace('/' + path_arr[len(path_arr) - 1], ''),
-                                                  cinObj["con"])
-                else:
-                    thyme.muv_mqtt_client.publish('/'.join(path_arr).replace('/' + path_arr[len(path_arr) - 1], ''),
-                                                  json.dumps(cinObj["con"]))
+                publish_noti(path_arr, cinObj)
+        else:
+            log.warning('[mqtt_noti_action] message is not noti')
+
+
+def http_noti_action(jsonObj):
+    pc = jsonObj
+    if pc.get('m2m:sgn'):
+        pc['sgn'] = pc['m2m:sgn']
+        del pc['m2m:sgn']
+
+    if pc.get('sgn') is None:
+        log.warning('[http_noti_action] m2m:sgn tag is none. m2m:notification format mismatch with oneM2M spec.')
+        return
+
+    path_arr, cinObj, rqi = parse_sgn('', pc)
+    if cinObj:
+        if (cinObj.get("sud") or cinObj.get("vrq")):
+            pass
         else:
-            print('[mqtt_noti_action] message is not noti')
+            log.debug('http notification <----')
+
+            publish_noti(path_arr, cinObj)
+    else:
+        log.warning('[http_noti_action] message is not noti')
+
+
+def publish_noti(path_arr, cinObj):
+    metrics.inc('notifications')
+
+    if http_app.getType(cinObj["con"] == 'string'):
+        thyme.muv_mqtt_client.publish('/'.join(path_arr).replace('/' + path_arr[len(path_arr) - 1], ''),
+                                      cinObj["con"])
+    else:
+        thyme.muv_mqtt_client.publish('/'.join(path_arr).replace('/' + path_arr[len(path_arr) - 1], ''),
+                                      json.dumps(cinObj["con"]))
@@ -0,0 +1,152 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Sampling CPU profiler that can be switched on in a running thyme.py.
+
+ Every conf["profiler"]["interval"] seconds a sampler thread takes the stack of
+ every thread (sys._current_frames()). At stop it writes one file of collapsed
+ stacks per thread (serial readers, paho loops, timers, uploaders...) to
+ conf["profiler"]["path"]/<start time>/, which flamegraph.pl and speedscope open:
+
+    thyme.py:<module>;http_app.py:http_watchdog;... 12
+
+ It is switched on and off by:
+    kill -USR2 <pid of thyme.py>
+    mosquitto_pub -t /nCube/profiler -m start      (or stop, or {"cmd": "start", "seconds": 30})
+ on the local broker, and stops by itself after conf["profiler"]["max_seconds"].
+ The sampling time is logged at stop, to check its overhead.
+"""
+
+import datetime, json, os, re, signal, sys, threading, time
+
+import conf
+import muv_log
+
+log = muv_log.get_logger('profiler')
+
+lock = threading.Lock()
+stop_event = None
+
+
+def thread_names():
+    import thyme
+
+    names = {}
+    for t in threading.enumerate():
+        names[t.ident] = 'timer' if isinstance(t, threading.Timer) else t.name
+    # the loop threads of paho have no name of their own
+    for name, client in [('mqtt', thyme.mqtt_client), ('muv_mqtt', thyme.muv_mqtt_client)]:
+        t = getattr(client, '_thread', None)
+        if t is not None:
+            names[t.ident] = name
+
+    return names
+
+
+def collapse(frame, depth):
+    stack = []
+    while frame is not None and len(stack) < depth:
+        code = frame.f_code
+        stack.append(os.path.basename(code.co_filename) + ':' + code.co_name)
+        frame = frame.f_back
+    stack.reverse()
+
+    return ';'.join(stack)
+
+
+def sample_loop(stop, seconds):
+    global stop_event
+
+    interval = conf.conf['profiler']['interval']
+    depth = conf.conf['profiler']['depth']
+    me = threading.get_ident()
+    started = time.monotonic()
+    started_at = datetime.datetime.now()
+    deadline = started + seconds
+    stacks = {}  # thread name -> {collapsed stack: samples}
+    names = {}
+    names_at = 0.0
+    samples = 0
+    cpu = 0.0
+
+    while not stop.wait(interval) and time.monotonic() < deadline:
+        began = time.perf_counter()
+        now = time.monotonic()
+        if now - names_at > 1.0:
+            names = thread_names()
+            names_at = now
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            counts = stacks.setdefault(names.get(ident, str(ident)), {})
+            stack = collapse(frame, depth)
+            counts[stack] = counts.get(stack, 0) + 1
+        samples += 1
+        cpu += time.perf_counter() - began
+
+    elapsed = time.monotonic() - started
+    directory = os.path.join(conf.conf['profiler']['path'], started_at.strftime('%Y-%m-%dT%H%M%S'))
+    os.makedirs(directory, exist_ok=True)
+    for name, counts in stacks.items():
+        with open(os.path.join(directory, re.sub(r'[^\w.-]', '_', name) + '.folded'), 'w') as f:
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write('{} {}\n'.format(stack, count))
+    log.info('profile of %.1f s, %d samples of %d threads in %s, sampling took %.2f%% of the time',
+             elapsed, samples, len(stacks), directory, 100.0 * cpu / max(elapsed, 1e-6))
+
+    with lock:
+        if stop_event is stop:
+            stop_event = None
+
+
+def start(seconds=None):
+    global stop_event
+
+    with lock:
+        if stop_event is not None:
+            return False
+        stop_event = threading.Event()
+        seconds = min(seconds or conf.conf['profiler']['max_seconds'], conf.conf['profiler']['max_seconds'])
+        t = threading.Thread(target=sample_loop, args=(stop_event, seconds), name='profiler', daemon=True)
+    t.start()
+    log.info('profiler started for at most %d s', seconds)
+
+    return True
+
+
+def stop():
+    with lock:
+        if stop_event is None:
+            return False
+        stop_event.set()
+
+    return True
+
+
+def toggle(*args):
+    if not stop():
+        start()
+
+
+def command(payload):
+    # payload of the control topic: 'start', 'stop' or {"cmd": "start", "seconds": 30}
+    try:
+        cmd = json.loads(payload)
+    except ValueError:
+        cmd = {'cmd': payload.strip()}
+    if not isinstance(cmd, dict):
+        cmd = {'cmd': str(cmd)}
+
+    if cmd.get('cmd') == 'start':
+        start(cmd.get('seconds'))
+    elif cmd.get('cmd') == 'stop':
+        stop()
+    else:
+        toggle()
+
+
+def init():
+    # called from the main thread, which alone can set signal handlers
+    name = conf.conf['profiler']['signal']
+    if name and hasattr(signal, name):
+        signal.signal(getattr(signal, name), toggle)
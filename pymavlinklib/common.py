@@ -139,4 +139,25 @@ mavlink['STATUSTEXT'] = 253
 mavlink['DEBUG'] = 254
 mavlink['SETUP_SIGNING'] = 256
 mavlink['BUTTON_CHANGE'] = 257
-mavlink['PLAY_TUN'] = 25
\ No newline at end of file
+mavlink['PLAY_TUN'] = 25
+
+# payload layout in wire order: (struct format, field names), 'name[n]' is an array of n values
+payload = {}
+
+payload['HEARTBEAT'] = ('<IBBBBB', ['custom_mode', 'type', 'autopilot', 'base_mode', 'system_status',
+                                    'mavlink_version'])
+payload['SYS_STATUS'] = ('<IIIHHhHHHHHHb', ['onboard_control_sensors_present', 'onboard_control_sensors_enabled',
+                                            'onboard_control_sensors_health', 'load', 'voltage_battery',
+                                            'current_battery', 'drop_rate_comm', 'errors_comm', 'errors_count1',
+                                            'errors_count2', 'errors_count3', 'errors_count4', 'battery_remaining'])
+payload['SYSTEM_TIME'] = ('<QI', ['time_unix_usec', 'time_boot_ms'])
+payload['GPS_RAW_INT'] = ('<QiiiHHHHBB', ['time_usec', 'lat', 'lon', 'alt', 'eph', 'epv', 'vel', 'cog', 'fix_type',
+                                          'satellites_visible'])
+payload['ATTITUDE'] = ('<Iffffff', ['time_boot_ms', 'roll', 'pitch', 'yaw', 'rollspeed', 'pitchspeed', 'yawspeed'])
+payload['GLOBAL_POSITION_INT'] = ('<IiiiihhhH', ['time_boot_ms', 'lat', 'lon', 'alt', 'relative_alt', 'vx', 'vy',
+                                                 'vz', 'hdg'])
+payload['VFR_HUD'] = ('<ffffhH', ['airspeed', 'groundspeed', 'alt', 'climb', 'heading', 'throttle'])
+payload['TIMESYNC'] = ('<qq', ['tc1', 'ts1'])
+payload['BATTERY_STATUS'] = ('<iih10HhBBBb', ['current_consumed', 'energy_consumed', 'temperature', 'voltages[10]',
+                                              'current_battery', 'id', 'battery_function', 'type',
+                                              'battery_remaining'])
@@ -0,0 +1,138 @@
+# -*-coding:utf-8 -*-
+
+"""
+ On-board telemetry rollups.
+
+ The dispatcher hands every frame of a vehicle to sample(), which keeps the
+ columns of position, altitude, speed and battery of the messages below as
+ rows. Every conf["rollup"]["window"] seconds the rows of each vehicle are
+ turned into NumPy arrays and reduced column-wise to [min, max, mean, last],
+ and posted as one CIN to <Drone_Data>/<drone>/<conf["rollup"]["container"]>,
+ next to the sortie containers:
+
+    {"sortie": "disarm", "start": "2024-05-01T10:00:00.000", "end": "...", "count": 5,
+     "lat": [37.4031, 37.4036, 37.4034, 37.4036], "groundspeed": [...], ...}
+"""
+
+import datetime, struct, threading, time
+
+import conf
+import http_adn
+import muv_log
+from pymavlinklib import common
+
+log = muv_log.get_logger('rollup')
+
+# msgid: (payload struct, [(column, index of the payload field, scale)])
+columns = {}
+for name, fields in [('GLOBAL_POSITION_INT', [('lat', 'lat', 1e-7), ('lon', 'lon', 1e-7), ('alt', 'alt', 1e-3),
+                                              ('relative_alt', 'relative_alt', 1e-3), ('vx', 'vx', 1e-2),
+                                              ('vy', 'vy', 1e-2), ('vz', 'vz', 1e-2)]),
+                     ('VFR_HUD', [('airspeed', 'airspeed', 1.0), ('groundspeed', 'groundspeed', 1.0),
+                                  ('climb', 'climb', 1.0)]),
+                     ('SYS_STATUS', [('voltage', 'voltage_battery', 1e-3), ('current', 'current_battery', 1e-2),
+                                     ('battery_remaining', 'battery_remaining', 1.0)])]:
+    fmt, payload_fields = common.payload[name]
+    columns[common.mavlink[name]] = (struct.Struct(fmt), [(c, payload_fields.index(f), s) for c, f, s in fields])
+
+running = False
+
+lock = threading.Lock()
+buffers = {}  # vehicle name -> {msgid: [row, ...]} of the current window
+started_at = {}  # vehicle name -> datetime of the window start
+vehicles = {}  # vehicle name -> Vehicle
+
+
+def sample(v, frame):
+    if frame[0] == 0xfd:
+        msgid = frame[7] | (frame[8] << 8) | (frame[9] << 16)
+        payload = frame[10:10 + frame[1]]
+    else:
+        msgid = frame[5]
+        payload = frame[6:6 + frame[1]]
+
+    spec = columns.get(msgid)
+    if spec is None:
+        return
+
+    packer, fields = spec
+    if len(payload) < packer.size:  # MAVLink 2 truncates trailing zero bytes
+        payload = payload + bytes(packer.size - len(payload))
+    values = packer.unpack_from(payload)
+    row = tuple(values[idx] for column, idx, scale in fields)
+
+    with lock:
+        rows = buffers.get(v.name)
+        if rows is None:
+            rows = buffers[v.name] = {}
+            started_at[v.name] = datetime.datetime.now()
+            vehicles[v.name] = v
+        rows.setdefault(msgid, []).append(row)
+
+
+def reduce(rows):
+    """
+    Returns {column: [min, max, mean, last]} of the rows of each message.
+    """
+
+    import numpy as np
+
+    summary = {}
+    for msgid, message_rows in rows.items():
+        fields = columns[msgid][1]
+        scales = np.array([scale for column, idx, scale in fields])
+        values = np.array(message_rows, dtype=np.float64) * scales
+        stats = np.stack([values.min(axis=0), values.max(axis=0), values.mean(axis=0), values[-1]])
+        for i, (column, idx, scale) in enumerate(fields):
+            summary[column] = [round(float(x), 7) for x in stats[:, i]]
+
+        if msgid == common.mavlink['GLOBAL_POSITION_INT']:
+            speed = np.hypot(values[:, 4], values[:, 5])
+            summary['speed'] = [round(float(x), 3) for x in (speed.min(), speed.max(), speed.mean(), speed[-1])]
+
+    return summary
+
+
+def roll():
+    now = datetime.datetime.now()
+    with lock:
+        windows = [(name, rows, started_at[name]) for name, rows in buffers.items()]
+        buffers.clear()
+
+    for name, rows, started in windows:
+        v = vehicles[name]
+        content = {
+            'sortie': v.sortie_name,
+            'start': started.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3],
+            'end': now.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3],
+            'count': sum(len(r) for r in rows.values()),
+        }
+        content.update(reduce(rows))
+        container = v.parent_cnt_name + '/' + conf.conf['rollup']['container']
+        http_adn.crtci(container + '?rcn=0', 0, content, None, 'telemetry')
+
+
+def create_container(v):
+    rsc, res_body, count = http_adn.crtct(v.parent_cnt_name + '?rcn=0', conf.conf['rollup']['container'], 0)
+
+    return rsc
+
+
+def roll_loop():
+    while True:
+        time.sleep(conf.conf['rollup']['window'])
+        try:
+            roll()
+        except Exception as e:
+            log.warning('rollup: %s', e)
+
+
+def start():
+    global running
+
+    if running:
+        return
+    running = True
+
+    t = threading.Thread(target=roll_loop, name='rollup', daemon=True)
+    t.start()
@@ -0,0 +1,211 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Store-and-forward spool of the CIN writes that could not reach the CSE.
+
+ Failed writes are kept in a SQLite database in WAL mode, bounded by
+ conf["spool"] max_rows, max_bytes and max_age. They are buffered and committed
+ commit_rows at a time in one transaction, or after commit_interval seconds, as
+ every commit rewrites whole pages of the WAL and of the index on the SD card.
+ A drain thread sends them again in batches, several at a time, as soon as the
+ CSE answers again.
+"""
+
+import atexit, sqlite3, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import conf
+import http_adn
+import metrics
+
+db = None
+lock = threading.Lock()
+alive = threading.Event()
+
+depth = 0
+depth_bytes = 0
+spooled_count = 0
+drained_count = 0
+dropped_count = 0
+drain_rate = 0.0
+
+pending = []  # rows put and not committed yet
+inflight_max = 0  # highest id the drain is sending, the eviction keeps the rows up to it
+inflight_rows = 0  # rows and bytes the drain is sending, not counted against max_rows and max_bytes
+inflight_bytes = 0
+
+
+def start():
+    global db
+    global depth
+    global depth_bytes
+
+    with lock:
+        if db is not None:
+            return
+
+        db = sqlite3.connect(conf.conf['spool']['path'], check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL, '
+                   'prio TEXT, path TEXT, ty TEXT, body TEXT)')
+        depth, depth_bytes = db.execute('SELECT COUNT(*), IFNULL(SUM(LENGTH(body)), 0) FROM spool').fetchone()
+
+    atexit.register(flush)
+    t = threading.Thread(target=drain_loop, name='spool', daemon=True)
+    t.start()
+
+
+def put(path, ty, bodyString, prio):
+    global depth
+    global depth_bytes
+    global spooled_count
+
+    if db is None:
+        start()
+
+    with lock:
+        pending.append((time.time(), prio, path, ty, bodyString))
+        depth += 1
+        depth_bytes += len(bodyString)
+        spooled_count += 1
+
+        if len(pending) >= conf.conf['spool']['commit_rows']:
+            commit_pending()
+
+
+def commit_pending():
+    # called with the lock held
+    global depth
+    global depth_bytes
+    global dropped_count
+
+    if len(pending) == 0:
+        return
+
+    db.execute('BEGIN')
+    db.executemany('INSERT INTO spool (created, prio, path, ty, body) VALUES (?, ?, ?, ?, ?)', pending)
+    del pending[:]
+
+    while depth - inflight_rows > 1 and (depth - inflight_rows > conf.conf['spool']['max_rows'] or
+                                         depth_bytes - inflight_bytes > conf.conf['spool']['max_bytes']):
+        row = db.execute('SELECT id, LENGTH(body) FROM spool WHERE id > ? ORDER BY id LIMIT 1',
+                         (inflight_max,)).fetchone()
+        if row is None:
+            break
+        db.execute('DELETE FROM spool WHERE id = ?', (row[0],))
+        depth -= 1
+        depth_bytes -= row[1]
+        dropped_count += 1
+    db.execute('COMMIT')
+
+
+def flush():
+    if db is None:
+        return
+
+    with lock:
+        commit_pending()
+
+
+def cse_alive():
+    if depth > 0:
+        alive.set()
+
+
+def expire():
+    global depth
+    global depth_bytes
+    global dropped_count
+
+    with lock:
+        before = time.time() - conf.conf['spool']['max_age']
+        count, size = db.execute('SELECT COUNT(*), IFNULL(SUM(LENGTH(body)), 0) FROM spool WHERE created < ?',
+                                 (before,)).fetchone()
+        if count > 0:
+            db.execute('DELETE FROM spool WHERE created < ?', (before,))
+            depth -= count
+            depth_bytes -= size
+            dropped_count += count
+
+
+def send(row):
+    rsc, res_body = http_adn.http_request(conf.conf['ae']['id'], row[2], 'POST', row[3], row[4], row[1])
+
+    return row, rsc
+
+
+def drain_loop():
+    global depth
+    global depth_bytes
+    global drained_count
+    global drain_rate
+
+    global inflight_max
+    global inflight_rows
+    global inflight_bytes
+
+    pool = ThreadPoolExecutor(max_workers=max(1, int(conf.conf['spool']['concurrency'])))
+    tried = time.monotonic()
+
+    while True:
+        woken = alive.wait(conf.conf['spool']['commit_interval'])
+        flush()
+        if not woken and time.monotonic() - tried < conf.conf['spool']['retry']:
+            continue
+        alive.clear()
+        tried = time.monotonic()
+        if depth == 0:
+            continue
+
+        expire()
+
+        started = time.monotonic()
+        count = 0
+        while True:
+            with lock:
+                commit_pending()
+                rows = db.execute('SELECT id, prio, path, ty, body FROM spool ORDER BY id LIMIT ?',
+                                  (conf.conf['spool']['batch'],)).fetchall()
+                inflight_max = rows[-1][0] if len(rows) > 0 else 0
+                inflight_rows = len(rows)
+                inflight_bytes = sum(len(row[4]) for row in rows)
+            if len(rows) == 0:
+                break
+
+            sent = []
+            for row, rsc in pool.map(send, rows):
+                if rsc != 9999:
+                    sent.append(row)
+
+            with lock:
+                db.execute('BEGIN')
+                db.executemany('DELETE FROM spool WHERE id = ?', [(row[0],) for row in sent])
+                db.execute('COMMIT')
+                inflight_max = inflight_rows = inflight_bytes = 0
+                depth -= len(sent)
+                depth_bytes -= sum(len(row[4]) for row in sent)
+                drained_count += len(sent)
+            count += len(sent)
+
+            if len(sent) < len(rows):
+                break
+
+        if count > 0:
+            drain_rate = count / max(time.monotonic() - started, 1e-6)
+
+
+metrics.gauge('spool_depth', lambda: depth)
+metrics.gauge('spool_dropped', lambda: dropped_count)
+metrics.gauge('spool_drain_rate', lambda: drain_rate)
+
+
+def stats():
+    return {
+        'depth': depth,
+        'depth_bytes': depth_bytes,
+        'spooled': spooled_count,
+        'drained': drained_count,
+        'dropped': dropped_count,
+        'drain_rate': drain_rate
+    }
@@ -0,0 +1,96 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Latest decoded telemetry of a vehicle.
+
+ The serial thread calls update() after decoding a message; any thread reads a
+ consistent snapshot() without subscribing to the MUV topics. Each message type
+ is a Record whose values are an immutable tuple, replaced as a whole under the
+ lock, so a snapshot only copies references. The store keeps a version counter,
+ bumped when a value changes, and a JSON form rebuilt only when the version
+ moved. ae_http serves it as GET /telemetry[/<flight>].
+"""
+
+import json, threading, time
+
+
+class Record:
+    __slots__ = ('fields', 'values', 'version', 'updated')
+
+    def __init__(self, fields, values, version, updated):
+        self.fields = fields
+        self.values = values
+        self.version = version
+        self.updated = updated
+
+    def as_dict(self):
+        return dict(zip(self.fields, self.values))
+
+
+class Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}  # message name -> Record
+        self.version = 0
+        self.json_version = -1
+        self.json_cache = '{}'
+
+    def update(self, name, content):
+        """
+        content: dict of the decoded fields. Returns True when a value changed.
+        """
+
+        now = time.monotonic()
+        with self.lock:
+            record = self.records.get(name)
+            if record is None or record.fields != tuple(content):
+                fields = tuple(content)
+                values = tuple(content.values())
+                self.version += 1
+                self.records[name] = Record(fields, values, self.version, now)
+                return True
+
+            values = tuple(content.values())
+            record.updated = now
+            if values == record.values:
+                return False
+            self.version += 1
+            record.values = values
+            record.version = self.version
+
+            return True
+
+    def get(self, name):
+        with self.lock:
+            record = self.records.get(name)
+            if record is None:
+                return None
+            return record.as_dict()
+
+    def snapshot(self):
+        """
+        Returns (version, {message name: (fields, values, version, updated)}).
+        """
+
+        with self.lock:
+            return self.version, {name: (r.fields, r.values, r.version, r.updated)
+                                  for name, r in self.records.items()}
+
+    def json(self):
+        """
+        Returns (version, JSON string of {message name: {field: value}}).
+        """
+
+        with self.lock:
+            if self.json_version == self.version:
+                return self.version, self.json_cache
+            version = self.version
+            records = {name: r.as_dict() for name, r in self.records.items()}
+
+        text = json.dumps(records)
+        with self.lock:
+            if version > self.json_version:
+                self.json_version = version
+                self.json_cache = text
+
+        return version, text
@@ -0,0 +1,33 @@
+# -*-coding:utf-8 -*-
+
+import os, socket, sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import conf
+import local_cse
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope='session')
+def cse_server():
+    port = free_port()
+    server = local_cse.start(port)
+    yield port
+    server.shutdown()
+
+
+@pytest.fixture
+def cse(cse_server, monkeypatch):
+    # http_adn talks to the in-process local_cse
+    monkeypatch.setitem(conf.conf['cse'], 'host', '127.0.0.1')
+    monkeypatch.setitem(conf.conf['cse'], 'port', str(cse_server))
+
+    return local_cse
@@ -0,0 +1,69 @@
+# -*-coding:utf-8 -*-
+
+import json, threading
+
+import pytest
+
+import conf
+import flight_ledger
+from flight_ledger import HISTORY
+
+
+@pytest.fixture
+def ledger(cse, tmp_path, monkeypatch):
+    monkeypatch.setitem(conf.conf['ledger'], 'path', str(tmp_path / 'flight_ledger.json'))
+    monkeypatch.setattr(flight_ledger, 'ledger', None)
+    # the tests call reconcile() and sync_one() themselves, without the sync thread
+    monkeypatch.setattr(flight_ledger, 'sync_thread', threading.current_thread())
+    cse.seed('/Mobius/Life_Prediction', '2', {'api': 'local_cse', 'rr': True})
+    cse.seed(HISTORY, '3', {})
+
+    return flight_ledger
+
+
+def remote_la(cse, name):
+    rsc, cin = cse.retrieve(HISTORY + '/' + name + '/la')
+
+    return cin['con'] if rsc == 2000 else None
+
+
+def test_reconcile_adopts_a_remote_total_ahead(ledger, cse):
+    cse.seed(HISTORY + '/ledger_ahead', '3', {})
+    cse.create(HISTORY + '/ledger_ahead', '4', {'con': {'total_flight_time': 500, 'battery_cycles': 7,
+                                                        'arming_time': 100, 'sortie_name': 'old'}})
+
+    assert ledger.record('ledger_ahead', 's1', 60) == 60
+    assert ledger.reconcile('ledger_ahead')
+    assert ledger.total('ledger_ahead') == 560
+
+    assert ledger.sync_one('ledger_ahead')
+    # the entry is merged into the last con, battery_cycles carries on
+    assert remote_la(cse, 'ledger_ahead') == {'total_flight_time': 560, 'battery_cycles': 7, 'arming_time': 60,
+                                              'sortie_name': 's1'}
+    assert ledger.ledger['ledger_ahead']['pending'] == []
+    assert ledger.ledger['ledger_ahead']['synced'] == 560
+
+
+def test_sync_creates_the_container_of_a_new_vehicle(ledger, cse):
+    ledger.record('ledger_new', 's1', 30)
+    ledger.record('ledger_new', 's2', 45)
+
+    assert ledger.reconcile('ledger_new')
+    assert ledger.sync_one('ledger_new')
+    assert ledger.sync_one('ledger_new')
+
+    assert remote_la(cse, 'ledger_new') == {'total_flight_time': 75, 'arming_time': 45, 'sortie_name': 's2'}
+    assert ledger.ledger['ledger_new']['synced'] == 75
+
+
+def test_entries_wait_while_the_cse_is_unreachable(ledger, cse, monkeypatch):
+    ledger.record('ledger_offline', 's1', 30)
+    monkeypatch.setitem(conf.conf['cse'], 'port', '1')
+
+    assert not ledger.sync_one('ledger_offline')
+
+    with open(conf.conf['ledger']['path'], 'r') as f:
+        saved = json.load(f)
+    assert [entry['sortie_name'] for entry in saved['ledger_offline']['pending']] == ['s1']
+    assert saved['ledger_offline']['total_flight_time'] == 30
+    assert remote_la(cse, 'ledger_offline') is None
@@ -0,0 +1,78 @@
+# -*-coding:utf-8 -*-
+
+import datetime, struct
+
+import pytest
+
+import conf
+import frame_clock
+from pymavlinklib import common
+
+
+def attitude(time_boot_ms, sysid=1, compid=1):
+    payload = struct.pack(common.payload['ATTITUDE'][0], time_boot_ms, 0, 0, 0, 0, 0, 0)
+
+    return bytes([0xfe, len(payload), 0, sysid, compid, common.mavlink['ATTITUDE']]) + payload + b'\x00\x00'
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setitem(conf.conf['clock'], 'window', 10)
+
+    return frame_clock.FcClock()
+
+
+def test_offset_is_the_sample_that_waited_least(clock):
+    # booted at monotonic 100.0, frames delayed 30, 5 and 12 ms on the link
+    for boot_ms, delay in [(1000, 0.030), (1100, 0.005), (1200, 0.012)]:
+        clock.sample(100.0 + boot_ms / 1000.0 + delay, attitude(boot_ms), 1)
+
+    assert clock.offset == pytest.approx(100.005)
+    # aggregated at the time the autopilot sampled it, not when it arrived
+    assert clock.sample(101.330, attitude(1300), 1) == pytest.approx(101.305)
+
+
+def test_offset_follows_the_drift_window_by_window(clock):
+    clock.sample(101.000, attitude(1000), 1)
+    clock.sample(105.000, attitude(5000), 1)
+    assert clock.offset == pytest.approx(100.0)
+
+    # the autopilot clock fell 2 ms behind; a window later the estimate follows
+    clock.sample(111.002, attitude(11000), 1)
+    assert clock.offset == pytest.approx(100.0)
+    clock.sample(115.002, attitude(15000), 1)
+    clock.sample(121.002, attitude(21000), 1)
+    assert clock.offset == pytest.approx(100.002)
+
+
+def test_reboot_of_the_autopilot_restarts_the_estimate(clock):
+    clock.sample(160.000, attitude(60000), 1)
+    assert clock.offset == pytest.approx(100.0)
+
+    clock.sample(170.500, attitude(500), 1)
+    assert clock.offset == pytest.approx(170.0)
+
+
+def test_other_systems_and_components_are_ignored(clock):
+    assert clock.sample(101.0, attitude(1000, compid=154), 1) == 101.0
+    assert clock.sample(101.0, attitude(1000, sysid=2), 1) == 101.0
+    assert clock.samples == 0
+    assert clock.offset is None
+
+    clock.sample(101.0, attitude(1000, sysid=2), 2)
+    assert clock.samples == 1
+
+
+def test_sampled_time_is_never_after_the_receive_time(clock):
+    clock.sample(101.000, attitude(1000), 1)
+
+    # the frame is stamped earlier than the estimate says it was sampled
+    assert clock.sample(101.090, attitude(1100), 1) == 101.090
+
+
+def test_timestamp_is_the_aggregation_key():
+    wall_ms = 1714557600123
+    expected = datetime.datetime.fromtimestamp(wall_ms / 1000.0).strftime('%Y-%m-%dT%H:%M:%S%f')[:-3]
+
+    assert frame_clock.timestamp(wall_ms) == expected
+    assert frame_clock.timestamp(wall_ms + 5) == expected[:-3] + '128'
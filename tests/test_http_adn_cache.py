@@ -0,0 +1,59 @@
+# -*-coding:utf-8 -*-
+
+import pytest
+
+import conf
+import http_adn
+
+DRONE = '/Mobius/KETI_MUV/Drone_Data/cache_drone'
+
+
+@pytest.fixture
+def cache(cse, monkeypatch):
+    monkeypatch.setitem(conf.conf['cache'], 'enable', True)
+    monkeypatch.setitem(conf.conf['cache'], 'ttl', 60)
+    http_adn.retrieve_cache.clear()
+    cse.seed('/Mobius/KETI_MUV', '2', {'api': 'local_cse', 'rr': True})
+    cse.seed('/Mobius/KETI_MUV/Drone_Data', '3', {})
+    cse.seed(DRONE, '3', {})
+    cse.create(DRONE, '4', {'con': 'first'})
+
+    yield http_adn
+
+    http_adn.retrieve_cache.clear()
+
+
+def gets(cse):
+    return cse.stats['requests'].get('GET', 0)
+
+
+def test_retrieve_is_served_from_the_cache(cache, cse):
+    before = gets(cse)
+
+    assert http_adn.rtvct(DRONE + '/la', 0)[1]['m2m:cin']['con'] == 'first'
+    assert http_adn.rtvct(DRONE + '/la', 0)[1]['m2m:cin']['con'] == 'first'
+    assert gets(cse) == before + 1
+
+    http_adn.rtvct(DRONE + '/la', 0, refresh=True)
+    assert gets(cse) == before + 2
+
+
+def test_write_under_a_path_invalidates_it(cache, cse):
+    http_adn.rtvct(DRONE + '/la', 0)
+    http_adn.rtvct(DRONE, 0)
+    http_adn.rtvct('/Mobius/KETI_MUV/Drone_Data', 0)
+
+    http_adn.crtci(DRONE + '?rcn=0', 0, 'second', None)
+
+    assert DRONE + '/la' not in http_adn.retrieve_cache
+    assert DRONE not in http_adn.retrieve_cache
+    assert '/Mobius/KETI_MUV/Drone_Data' in http_adn.retrieve_cache
+    assert http_adn.rtvct(DRONE + '/la', 0)[1]['m2m:cin']['con'] == 'second'
+
+
+def test_failed_retrieve_is_not_cached(cache, cse):
+    before = gets(cse)
+
+    assert http_adn.rtvct(DRONE + '/missing', 0)[0] == 4004
+    assert http_adn.rtvct(DRONE + '/missing', 0)[0] == 4004
+    assert gets(cse) == before + 2
@@ -0,0 +1,90 @@
+# -*-coding:utf-8 -*-
+
+import logging
+
+import pytest
+
+import mav_route
+from mav_route import ROUTE_MQTT, ROUTE_MOBIUS, ROUTE_LOCAL
+
+
+def v1(sysid, compid, msgid):
+    return 'fe09{:02x}{:02x}{:02x}{:02x}'.format(0, sysid, compid, msgid) + '00' * 9 + '0000'
+
+
+def v2(sysid, compid, msgid):
+    msgid_hex = ''.join('{:02x}'.format((msgid >> shift) & 0xff) for shift in (0, 8, 16))
+    return 'fd09000000{:02x}{:02x}'.format(sysid, compid) + msgid_hex + '00' * 9 + '0000'
+
+
+@pytest.fixture(autouse=True)
+def default_routes():
+    yield
+    mav_route.compile_routes([{'sysid': '*', 'compid': '*', 'msgid': '*', 'sink': ['mqtt', 'mobius', 'local']}], 8)
+
+
+def test_first_matching_rule_wins():
+    mav_route.compile_routes([
+        {'sysid': 1, 'compid': '*', 'msgid': 0, 'sink': ['mqtt']},
+        {'sysid': 1, 'compid': '*', 'msgid': '*', 'sink': ['mobius', 'local']},
+        {'sysid': '*', 'compid': '*', 'msgid': '*', 'sink': ['mqtt']},
+    ], 1)
+
+    assert mav_route.route_of(v1(1, 1, 0)) == ROUTE_MQTT
+    assert mav_route.route_of(v1(1, 1, 30)) == ROUTE_MOBIUS | ROUTE_LOCAL
+    assert mav_route.route_of(v1(1, 154, 30)) == ROUTE_MOBIUS | ROUTE_LOCAL
+    assert mav_route.route_of(v1(2, 1, 0)) == ROUTE_MQTT
+
+
+def test_compid_and_extended_msgid():
+    mav_route.compile_routes([
+        {'sysid': 1, 'compid': 154, 'msgid': '*', 'sink': []},
+        {'sysid': 1, 'compid': '*', 'msgid': [30, 12901], 'sink': ['local']},
+        {'sysid': 1, 'compid': '*', 'msgid': '*', 'sink': ['mqtt']},
+    ], 1)
+
+    assert mav_route.route_of(v1(1, 154, 30)) == 0
+    assert mav_route.route_of(v2(1, 1, 30)) == ROUTE_LOCAL
+    assert mav_route.route_of(v2(1, 1, 12901)) == ROUTE_LOCAL
+    assert mav_route.route_of(v2(1, 1, 12900)) == ROUTE_MQTT
+    assert mav_route.route_of(v2(1, 154, 12901)) == 0
+
+
+def test_no_matching_rule_drops():
+    mav_route.compile_routes([{'sysid': 1, 'compid': '*', 'msgid': '*', 'sink': ['mqtt']}], 1)
+
+    assert mav_route.route_of(v1(2, 1, 0)) == 0
+
+
+def test_self_is_the_system_id_of_each_vehicle():
+    mav_route.compile_routes([
+        {'sysid': 'self', 'compid': '*', 'msgid': '*', 'sink': ['mqtt', 'mobius', 'local']},
+        {'sysid': '*', 'compid': '*', 'msgid': '*', 'sink': ['mqtt']},
+    ], [1, 2])
+
+    assert mav_route.route_of(v1(1, 1, 33)) == mav_route.ROUTE_ALL
+    assert mav_route.route_of(v1(2, 1, 33)) == mav_route.ROUTE_ALL
+    assert mav_route.route_of(v1(3, 1, 33)) == ROUTE_MQTT
+
+
+def test_unrouted_autopilot_is_reported_once(caplog):
+    mav_route.foreign_warned.clear()
+    mav_route.compile_routes([
+        {'sysid': 'self', 'compid': '*', 'msgid': '*', 'sink': ['mqtt', 'mobius', 'local']},
+        {'sysid': '*', 'compid': '*', 'msgid': '*', 'sink': ['mqtt']},
+    ], 8)
+
+    with caplog.at_level(logging.WARNING, logger='nCube.route'):
+        mav_route.route_of(v1(255, 190, 0))  # heartbeat of a GCS
+        mav_route.route_of(v1(1, 1, 0))
+        mav_route.route_of(v1(1, 1, 0))
+
+    assert [r.getMessage().startswith('heartbeat of the autopilot of system 1') for r in caplog.records] == [True]
+
+    mav_route.route_of(v1(8, 1, 0))
+    assert mav_route.self_seen
+
+
+def test_too_many_classes():
+    with pytest.raises(ValueError, match='too many distinct'):
+        mav_route.compile_routes([{'sysid': list(range(20)), 'compid': list(range(20)), 'sink': ['mqtt']}], 1)
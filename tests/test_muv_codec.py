@@ -0,0 +1,103 @@
+# -*-coding:utf-8 -*-
+
+import json, struct
+
+import pytest
+
+import conf
+import muv_codec
+
+POSITION = {'time_boot_ms': 81250, 'lat': 374036120, 'lon': 1271036640, 'alt': 52310, 'relative_alt': 10250,
+            'vx': -120, 'vy': 35, 'vz': -4, 'hdg': 35999}
+HEARTBEAT = {'custom_mode': 4, 'type': 2, 'autopilot': 3, 'base_mode': -127, 'system_status': 4,
+             'mavlink_version': 3}
+
+
+@pytest.fixture
+def codec(monkeypatch):
+    def init(encoding, delta=False):
+        monkeypatch.setitem(conf.conf['muv'], 'encoding', encoding)
+        monkeypatch.setitem(conf.conf['muv'], 'delta', delta)
+        muv_codec.init()
+
+        return muv_codec
+
+    monkeypatch.setattr(muv_codec, 'mode', None)
+    monkeypatch.setattr(muv_codec, 'encode', muv_codec.encode)
+    monkeypatch.setattr(muv_codec, 'payload', muv_codec.payload)
+    muv_codec.deltas.clear()
+
+    return init
+
+
+@pytest.mark.parametrize('encoding', ['json', 'struct'])
+@pytest.mark.parametrize('name,content', [('global_position_int', POSITION), ('heartbeat', HEARTBEAT)])
+def test_round_trip(codec, encoding, name, content):
+    codec(encoding)
+
+    payload = muv_codec.payload('/Mobius/KETI_MUV/Drone_Data/d/' + name, name, content)
+    assert muv_codec.decoders[encoding](name, payload) == content
+
+
+def test_struct_is_the_published_layout(codec):
+    codec('struct')
+
+    payload = muv_codec.encode('global_position_int', POSITION)
+    layout = json.loads(muv_codec.schema())['global_position_int']
+    assert len(payload) == struct.calcsize(layout['format']) == 28
+    assert dict(zip(layout['fields'], struct.unpack(layout['format'], payload))) == POSITION
+
+
+def test_struct_fills_missing_fields_with_zero(codec):
+    codec('struct')
+
+    assert muv_codec.decode_struct('heartbeat', muv_codec.encode('heartbeat', {'type': 2}))['custom_mode'] == 0
+
+
+class Clock:
+    now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_delta_carries_the_changed_fields(codec, monkeypatch):
+    codec('json', delta=True)
+    clock = Clock()
+    monkeypatch.setattr(muv_codec, 'time', clock)
+    topic = '/Mobius/KETI_MUV/Drone_Data/d/global_position_int'
+
+    first = json.loads(muv_codec.payload(topic, 'global_position_int', POSITION))
+    assert first == {'seq': 1, 'keyframe': True, 'fields': POSITION}
+
+    clock.now += 1
+    moved = dict(POSITION, lat=POSITION['lat'] + 10, time_boot_ms=POSITION['time_boot_ms'] + 1000)
+    second = json.loads(muv_codec.payload(topic, 'global_position_int', moved))
+    assert second == {'seq': 2, 'keyframe': False, 'fields': {'lat': moved['lat'],
+                                                               'time_boot_ms': moved['time_boot_ms']}}
+
+    # only an ignored field changed
+    clock.now += 1
+    assert muv_codec.payload(topic, 'global_position_int', dict(moved, time_boot_ms=83250)) is None
+
+    # a subscriber applying the deltas has the last content
+    state = dict(first['fields'])
+    state.update(second['fields'])
+    assert state == moved
+
+    clock.now += conf.conf['muv']['keyframe_interval']
+    keyframe = json.loads(muv_codec.payload(topic, 'global_position_int', moved))
+    assert keyframe['seq'] == 3 and keyframe['keyframe'] and keyframe['fields'] == moved
+
+
+def test_init_again_keeps_the_sequences(codec):
+    codec('json', delta=True)
+    topic = '/Mobius/KETI_MUV/Drone_Data/d/heartbeat'
+    muv_codec.payload(topic, 'heartbeat', HEARTBEAT)
+
+    muv_codec.init()
+    assert json.loads(muv_codec.payload(topic, 'heartbeat', dict(HEARTBEAT, base_mode=81)))['seq'] == 2
+
+    codec('struct', delta=True)
+    assert muv_codec.payload is muv_codec.payload_full
+    assert muv_codec.deltas == {}
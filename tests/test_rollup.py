@@ -0,0 +1,82 @@
+# -*-coding:utf-8 -*-
+
+import struct
+
+import pytest
+
+import rollup
+import vehicle
+from pymavlinklib import common
+
+DRONE = '/Mobius/KETI_MUV/Drone_Data/rollup_drone'
+
+
+def frame_v1(name, values):
+    payload = struct.pack(common.payload[name][0], *values)
+
+    return bytes([0xfe, len(payload), 0, 1, 1, common.mavlink[name]]) + payload + b'\x00\x00'
+
+
+def frame_v2(name, values):
+    payload = struct.pack(common.payload[name][0], *values).rstrip(b'\x00')
+    msgid = common.mavlink[name]
+
+    return bytes([0xfd, len(payload), 0, 0, 0, 1, 1, msgid & 0xff, (msgid >> 8) & 0xff, msgid >> 16]) + \
+        payload + b'\x00\x00'
+
+
+def position(lat, vx, vy):
+    return 1000, lat, 1270000000, 50000, 10000, vx, vy, 0, 0
+
+
+@pytest.fixture
+def drone(monkeypatch):
+    monkeypatch.setattr(rollup, 'buffers', {})
+    monkeypatch.setattr(rollup, 'started_at', {})
+    monkeypatch.setattr(rollup, 'vehicles', {})
+    v = vehicle.Vehicle('rollup_drone', None)
+    v.parent_cnt_name = DRONE
+
+    return v
+
+
+def test_reduce_gives_min_max_mean_last(drone):
+    for lat, vx, vy in [(370000000, 300, 400), (370000020, 0, 0), (370000010, -600, 800)]:
+        rollup.sample(drone, frame_v1('GLOBAL_POSITION_INT', position(lat, vx, vy)))
+    rollup.sample(drone, frame_v1('HEARTBEAT', (0, 2, 3, 81, 4, 3)))
+
+    summary = rollup.reduce(rollup.buffers['rollup_drone'])
+    assert summary['lat'] == [37.0, 37.000002, 37.000001, 37.000001]
+    assert summary['vx'] == [-6.0, 3.0, -1.0, -6.0]
+    assert summary['speed'] == [0.0, 10.0, 5.0, 10.0]
+    assert summary['relative_alt'] == [10.0, 10.0, 10.0, 10.0]
+
+
+def test_truncated_v2_payload_is_zero_filled(drone):
+    rollup.sample(drone, frame_v2('VFR_HUD', (12.5, 11.0, 30.0, 0.0, 0, 0)))
+
+    summary = rollup.reduce(rollup.buffers['rollup_drone'])
+    assert summary['groundspeed'] == [11.0, 11.0, 11.0, 11.0]
+    assert summary['climb'] == [0.0, 0.0, 0.0, 0.0]
+
+
+def test_roll_posts_one_cin_per_window(drone, cse):
+    cse.seed('/Mobius/KETI_MUV', '2', {'api': 'local_cse', 'rr': True})
+    cse.seed('/Mobius/KETI_MUV/Drone_Data', '3', {})
+    cse.seed(DRONE, '3', {})
+    assert rollup.create_container(drone) in (2001, 4105)
+
+    rollup.sample(drone, frame_v1('GLOBAL_POSITION_INT', position(370000000, 300, 400)))
+    rollup.sample(drone, frame_v1('GLOBAL_POSITION_INT', position(370000020, 0, 0)))
+    rollup.roll()
+
+    rsc, cin = cse.retrieve(DRONE + '/rollup/la')
+    assert rsc == 2000
+    assert cin['con']['sortie'] == 'disarm'
+    assert cin['con']['count'] == 2
+    assert cin['con']['speed'] == [0.0, 5.0, 2.5, 0.0]
+    assert rollup.buffers == {}
+
+    # an empty window posts nothing
+    rollup.roll()
+    assert cse.retrieve(DRONE + '/rollup')[1]['cni'] == 1
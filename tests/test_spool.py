@@ -0,0 +1,187 @@
+# -*-coding:utf-8 -*-
+
+import threading, time
+
+import pytest
+
+import conf
+import http_adn
+import spool
+
+PATH = '/Mobius/KETI_MUV/Drone_Data/Dione/disarm?rcn=0'
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+
+    return True
+
+
+def rows():
+    with spool.lock:
+        return [row[0] for row in spool.db.execute('SELECT body FROM spool ORDER BY id')]
+
+
+@pytest.fixture(scope='module')
+def spool_db(tmp_path_factory):
+    # one drain thread for the module, woken only by cse_alive()
+    conf.conf['spool']['path'] = str(tmp_path_factory.mktemp('spool') / 'spool.db')
+    conf.conf['spool']['retry'] = 3600
+    conf.conf['spool']['commit_interval'] = 3600
+    spool.start()
+
+    return spool
+
+
+@pytest.fixture
+def empty_spool(spool_db, monkeypatch):
+    monkeypatch.setitem(conf.conf['spool'], 'commit_rows', 1)
+    monkeypatch.setitem(conf.conf['spool'], 'max_rows', 1000)
+    monkeypatch.setitem(conf.conf['spool'], 'max_bytes', 1 << 20)
+    monkeypatch.setitem(conf.conf['spool'], 'batch', 100)
+    with spool.lock:
+        del spool.pending[:]
+        spool.db.execute('DELETE FROM spool')
+        spool.depth = spool.depth_bytes = spool.dropped_count = 0
+
+    return spool
+
+
+def test_puts_are_committed_in_batches(empty_spool, monkeypatch):
+    monkeypatch.setitem(conf.conf['spool'], 'commit_rows', 3)
+
+    spool.put(PATH, '4', 'a', 'telemetry')
+    spool.put(PATH, '4', 'b', 'telemetry')
+    assert rows() == []
+    assert spool.depth == 2
+
+    spool.put(PATH, '4', 'c', 'telemetry')
+    spool.put(PATH, '4', 'd', 'telemetry')
+    assert rows() == ['a', 'b', 'c']
+
+    spool.flush()
+    assert rows() == ['a', 'b', 'c', 'd']
+    assert spool.depth == 4
+
+
+def test_eviction_drops_the_oldest(empty_spool, monkeypatch):
+    monkeypatch.setitem(conf.conf['spool'], 'max_rows', 3)
+
+    for body in 'abcde':
+        spool.put(PATH, '4', body, 'telemetry')
+
+    assert rows() == ['c', 'd', 'e']
+    assert spool.depth == 3
+    assert spool.depth_bytes == 3
+    assert spool.dropped_count == 2
+
+
+def test_drain_sends_in_order(empty_spool, monkeypatch):
+    sent = []
+    monkeypatch.setattr(http_adn, 'http_request',
+                        lambda origin, path, method, ty, body, prio: sent.append(body) or (2001, {}))
+    for body in 'abc':
+        spool.put(PATH, '4', body, 'telemetry')
+
+    spool.cse_alive()
+
+    assert wait_for(lambda: spool.depth == 0)
+    assert sent == ['a', 'b', 'c']
+    assert rows() == []
+
+
+def test_drain_keeps_what_the_cse_did_not_take(empty_spool, monkeypatch):
+    tried = threading.Event()
+    monkeypatch.setattr(http_adn, 'http_request',
+                        lambda origin, path, method, ty, body, prio: tried.set() or (9999, {'dbg': OSError()}))
+    spool.put(PATH, '4', 'a', 'telemetry')
+
+    spool.cse_alive()
+
+    assert tried.wait(5)
+    assert wait_for(lambda: spool.inflight_max == 0)
+    assert rows() == ['a']
+    assert spool.depth == 1
+
+
+def test_eviction_spares_the_rows_being_drained(empty_spool, monkeypatch):
+    monkeypatch.setitem(conf.conf['spool'], 'batch', 2)
+    sending = threading.Event()
+    release = threading.Event()
+
+    def slow_request(origin, path, method, ty, body, prio):
+        sending.set()
+        release.wait(5)
+        return 2001, {}
+
+    monkeypatch.setattr(http_adn, 'http_request', slow_request)
+    spool.put(PATH, '4', 'a', 'telemetry')
+    spool.put(PATH, '4', 'b', 'telemetry')
+    spool.cse_alive()
+    assert sending.wait(5)
+    monkeypatch.setitem(conf.conf['spool'], 'max_rows', 1)
+
+    # a and b in flight do not count against max_rows: c is evicted for d, a and b stay
+    spool.put(PATH, '4', 'c', 'telemetry')
+    spool.put(PATH, '4', 'd', 'telemetry')
+    assert rows() == ['a', 'b', 'd']
+
+    release.set()
+    assert wait_for(lambda: spool.inflight_max == 0 and rows() == [])
+    assert spool.depth == 0
+    assert spool.depth_bytes == 0
+
+
+def test_inflight_bytes_are_outside_max_bytes(empty_spool, monkeypatch):
+    monkeypatch.setitem(conf.conf['spool'], 'batch', 2)
+    sending = threading.Event()
+    release = threading.Event()
+
+    def slow_request(origin, path, method, ty, body, prio):
+        sending.set()
+        release.wait(5)
+        return 2001, {}
+
+    monkeypatch.setattr(http_adn, 'http_request', slow_request)
+    spool.put(PATH, '4', 'aaaa', 'telemetry')
+    spool.put(PATH, '4', 'bbbb', 'telemetry')
+    spool.put(PATH, '4', 'cccc', 'telemetry')
+    spool.cse_alive()
+    assert sending.wait(5)
+    assert (spool.inflight_rows, spool.inflight_bytes) == (2, 8)
+    monkeypatch.setitem(conf.conf['spool'], 'max_bytes', 6)
+
+    # 4 bytes queued behind the batch, then 2 and 2 more: the oldest queued row goes
+    spool.put(PATH, '4', 'dd', 'telemetry')
+    spool.put(PATH, '4', 'ee', 'telemetry')
+    assert rows() == ['aaaa', 'bbbb', 'dd', 'ee']
+    assert spool.depth_bytes == 12
+
+    release.set()
+    assert wait_for(lambda: rows() == [])
+    assert (spool.inflight_max, spool.inflight_rows, spool.inflight_bytes) == (0, 0, 0)
+
+
+def test_rows_the_cse_refused_stay_after_a_batch(empty_spool, monkeypatch):
+    sent = []
+
+    def request(origin, path, method, ty, body, prio):
+        if body == 'b':
+            return 9999, {'dbg': OSError()}
+        sent.append(body)
+        return 2001, {}
+
+    monkeypatch.setattr(http_adn, 'http_request', request)
+    for body in 'abc':
+        spool.put(PATH, '4', body, 'telemetry')
+
+    spool.cse_alive()
+
+    assert wait_for(lambda: 'a' in sent and spool.inflight_max == 0)
+    assert rows() == ['b']
+    assert spool.depth == 1
+    assert spool.depth_bytes == 1
@@ -0,0 +1,71 @@
+# -*-coding:utf-8 -*-
+
+import json, threading
+
+import telemetry
+
+
+def test_update_bumps_the_version_only_on_a_change():
+    store = telemetry.Store()
+
+    assert store.update('heartbeat', {'type': 2, 'base_mode': 81})
+    assert not store.update('heartbeat', {'type': 2, 'base_mode': 81})
+    assert store.version == 1
+
+    assert store.update('heartbeat', {'type': 2, 'base_mode': 209})
+    assert store.update('global_position_int', {'lat': 1})
+    assert store.version == 3
+    assert store.get('heartbeat') == {'type': 2, 'base_mode': 209}
+    assert store.get('attitude') is None
+
+    # other fields replace the record
+    assert store.update('heartbeat', {'type': 2})
+    assert store.get('heartbeat') == {'type': 2}
+
+
+def test_snapshot_is_not_changed_by_later_updates():
+    store = telemetry.Store()
+    store.update('global_position_int', {'lat': 1, 'lon': 2})
+
+    version, records = store.snapshot()
+    store.update('global_position_int', {'lat': 3, 'lon': 4})
+
+    assert version == 1
+    assert records['global_position_int'][:3] == (('lat', 'lon'), (1, 2), 1)
+    assert store.snapshot()[1]['global_position_int'][1] == (3, 4)
+
+
+def test_json_is_rebuilt_only_when_the_version_moved():
+    store = telemetry.Store()
+    store.update('heartbeat', {'type': 2})
+
+    version, text = store.json()
+    assert (version, json.loads(text)) == (1, {'heartbeat': {'type': 2}})
+    assert store.json()[1] is text
+
+    store.update('heartbeat', {'type': 2})
+    assert store.json()[1] is text
+
+    store.update('heartbeat', {'type': 3})
+    assert store.json() == (2, json.dumps({'heartbeat': {'type': 3}}))
+
+
+def test_readers_see_whole_messages():
+    store = telemetry.Store()
+    store.update('global_position_int', {'lat': 0, 'lon': 0})
+    torn = []
+
+    def writer():
+        for i in range(20000):
+            store.update('global_position_int', {'lat': i, 'lon': i})
+
+    t = threading.Thread(target=writer)
+    t.start()
+    while t.is_alive():
+        content = store.get('global_position_int')
+        if content['lat'] != content['lon']:
+            torn.append(content)
+    t.join()
+
+    assert torn == []
+    assert store.get('global_position_int') == {'lat': 19999, 'lon': 19999}
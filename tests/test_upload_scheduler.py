@@ -0,0 +1,133 @@
+# -*-coding:utf-8 -*-
+
+import threading, time
+
+import pytest
+
+import conf
+import metrics
+import upload_scheduler
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+
+    return True
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setitem(conf.conf, 'upload', {
+        'control': {'priority': 0, 'concurrency': 1, 'queue_size': 10, 'max_age': 0},
+        'bulk': {'priority': 1, 'concurrency': 1, 'queue_size': 2, 'max_age': 0.2},
+    })
+    with upload_scheduler.cond:
+        upload_scheduler.classes.clear()
+        del upload_scheduler.order[:]
+    upload_scheduler.start()
+
+    yield upload_scheduler
+
+    monkeypatch.undo()
+    with upload_scheduler.cond:
+        upload_scheduler.classes.clear()
+        del upload_scheduler.order[:]
+    upload_scheduler.start()
+
+
+def submit(prio, fn, *args):
+    # request() blocks until its job is done: run it in a thread, its result in the returned list
+    result = []
+    t = threading.Thread(target=lambda: result.append(upload_scheduler.request(prio, fn, *args)), daemon=True)
+    t.start()
+
+    return t, result
+
+
+def blocked_worker(prio):
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+        return 2001, {}
+
+    t, result = submit(prio, block)
+    assert started.wait(5)
+
+    return release, t, result
+
+
+def counter(name, prio):
+    return metrics.counters.get(name, {}).get((('class', prio),), 0)
+
+
+def queued(prio, count):
+    return wait_for(lambda: len(upload_scheduler.classes[prio]['queue']) == count)
+
+
+def test_full_queue_drops_the_oldest(scheduler):
+    dropped = counter('upload_dropped', 'bulk')
+    release, blocker, blocker_result = blocked_worker('bulk')
+    ran = []
+
+    jobs = []
+    for name in ['first', 'second', 'third']:
+        jobs.append(submit('bulk', lambda name=name: ran.append(name) or (2001, {})))
+        assert queued('bulk', min(len(jobs), 2))
+
+    jobs[0][0].join(5)
+    assert jobs[0][1][0][0] == upload_scheduler.DROPPED
+
+    # the queued jobs may have waited on the blocker longer than max_age
+    with scheduler.cond:
+        scheduler.classes['bulk']['max_age'] = 0
+    release.set()
+    for t, result in jobs[1:]:
+        t.join(5)
+        assert result[0] == (2001, {})
+    assert ran == ['second', 'third']
+    assert counter('upload_dropped', 'bulk') == dropped + 1
+
+
+def test_requests_older_than_max_age_are_dropped(scheduler):
+    release, blocker, blocker_result = blocked_worker('bulk')
+    ran = []
+    t, result = submit('bulk', lambda: ran.append(1) or (2001, {}))
+    assert queued('bulk', 1)
+
+    time.sleep(0.3)
+    release.set()
+    t.join(5)
+
+    assert result[0][0] == upload_scheduler.DROPPED
+    assert ran == []
+
+
+def test_control_goes_before_queued_bulk(scheduler):
+    release, blocker, blocker_result = blocked_worker('bulk')
+    ran = []
+    bulk = submit('bulk', lambda: ran.append('bulk') or (2001, {}))
+    assert queued('bulk', 1)
+
+    control = submit('control', lambda: ran.append('control') or (2001, {}))
+    control[0].join(5)
+
+    assert ran == ['control']
+    release.set()
+    bulk[0].join(5)
+    blocker.join(5)
+
+
+def test_unknown_class_goes_to_the_lowest_priority(scheduler):
+    submitted = counter('upload_submitted', 'bulk')
+    completed = counter('upload_completed', 'bulk')
+
+    assert scheduler.request('nonexistent', lambda: (2001, {})) == (2001, {})
+    assert counter('upload_submitted', 'bulk') == submitted + 1
+    assert counter('upload_completed', 'bulk') == completed + 1
@@ -0,0 +1,37 @@
+# -*-coding:utf-8 -*-
+
+import conf
+import vehicle
+
+
+def provisioned(cse, flight):
+    cse.seed_approval(conf.conf['ae']['approval_gcs'], flight, cse.default_drone_info(flight, '127.0.0.1'))
+
+    return vehicle.Vehicle(flight, None)
+
+
+def test_extra_vehicle_creates_its_own_ae(cse):
+    v = provisioned(cse, 'extra_new')
+
+    assert v.provision()
+    rsc, ae = cse.retrieve(conf.conf['ae']['parent'] + '/extra_new')
+    assert rsc == 2000
+    assert ae['aei'] == v.origin == 'Sextra_new'
+    assert ae['api'] == v.appid != conf.conf['ae']['appid']
+    assert cse.retrieve('/Mobius/KETI_MUV/Drone_Data/extra_new/disarm')[0] == 2000
+
+
+def test_existing_ae_of_the_vehicle_is_accepted(cse):
+    v = provisioned(cse, 'extra_again')
+    assert v.provision()
+
+    assert vehicle.Vehicle('extra_again', None).provision()
+
+
+def test_existing_ae_of_another_origin_is_refused(cse):
+    v = provisioned(cse, 'extra_taken')
+    cse.seed(conf.conf['ae']['parent'] + '/extra_taken', '2', {'api': 'other', 'rr': True})
+    cse.resources[conf.conf['ae']['parent'] + '/extra_taken']['aei'] = 'Sother'
+
+    assert not v.provision()
+    assert cse.retrieve('/Mobius/KETI_MUV/Drone_Data/extra_taken')[0] == 4004
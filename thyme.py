@@ -4,14 +4,60 @@
  Created by Wonseok Jung in KETI on 2021-03-16.
 """
 
-import conf
+import argparse, os, signal
+
+import conf as muv_conf
+import muv_log
+import profiler
+import ae_http
 import http_app
+import thyme_tas_mav as tas_mav
+import mav_capture
+import flight_recorder
+import frame_trace
+import spool
 
-conf = conf.conf
+conf = muv_conf.conf
 sh_state = 'rtvct'
 mqtt_client = None
 muv_mqtt_client = None
 
+
+def terminate(signum, frame):
+    # systemd stops thyme.py with SIGTERM, which skips the atexit handlers
+    mav_capture.stop_capture()
+    flight_recorder.stop()
+    if frame_trace.every:
+        frame_trace.dump()
+    spool.flush()
+    if muv_log.listener is not None:
+        muv_log.listener.stop()
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capture', action='store_true', help='record the frames of the FC as tlog in ./capture')
+    parser.add_argument('--replay', default='', help='tlog or .mavraw file fed to the TAS instead of the serial port')
+    parser.add_argument('--fast', action='store_true', help='replay as fast as possible')
+    parser.add_argument('--loop', action='store_true', help='replay the tlog again and again')
+    args = parser.parse_args()
+
+    if args.capture:
+        conf['capture']['enable'] = True
+    if args.replay:
+        conf['replay']['path'] = args.replay
+        conf['replay']['realtime'] = not args.fast
+        conf['replay']['loop'] = args.loop
+
     # while True:
+    muv_conf.init()
+    muv_log.init()
+    profiler.init()
+    signal.signal(signal.SIGTERM, terminate)
+    http_app.init()
+    ae_http.start()
+    tas_mav.tas_early()
     http_app.http_watchdog()
\ No newline at end of file
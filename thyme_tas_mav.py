@@ -4,8 +4,7 @@
  Created by Wonseok Jung in KETI on 2021-03-16.
 """
 
-import datetime, serial, json, sys
-import asyncio
+import collections, datetime, os, json, sys, time
 
 import threading
 from functools import wraps
@@ -13,6 +12,20 @@ from functools import wraps
 import http_adn
 import http_app
 import thyme
+import mav_route
+import muv_log
+import metrics
+import mav_capture
+import flight_recorder
+import vehicle
+import muv_codec
+import frame_clock
+import frame_trace
+import rollup
+import flight_ledger
+
+log = muv_log.get_logger('tas_mav')
+dump = muv_log.get_logger('dump')
 
 _server = None
 
@@ -52,7 +65,7 @@ class Timer():
             if (self.toClearTimer is False):
                 fn()
             else:
-                print('Invokation is cleared!')
+                log.debug('Invokation is cleared!')
 
         some_fn()
         return isInvokationCancelled
@@ -64,46 +77,183 @@ class Timer():
 timer = Timer()
 
 
-def tas_ready():
+def start_ingest(v):
+    # the serial port or the replay of the primary vehicle, once
     global _server
+
+    if v.ingesting:
+        return
+    v.ingesting = True
+
+    if thyme.conf['recorder']['enable'] and not flight_recorder.time_base:
+        flight_recorder.start()
+
+    if thyme.conf['replay']['path']:
+        mav_capture.start_replay(v)
+    elif v.drone_type == 'dji':
+        if _server is None:
+            pass
+            """TBD socket connect with DJI"""
+            # _server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # print('socket connected')
+    elif v.drone_type == 'pixhawk':
+        if thyme.conf['capture']['enable']:
+            mav_capture.start_capture()
+        mavPortOpening(v)
+
+
+def tas_early():
+    """
+    Starts the serial ingest and the local MUV topics at boot with the identity of
+    the last approval, before the CSE is provisioned. The frames of the remote MQTT
+    and Mobius sinks are held until tas_ready(). Returns False when there is no
+    approval cached yet, and the ingest waits for the provisioning as before.
+    """
+
+    global remote_attached
+
+    if not thyme.conf['early']['enable']:
+        return False
+    drone_info = vehicle.cached_approval()
+    if drone_info is None:
+        log.info('no cached approval, the ingest starts after the provisioning')
+        return False
+
+    try:
+        load_fc_model()
+        v = vehicle.start_cached(fc, mavPortNum, mavBaudrate, drone_info)
+        remote_attached = False
+        mav_route.compile_routes(thyme.conf['route'], vehicle.system_ids())
+        muv_codec.init()
+        frame_trace.init()
+        http_app.muv_mqtt_connect('localhost', 1883)
+        muv_codec.publish_schema(thyme.muv_mqtt_client, v.parent_cnt_name)
+        start_ingest(v)
+        log.info('%s: ingest started before the provisioning as system %s', v.name, v.system_id)
+    except Exception as e:
+        log.error('tas_early: %s', e)
+        return False
+
+    return True
+
+
+def tas_ready():
     global mavPortNum
     global mavBaudrate
 
     try:
-        if http_app.my_drone_type == 'dji':
-            if _server is None:
-                pass
-                """TBD socket connect with DJI"""
-                # _server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                # print('socket connected')
-        elif http_app.my_drone_type == 'pixhawk':
-            mavPortNum = '/dev/ttyAMA0'
-            mavBaudrate = '115200'
-            mavPortOpening()
+        mavPortNum = '/dev/ttyAMA0'
+        mavBaudrate = '115200'
+        load_fc_model()
+        v = vehicle.start_primary(fc, mavPortNum, mavBaudrate)
+        mav_route.compile_routes(thyme.conf['route'], vehicle.system_ids())
+        muv_codec.init()
+        frame_trace.init()
+        if thyme.muv_mqtt_client is not None:
+            muv_codec.publish_schema(thyme.muv_mqtt_client, v.parent_cnt_name)
+
+        if thyme.conf['rollup']['enable']:
+            rollup.create_container(v)
+            rollup.start()
+        flight_ledger.start(v.name)
+
+        start_ingest(v)
+        attach_remote()
+
+        if len(thyme.conf['vehicles']) > 0:
+            vehicle.start_extra(fc, vehicle_ready)
     except Exception as e:
-        print(e)
+        log.error('tas_ready: %s', e)
 
 
-aggr_content = {}
+def vehicle_ready(v):
+    try:
+        mav_route.compile_routes(thyme.conf['route'], vehicle.system_ids())
+        if thyme.muv_mqtt_client is not None:
+            muv_codec.publish_schema(thyme.muv_mqtt_client, v.parent_cnt_name)
+        if rollup.running:
+            rollup.create_container(v)
+        flight_ledger.start(v.name)
+        if v.replay:
+            mav_capture.start_replay(v, v.replay)
+        elif v.drone_type == 'pixhawk':
+            mavPortOpening(v)
+    except Exception as e:
+        log.error('%s: %s', v.name, e)
 
 
-def send_aggr_to_Mobius(topic, content_each, gap):
-    if aggr_content.get(topic):
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%f')[:-3]
-        aggr_content[topic][timestamp] = content_each
+# frames of the remote sinks held from tas_early() until tas_ready()
+remote_attached = True
+remote_lock = threading.Lock()
+remote_held = collections.deque()  # (received, sampled, route, mavPacket, sortie, vehicle)
+remote_sorties = []  # (vehicle, sortie) armed before tas_ready(), their containers are created by attach_remote()
 
-    else:
-        aggr_content[topic] = {}
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%f')[:-3]
-        aggr_content[topic][timestamp] = content_each
+first_local = None  # seconds from the process start to the first local MUV message
+import_time = time.monotonic()
+
+aggr_content = {}  # topic -> {timestamp: frame} of the current window
+aggr_base = {}  # topic -> [wall clock - monotonic clock, latest key in ms, traces] of the current window
+aggr_lock = threading.Lock()  # a window is written by the serial threads and taken by the timer
 
-        def upload():
-            http_adn.crtci(topic + '?rcn=0', 0, aggr_content[topic], None)
-            del aggr_content[topic]
+LABEL_MQTT = (('sink', 'mqtt'),)
+LABEL_MOBIUS = (('sink', 'mobius'),)
+LABEL_LOCAL = (('sink', 'local'),)
+LABEL_REMOTE_CLIENT = (('client', 'remote'),)
+LABEL_LOCAL_CLIENT = (('client', 'local'),)
+REMOTE_ROUTES = mav_route.ROUTE_MQTT | mav_route.ROUTE_MOBIUS
 
-            return gap, topic
+metrics.gauge('aggr_topics', lambda: len(aggr_content))
 
-        timer.setTimeout(upload, gap)
+
+def send_aggr_to_Mobius(topic, content_each, gap, received=None, trace=None):
+    # received: time.monotonic() of the frame, mapped to the wall clock once per window
+    if received is None:
+        received = time.monotonic()
+
+    with aggr_lock:
+        window = aggr_content.get(topic)
+        if window is None:
+            window = aggr_content[topic] = {}
+            aggr_base[topic] = [frame_clock.wall_base(), 0, []]
+            timer.setTimeout(lambda: upload_aggr(topic, gap), gap)
+
+        base = aggr_base[topic]
+        wall_ms = int((base[0] + received) * 1000)
+        timestamp = frame_clock.timestamp(wall_ms)
+        if timestamp in window:  # frames of one serial read: after the latest key of the window
+            wall_ms = base[1] + 1
+            timestamp = frame_clock.timestamp(wall_ms)
+        if wall_ms > base[1]:
+            base[1] = wall_ms
+        window[timestamp] = content_each
+        if trace is not None:
+            trace.mark('aggregated')
+            base[2].append(trace)
+
+
+def upload_aggr(topic, gap):
+    # the window is taken under the lock, so no serial thread writes into it while crtci serializes it
+    with aggr_lock:
+        content = aggr_content.pop(topic)
+        traces = aggr_base.pop(topic)[2]
+    rsc, res_body, parent, socket = http_adn.crtci(topic + '?rcn=0', 0, content, None)
+    for trace in traces:
+        if rsc == 2001:
+            trace.mark('cin')
+        frame_trace.finish(trace)
+
+    return gap, topic
+
+
+def fc_boot_times():
+    # wall clock time the autopilot of each vehicle booted at, from the estimated offset
+    base = frame_clock.wall_base()
+
+    return {(('vehicle', name),): base + v.clock.offset for name, v in list(vehicle.vehicles.items())
+            if v.clock.offset is not None}
+
+
+metrics.gauge('fc_boot_time_seconds', fc_boot_times)
 
 
 # function mavlinkGenerateMessage(sysId, type, params) {
@@ -332,16 +482,20 @@ def noti(path_arr, cinObj, socket):
         cin['con'] = cinObj['content']
 
     if cin['con'] == '':
-        print('---- is not cin message')
+        log.warning('---- is not cin message')
     else:
         socket.write(json.dumps(cin))
 
 
-def gcs_noti_handler(message):
+def gcs_noti_handler(message, v=None):
     global socket_mav
-    global mavPort
 
-    if http_app.my_drone_type == 'dji':
+    if v is None:
+        v = vehicle.primary
+    if v is None:
+        return
+
+    if v.drone_type == 'dji':
         com_msg = str(message)
         com_message = com_msg.split(":")
         msg_command = com_message[0]
@@ -360,38 +514,39 @@ def gcs_noti_handler(message):
             msg_alt = com_message[3][0:3]
         elif msg_command == 'm' or msg_command == 'a':
             socket_mav.write(message)
-    elif http_app.my_drone_type == 'pixhawk':
-        if mavPort is not None:
-            if mavPort.isOpen():
-                mavPort.write(message)
+    elif v.drone_type == 'pixhawk':
+        if v.port is not None:
+            if v.port.isOpen():
+                v.port.write(message)
     else:
         pass
 
 
-def mavPortOpening():
+def mavPortOpening(v):
     global mavPort
-    global mavPortNum
-    global mavBaudrate
 
     # try:
-    if mavPort is None:
+    if v.port is None:
+        import asyncio
+        import serial
+
         sys.setrecursionlimit(2000)
-        mavPort = serial.Serial(mavPortNum, int(mavBaudrate))
-        asyncio.run(mavPortOpen())
+        v.port = serial.Serial(v.port_name, int(v.baudrate))
+        if v.is_primary:
+            mavPort = v.port
+        asyncio.run(mavPortOpen(v))
     else:
-        if mavPort.isOpen():
+        if v.port.isOpen():
             pass
         else:
-            mavPort.open()
+            v.port.open()
 
     # except Exception as e:
     #     mavPortError(e)
 
 
-async def mavPortOpen():
-    global mavPort
-
-    print('mavPort open. ' + mavPortNum + ' Data rate: ' + mavBaudrate)
+async def mavPortOpen(v):
+    log.info('mavPort open. %s Data rate: %s', v.port_name, v.baudrate)
     sys.setrecursionlimit(10 ** 9)
     # mavPortData()
     # loop = asyncio.get_running_loop()
@@ -399,23 +554,19 @@ async def mavPortOpen():
     #     result = await loop.run_in_executor(
     #         pool, mavPortData)
     # timer.setTimeout(mavPortData, 0.25)
-    t = threading.Thread(target=mavPortData, args=(mavPort,))
+    t = threading.Thread(target=mavPortData, args=(v.port, v), name='serial-' + v.name)
     t.start()
 
 
-def mavPortClose():
-    global mavPort
-
-    print('mavPort closed..')
-    mavPort.close()
-    mavPortOpening()
+def mavPortClose(v):
+    log.info('mavPort closed..')
+    v.port.close()
+    mavPortOpening(v)
 
 
-def mavPortError(error):
-    global mavPort
-
-    print('[mavPort error]: {}'.format(error))
-    mavPortOpening()
+def mavPortError(error, v):
+    log.error('[mavPort error]: %s', error)
+    mavPortOpening(v)
 
 
 mav_ver = 1
@@ -439,100 +590,252 @@ def Hex(arrayBuffer):
     return "".join(hexOctet)
 
 
-mavStrFromDrone = ''
-mavStrFromDroneLength = 0
+def mavPortData(mavPort, v):
+    while True:
+        data = mavPort.readline()
+        mavPortIngest(data, v)
+
+
+def mavPortIngest(data, v=None):
+    # v: the vehicle of the serial link, the primary one by default
+    if v is None:
+        v = vehicle.primary
+
+    received = time.monotonic()
+    metrics.inc('serial_bytes', len(data))
+    if mav_capture.raw_file is not None and v.is_primary:
+        mav_capture.capture_raw(received, data)
+    mavStrFromDrone = v.mavStrFromDrone + Hex(data)
+    mavStrFromDroneLength = v.mavStrFromDroneLength
+
+    while len(mavStrFromDrone) > 12:
+        stx = mavStrFromDrone[0:2]
+        if stx == 'fe':
+            length = int(mavStrFromDrone[mavStrFromDroneLength + 2:mavStrFromDroneLength + 4], 16)
+            mavLength = (6 * 2) + (length * 2) + (2 * 2)
+
+            if len(mavStrFromDrone) >= mavLength:
+                mavPacket = mavStrFromDrone[mavStrFromDroneLength:mavStrFromDroneLength + mavLength]
+                mavStrFromDrone = mavStrFromDrone[mavStrFromDroneLength + mavLength:]
+                mavStrFromDroneLength = 0
+
+                metrics.inc('serial_frames')
+                trace = frame_trace.begin(v.name, received) if frame_trace.every else None
+                mavPacketDispatch(mavPacket, received, v, trace)
+            else:
+                break
+        else:
+            mavStrFromDrone = mavStrFromDrone[2:]
+            metrics.inc('serial_skipped_bytes')
+
+    v.mavStrFromDrone = mavStrFromDrone
+    v.mavStrFromDroneLength = mavStrFromDroneLength
+
+
+def process_uptime():
+    # seconds since the process started, from /proc on Linux
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - import_time
+
+
+def first_local_published():
+    global first_local
+
+    first_local = process_uptime()
+    log.info('first local MUV message %.2f s after the start', first_local)
+
+
+metrics.gauge('boot_to_first_local_seconds', lambda: {} if first_local is None else first_local)
+metrics.gauge('remote_held_frames', lambda: len(remote_held))
+
+
+def hold_remote(mavPacket, received, sampled, route, v):
+    # keeps the frame for the remote sinks while they are not attached; False once they are
+    with remote_lock:
+        if remote_attached:
+            return False
+        if len(remote_held) >= thyme.conf['early']['max_frames']:
+            remote_held.popleft()
+            metrics.inc('remote_held_dropped')
+        remote_held.append((received, sampled, route, mavPacket, v.sortie_name, v))
+
+    return True
+
+
+def defer_sortie(v):
+    # before attach_remote() the CSE may not answer, so the containers of a new sortie wait for it
+    with remote_lock:
+        if remote_attached:
+            return False
+        remote_sorties.append((v, v.sortie_name))
+
+    return True
+
+
+def attach_sorties():
+    # called with the remote lock held: (vehicle, sortie) the remote sinks write to once attached
+    sorties = {}
+    for v in list(vehicle.vehicles.values()):
+        sorties[(v, v.sortie_name)] = True
+    for key in remote_sorties:
+        sorties[key] = True
+    if thyme.conf['early']['policy'] == 'flush':
+        for item in remote_held:
+            sorties[(item[5], item[4])] = True
+
+    return sorties
 
 
-def mavPortData(mavPort):
-    global mavStrFromDroneLength
-    global mavStrFromDrone
+def attach_remote():
+    """
+    Creates the containers of the sorties armed or held since tas_early(), sends
+    the frames held for the remote sinks, or drops them, by conf["early"]["policy"],
+    and lets the next frames go to the remote sinks directly.
+    """
+
+    global remote_attached
 
+    created = set()
     while True:
-        data = mavPort.readline()
-        mavStrFromDrone += Hex(data)
-
-        while len(mavStrFromDrone) > 12:
-            stx = mavStrFromDrone[0:2]
-            if stx == 'fe':
-                length = int(mavStrFromDrone[mavStrFromDroneLength + 2:mavStrFromDroneLength + 4], 16)
-                mavLength = (6 * 2) + (length * 2) + (2 * 2)
-
-                if len(mavStrFromDrone) >= mavLength:
-                    mavPacket = mavStrFromDrone[mavStrFromDroneLength:mavStrFromDroneLength + mavLength]
-                    mavStrFromDrone = mavStrFromDrone[mavStrFromDroneLength + mavLength:]
-                    mavStrFromDroneLength = 0
-
-                    thyme.mqtt_client.publish(http_app.my_cnt_name, (
-                        bytearray.fromhex(" ".join(mavPacket[i:i + 2] for i in range(0, len(mavPacket), 2)))))
-                    send_aggr_to_Mobius(http_app.my_cnt_name, mavPacket, 1.5)
-                    parseMavFromDrone(mavPacket)
-                else:
-                    break
-            else:
-                mavStrFromDrone = mavStrFromDrone[2:]
+        with remote_lock:
+            if remote_attached:
+                return
+            missing = [key for key in attach_sorties() if key not in created]
+            if len(missing) == 0:
+                oldest = time.monotonic() - thyme.conf['early']['max_age']
+                sent = 0
+                for received, sampled, route, mavPacket, sortie, v in remote_held:
+                    if thyme.conf['early']['policy'] != 'flush' or received < oldest:
+                        continue
+                    dispatch_remote(mavPacket, bytes.fromhex(mavPacket), received, sampled, route,
+                                    v.parent_cnt_name + '/' + sortie, v, None)
+                    sent += 1
+                metrics.inc('remote_held_dropped', len(remote_held) - sent)
+                log.info('remote sinks attached, %d held frames sent, %d dropped', sent, len(remote_held) - sent)
+                remote_held.clear()
+                del remote_sorties[:]
+                remote_attached = True
+                return
+
+        # out of the lock, the serial threads keep holding frames meanwhile
+        for v, sortie in missing:
+            rsc = create_sortie(v, sortie)
+            if rsc not in (2001, 4105, 5106):
+                log.warning('%s: container of sortie %s x-m2m-rsc : %s', v.name, sortie, rsc)
+            created.add((v, sortie))
+
+
+def dispatch_remote(mavPacket, frame, received, sampled, route, cnt_name, v, trace):
+    if route & mav_route.ROUTE_MQTT:
+        thyme.mqtt_client.publish(cnt_name, frame)
+        metrics.inc('sink_frames', 1, LABEL_MQTT)
+        metrics.inc('mqtt_publish', 1, LABEL_REMOTE_CLIENT)
+        if trace is not None:
+            trace.mark('mqtt')
+    if route & mav_route.ROUTE_MOBIUS:
+        aggr_time = sampled if thyme.conf['clock']['aggr_time'] == 'fc' else received
+        send_aggr_to_Mobius(cnt_name, mavPacket, 1.5, aggr_time, trace)
+        metrics.inc('sink_frames', 1, LABEL_MOBIUS)
+        if rollup.running:
+            rollup.sample(v, frame)
+
+
+def mavPacketDispatch(mavPacket, received, v, trace=None):
+    frame = bytes.fromhex(mavPacket)
+    sampled = v.clock.sample(received, frame, v.system_id)
+    if trace is not None:
+        trace.mark('framed')
+    if v.is_primary:
+        if mav_capture.capture_file is not None:
+            mav_capture.capture(received, frame)
+        if flight_recorder.time_base:
+            flight_recorder.record(v.sortie_name, received, frame)
+
+    route = mav_route.route_of(mavPacket)
+    if route & REMOTE_ROUTES:
+        if remote_attached or not hold_remote(mavPacket, received, sampled, route, v):
+            dispatch_remote(mavPacket, frame, received, sampled, route, v.cnt_name, v, trace)
+    if route & mav_route.ROUTE_LOCAL:
+        parseMavFromDrone(mavPacket, v, trace)
+        metrics.inc('sink_frames', 1, LABEL_LOCAL)
+
+    # an aggregated frame is done when the CIN of its window is answered
+    if trace is not None and 'aggregated' not in trace.marks:
+        frame_trace.finish(trace)
 
 
 fc = {}
-try:
-    with open('./fc_data_model.json', 'r') as f:
-        fc = json.load(f)
-
-except:
-    fc['heartbeat'] = {}
-    fc['heartbeat']['type'] = 2
-    fc['heartbeat']['autopilot'] = 3
-    fc['heartbeat']['base_mode'] = 0
-    fc['heartbeat']['custom_mode'] = 0
-    fc['heartbeat']['system_status'] = 0
-    fc['heartbeat']['mavlink_version'] = 1
-
-    fc['attitude'] = {}
-    fc['attitude']['time_boot_ms'] = 123456789
-    fc['attitude']['roll'] = 0.0
-    fc['attitude']['pitch'] = 0.0
-    fc['attitude']['yaw'] = 0.0
-    fc['attitude']['rollspeed'] = 0.0
-    fc['attitude']['pitchspeed'] = 0.0
-    fc['attitude']['yawspeed'] = 0.0
-
-    fc['global_position_int'] = {}
-    fc['global_position_int']['time_boot_ms'] = 123456789
-    fc['global_position_int']['lat'] = 0
-    fc['global_position_int']['lon'] = 0
-    fc['global_position_int']['alt'] = 0
-    fc['global_position_int']['vx'] = 0
-    fc['global_position_int']['vy'] = 0
-    fc['global_position_int']['vz'] = 0
-    fc['global_position_int']['hdg'] = 65535
-
-    fc['battery_status'] = {}
-    fc['battery_status']['id'] = 0
-    fc['battery_status']['battery_function'] = 0
-    fc['battery_status']['type'] = 3
-    fc['battery_status']['temperature'] = 32767
-    fc['battery_status']['voltages'] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-    fc['battery_status']['current_battery'] = -1
-    fc['battery_status']['current_consumed'] = -1
-    fc['battery_status']['battery_remaining'] = -1
-    fc['battery_status']['time_remaining'] = 0
-    fc['battery_status']['charge_state'] = 0
-
-    with open('./fc_data_model.json', 'w') as f:
-        json.dump(fc, f, indent=4)
-
-flag_base_mode = 0
-start_arm_time = 0
-cal_flag = 0
-cal_sortiename = ''
+
+
+def load_fc_model():
+    """
+    Reads ./fc_data_model.json into fc once, and writes the default model when there is none.
+    """
+
+    if len(fc) > 0:
+        return fc
+
+    try:
+        with open('./fc_data_model.json', 'r') as f:
+            fc.update(json.load(f))
+
+    except:
+        fc['heartbeat'] = {}
+        fc['heartbeat']['type'] = 2
+        fc['heartbeat']['autopilot'] = 3
+        fc['heartbeat']['base_mode'] = 0
+        fc['heartbeat']['custom_mode'] = 0
+        fc['heartbeat']['system_status'] = 0
+        fc['heartbeat']['mavlink_version'] = 1
+
+        fc['attitude'] = {}
+        fc['attitude']['time_boot_ms'] = 123456789
+        fc['attitude']['roll'] = 0.0
+        fc['attitude']['pitch'] = 0.0
+        fc['attitude']['yaw'] = 0.0
+        fc['attitude']['rollspeed'] = 0.0
+        fc['attitude']['pitchspeed'] = 0.0
+        fc['attitude']['yawspeed'] = 0.0
+
+        fc['global_position_int'] = {}
+        fc['global_position_int']['time_boot_ms'] = 123456789
+        fc['global_position_int']['lat'] = 0
+        fc['global_position_int']['lon'] = 0
+        fc['global_position_int']['alt'] = 0
+        fc['global_position_int']['vx'] = 0
+        fc['global_position_int']['vy'] = 0
+        fc['global_position_int']['vz'] = 0
+        fc['global_position_int']['hdg'] = 65535
+
+        fc['battery_status'] = {}
+        fc['battery_status']['id'] = 0
+        fc['battery_status']['battery_function'] = 0
+        fc['battery_status']['type'] = 3
+        fc['battery_status']['temperature'] = 32767
+        fc['battery_status']['voltages'] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+        fc['battery_status']['current_battery'] = -1
+        fc['battery_status']['current_consumed'] = -1
+        fc['battery_status']['battery_remaining'] = -1
+        fc['battery_status']['time_remaining'] = 0
+        fc['battery_status']['charge_state'] = 0
+
+        with open('./fc_data_model.json', 'w') as f:
+            json.dump(fc, f, indent=4)
+
+    return fc
+
 
 from pymavlinklib import common
 
 
-def parseMavFromDrone(mavPacket):
-    global flag_base_mode
-    global start_arm_time
-    global cal_sortiename
-    global cal_flag
+def parseMavFromDrone(mavPacket, v, trace=None):
+    fc = v.fc
 
     try:
         ver = mavPacket[0:2]
@@ -578,7 +881,19 @@ def parseMavFromDrone(mavPacket):
             fc['global_position_int']['alt'] = HexstrtoInt(alt)
             fc['global_position_int']['relative_alt'] = HexstrtoInt(relative_alt)
             # print(fc['global_position_int'])
-            thyme.muv_mqtt_client.publish(http_app.muv_pub_fc_gpi_topic, json.dumps(fc['global_position_int']))
+            v.telemetry.update('global_position_int', fc['global_position_int'])
+            if trace is not None:
+                trace.mark('decoded')
+            payload = muv_codec.payload(v.pub_fc_gpi_topic, 'global_position_int', fc['global_position_int'])
+            if payload is not None:
+                thyme.muv_mqtt_client.publish(v.pub_fc_gpi_topic, payload)
+                metrics.inc('mqtt_publish', 1, LABEL_LOCAL_CLIENT)
+                if first_local is None:
+                    first_local_published()
+                if trace is not None:
+                    trace.mark('published')
+            else:
+                metrics.inc('muv_unchanged')
 
         elif msg_id == common.mavlink['HEARTBEAT']:  # 00
             if ver == 'fd':
@@ -615,79 +930,68 @@ def parseMavFromDrone(mavPacket):
             fc['heartbeat']['system_status'] = HexstrtoInt(system_status)
             fc['heartbeat']['mavlink_version'] = HexstrtoInt(mavlink_version)
             # print(fc['heartbeat'])
-            thyme.muv_mqtt_client.publish(http_app.muv_pub_fc_hb_topic, json.dumps(fc['heartbeat']))
+            v.telemetry.update('heartbeat', fc['heartbeat'])
+            if trace is not None:
+                trace.mark('decoded')
+            payload = muv_codec.payload(v.pub_fc_hb_topic, 'heartbeat', fc['heartbeat'])
+            if payload is not None:
+                thyme.muv_mqtt_client.publish(v.pub_fc_hb_topic, payload)
+                metrics.inc('mqtt_publish', 1, LABEL_LOCAL_CLIENT)
+                if first_local is None:
+                    first_local_published()
+                if trace is not None:
+                    trace.mark('published')
+            else:
+                metrics.inc('muv_unchanged')
 
             if fc['heartbeat']['base_mode'] & 0x80:
-                if flag_base_mode == 3:
-                    start_arm_time = datetime.datetime.now()
-                    flag_base_mode += 1
-                    http_app.my_sortie_name = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%f')[:-3]
-                    http_app.my_cnt_name = http_app.my_parent_cnt_name + '/' + http_app.my_sortie_name
-                    rsc, res_body, count = http_adn.crtct(http_app.my_parent_cnt_name + '?rcn=0',
-                                                          http_app.my_sortie_name, 0)
-                    cal_flag = 1
-                    cal_sortiename = http_app.my_sortie_name
-
-                    for idx in http_app.mission_parent:
-                        createMissionContainer(idx)
+                if v.flag_base_mode == 3:
+                    v.start_arm_time = datetime.datetime.now()
+                    v.flag_base_mode += 1
+                    v.set_sortie(datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S%f')[:-3])
+                    if not defer_sortie(v):
+                        create_sortie(v, v.sortie_name)
+                    v.cal_flag = 1
+                    v.cal_sortiename = v.sortie_name
                 else:
-                    flag_base_mode += 1
-                    if flag_base_mode > 16:
-                        flag_base_mode = 16
+                    v.flag_base_mode += 1
+                    if v.flag_base_mode > 16:
+                        v.flag_base_mode = 16
             else:
-                flag_base_mode = 0
-                if cal_flag == 1:
-                    cal_flag = 0
-                    calculateFlightTime(cal_sortiename)
-                http_app.my_sortie_name = 'disarm'
-                http_app.my_cnt_name = http_app.my_parent_cnt_name + '/' + http_app.my_sortie_name
+                v.flag_base_mode = 0
+                if v.cal_flag == 1:
+                    v.cal_flag = 0
+                    calculateFlightTime(v.cal_sortiename, v)
+                v.set_sortie('disarm')
 
     except Exception as e:
-        print('parseMavFromDrone: ', e)
-        # print('parseMavFromDrone: ', mavPacket, 'error: ', e)
-
+        metrics.inc('parse_errors')
+        log.warning('parseMavFromDrone: %s', e)
+        dump.debug('parseMavFromDrone: %s error: %s', mavPacket, e)
 
-end_arm_time = 0
-arming_time = 0
-flight_time = {}
-
-
-def calculateFlightTime(cal_sortiename):
-    global start_arm_time
-    global end_arm_time
-    global arming_time
-    global flight_time
 
+def calculateFlightTime(cal_sortiename, v):
     end_arm_time = datetime.datetime.now()
-    arming_time = (end_arm_time - start_arm_time).seconds
+    arming_time = (end_arm_time - v.start_arm_time).seconds
 
-    rsc, res_body, count = http_adn.rtvct('/Mobius/Life_Prediction/History/' + thyme.conf['ae']['name'] + '/la', 0)
-    if rsc == 2000:
-        flight_time = res_body['m2m:cin']['con']
-        if flight_time['total_flight_time'] == 0:
-            flight_time['total_flight_time'] = arming_time
-        else:
-            flight_time['total_flight_time'] += arming_time
+    # the ledger posts the CIN to /Mobius/Life_Prediction/History/<flight> in the background
+    flight_ledger.record(v.name, cal_sortiename, arming_time)
 
-        flight_time['arming_time'] = arming_time
-        flight_time['sortie_name'] = cal_sortiename
+    v.cal_sortiename = ''
 
-        http_adn.crtci('/Mobius/Life_Prediction/History/' + thyme.conf['ae']['name'] + '?rcn=0', 0, flight_time, None)
-
-    else:
-        rsc, res_body, count = http_adn.crtct('/Mobius/Life_Prediction/History' + '?rcn=0', thyme.conf['ae']['name'], 0)
 
-        flight_time['total_flight_time'] = arming_time
-        flight_time['arming_time'] = arming_time
-        flight_time['sortie_name'] = cal_sortiename
-        http_adn.crtci('/Mobius/Life_Prediction/History/' + thyme.conf['ae']['name'] + '?rcn=0', 0, flight_time, None)
+def create_sortie(v, sortie_name):
+    # the container of the sortie in Drone_Data and in each mission of the vehicle
+    rsc, res_body, count = http_adn.crtct(v.parent_cnt_name + '?rcn=0', sortie_name, 0)
+    for idx in v.mission_parent:
+        createMissionContainer(idx, sortie_name)
 
-    cal_sortiename = ''
+    return rsc
 
 
-def createMissionContainer(idx):
+def createMissionContainer(idx, sortie_name):
     mission_parent_path = idx
-    rsc, res_body, count = http_adn.crtct(mission_parent_path + '?rcn=0', http_app.my_sortie_name, 0)
+    rsc, res_body, count = http_adn.crtct(mission_parent_path + '?rcn=0', sortie_name, 0)
 
 
 def HexstrtoInt(mav):
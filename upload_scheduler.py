@@ -0,0 +1,132 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Scheduler of the write requests to the CSE.
+
+ Every write of http_adn is queued in a priority class of conf["upload"] and run
+ by a worker of the scheduler, so control writes are not delayed behind bulk data
+ when the link is slow. Each class has its own concurrency and queue size; when a
+ queue is full the oldest request is dropped, and requests older than max_age
+ (seconds, 0 for no limit) are dropped instead of being sent. A request of an
+ unknown class goes to the class of the lowest priority.
+
+ The requests submitted, dropped and completed by each class, and their wait and
+ latency, are exported through metrics.
+"""
+
+import collections, threading, time
+
+import conf
+import metrics
+
+DROPPED = 9999
+
+cond = threading.Condition()
+classes = {}
+order = []
+
+
+def start():
+    with cond:
+        if len(classes) > 0:
+            return
+
+        for name, upload_class in conf.conf['upload'].items():
+            classes[name] = {
+                'name': name,
+                'labels': (('class', name),),
+                'priority': int(upload_class['priority']),
+                'concurrency': max(1, int(upload_class['concurrency'])),
+                'queue_size': int(upload_class['queue_size']),
+                'max_age': float(upload_class['max_age']),
+                'queue': collections.deque(),
+                'running': 0
+            }
+        order.extend(sorted(classes.values(), key=lambda c: c['priority']))
+
+        for idx in range(sum(c['concurrency'] for c in order)):
+            t = threading.Thread(target=upload_worker, name='upload-{}'.format(idx), daemon=True)
+            t.start()
+
+
+def request(prio, fn, *args):
+    if len(classes) == 0:
+        start()
+
+    upload_class = classes.get(prio)
+    if upload_class is None:
+        upload_class = order[-1]
+
+    job = {'fn': fn, 'args': args, 'enqueued': time.monotonic(), 'done': threading.Event(), 'result': None}
+    with cond:
+        if len(upload_class['queue']) >= upload_class['queue_size']:
+            drop(upload_class, upload_class['queue'].popleft())
+        upload_class['queue'].append(job)
+        cond.notify()
+    metrics.inc('upload_submitted', 1, upload_class['labels'])
+
+    job['done'].wait()
+
+    return job['result']
+
+
+def drop(upload_class, job):
+    metrics.inc('upload_dropped', 1, upload_class['labels'])
+    job['result'] = (DROPPED, {'dbg': 'dropped by upload scheduler ({})'.format(upload_class['name'])})
+    job['done'].set()
+
+
+def next_job():
+    for upload_class in order:
+        if len(upload_class['queue']) > 0 and upload_class['running'] < upload_class['concurrency']:
+            upload_class['running'] += 1
+            return upload_class, upload_class['queue'].popleft()
+
+    return None, None
+
+
+def upload_worker():
+    while True:
+        with cond:
+            upload_class, job = next_job()
+            while job is None:
+                cond.wait()
+                upload_class, job = next_job()
+
+        started = time.monotonic()
+        wait = started - job['enqueued']
+        if 0 < upload_class['max_age'] < wait:
+            with cond:
+                drop(upload_class, job)
+                upload_class['running'] -= 1
+                cond.notify()
+            continue
+
+        try:
+            job['result'] = job['fn'](*job['args'])
+        except Exception as e:
+            job['result'] = (9999, {'dbg': e})
+
+        latency = time.monotonic() - job['enqueued']
+        with cond:
+            upload_class['running'] -= 1
+            cond.notify()
+        metrics.inc('upload_completed', 1, upload_class['labels'])
+        metrics.observe('upload_wait_seconds', wait, upload_class['labels'])
+        metrics.observe('upload_latency_seconds', latency, upload_class['labels'])
+
+        job['done'].set()
+
+
+def backlog():
+    with cond:
+        return {c['labels']: len(c['queue']) for c in order}
+
+
+def running():
+    with cond:
+        return {c['labels']: c['running'] for c in order}
+
+
+metrics.gauge('upload_backlog', backlog)
+metrics.gauge('upload_running', running)
@@ -0,0 +1,227 @@
+# -*-coding:utf-8 -*-
+
+"""
+ Per-vehicle session, so one nCube process can serve several flight controllers.
+
+ A Vehicle owns what belongs to one FC: its approval identity and containers,
+ its serial link, the framer buffer, the decoded fc data model with its
+ telemetry store (telemetry.py) and the arming and flight time state. The
+ HTTP pool (upload_scheduler), the spool, the aggregation timer and the two
+ MQTT clients are shared by the vehicles of the process.
+
+ The primary vehicle is the one of flight.json, provisioned by http_app as
+ before. conf["vehicles"] (./vehicles.json) adds more:
+
+    [{"flight": "Dione2", "port": "/dev/ttyUSB0", "baudrate": 115200},
+     {"flight": "Dione3", "replay": "./dione3.tlog"}]
+
+ Extra vehicles get their approval, AE and Drone_Data/Mission_Data containers
+ but no MSW missions, and the flight recorder and capture stay with the primary.
+"""
+
+import copy, json, os, threading, time, uuid
+
+import conf
+import frame_clock
+import http_adn
+import http_app
+import muv_log
+import telemetry
+import thyme
+
+log = muv_log.get_logger('vehicle')
+
+primary = None
+vehicles = {}  # flight name -> Vehicle
+gcs_topics = {}  # GCS_Data topic -> Vehicle, commands from the GCS to the FC
+
+
+class Vehicle:
+    def __init__(self, name, fc, port_name='/dev/ttyAMA0', baudrate='115200', replay=''):
+        self.name = name
+        self.is_primary = False
+
+        # AE of an extra vehicle, the primary one is conf["ae"]
+        self.origin = 'S' + name
+        self.appid = str(uuid.uuid1())
+
+        # approval identity and containers
+        self.drone_info = {}
+        self.gcs_name = ''
+        self.drone_type = 'pixhawk'
+        self.system_id = 8
+        self.sortie_name = 'disarm'
+        self.parent_cnt_name = ''
+        self.cnt_name = ''
+        self.mission_parent = []
+        self.pub_fc_gpi_topic = ''
+        self.pub_fc_hb_topic = ''
+        self.sub_gcs_topic = ''
+
+        # serial link and framer
+        self.port_name = port_name
+        self.baudrate = str(baudrate)
+        self.replay = replay
+        self.port = None
+        self.ingesting = False  # serial port or replay started
+        self.mavStrFromDrone = ''
+        self.mavStrFromDroneLength = 0
+        self.clock = frame_clock.FcClock()
+
+        # decoder and flight time
+        self.fc = fc
+        self.telemetry = telemetry.Store()
+        self.flag_base_mode = 0
+        self.start_arm_time = 0
+        self.cal_flag = 0
+        self.cal_sortiename = ''
+
+    def set_sortie(self, sortie_name):
+        self.sortie_name = sortie_name
+        self.cnt_name = self.parent_cnt_name + '/' + sortie_name
+        if self.is_primary:
+            # webrtc and the MSW side still read them from http_app
+            http_app.my_sortie_name = self.sortie_name
+            http_app.my_cnt_name = self.cnt_name
+
+    def from_http_app(self):
+        """
+        Takes the identity the primary vehicle got from http_app provisioning.
+        """
+
+        self.drone_info = http_app.drone_info
+        self.gcs_name = self.drone_info.get('gcs', '')
+        self.drone_type = http_app.my_drone_type
+        self.system_id = http_app.my_system_id
+        self.sortie_name = http_app.my_sortie_name
+        self.parent_cnt_name = http_app.my_parent_cnt_name
+        self.cnt_name = http_app.my_cnt_name
+        self.mission_parent = http_app.mission_parent
+        self.pub_fc_gpi_topic = http_app.muv_pub_fc_gpi_topic
+        self.pub_fc_hb_topic = http_app.muv_pub_fc_hb_topic
+        self.sub_gcs_topic = http_app.muv_sub_gcs_topic
+
+    def approve(self, drone_info):
+        self.drone_info = drone_info
+        self.gcs_name = drone_info['gcs']
+        self.drone_type = drone_info.get('type') or 'pixhawk'
+        self.system_id = drone_info.get('system_id') or 8
+
+        drone_data = '/Mobius/' + self.gcs_name + '/Drone_Data/' + drone_info['drone']
+        self.parent_cnt_name = drone_data
+        self.set_sortie('disarm')
+        self.pub_fc_gpi_topic = drone_data + '/global_position_int'
+        self.pub_fc_hb_topic = drone_data + '/heartbeat'
+        self.sub_gcs_topic = '/Mobius/' + self.gcs_name + '/GCS_Data/' + drone_info['drone']
+
+    def provision(self):
+        """
+        Approval, AE and containers of an extra vehicle. Returns True when done.
+        """
+
+        rsc, res_body, count = http_adn.rtvct(
+            '/Mobius/' + conf.conf['ae']['approval_gcs'] + '/approval/' + self.name + '/la', 0)
+        if rsc != 2000:
+            log.warning('%s: approval x-m2m-rsc : %s', self.name, rsc)
+            return False
+        self.approve(res_body['m2m:cin']['con'])
+
+        rsc, res_body = http_adn.crtae(conf.conf['ae']['parent'], self.name, self.appid, self.origin)
+        if rsc in (4105, 5106):
+            # an AE of this name exists, it is ours only if it was created with our origin
+            rsc, res_body = http_adn.rtvae(conf.conf['ae']['parent'] + '/' + self.name, refresh=True)
+            if rsc != 2000:
+                return False
+            aeid = res_body['m2m:ae']['aei']
+            if aeid != self.origin and aeid != '/' + self.origin:
+                log.warning('%s: AE %s/%s belongs to %s, not %s', self.name, conf.conf['ae']['parent'], self.name,
+                            aeid, self.origin)
+                return False
+        elif rsc != 2001:
+            return False
+
+        gcs = '/Mobius/' + self.gcs_name
+        drone = self.drone_info['drone']
+        for parent, rn in [(gcs, 'Drone_Data'), (gcs + '/Drone_Data', drone), (self.parent_cnt_name, 'disarm'),
+                           (gcs, 'Mission_Data'), (gcs + '/Mission_Data', drone)]:
+            rsc, res_body, count = http_adn.crtct(parent, rn, 0, self.origin)
+            if rsc not in (2001, 4105, 5106):
+                return False
+
+        return True
+
+
+def register(v):
+    vehicles[v.name] = v
+    if v.sub_gcs_topic != '':
+        gcs_topics[v.sub_gcs_topic] = v
+
+
+def cached_approval():
+    # drone_info of the last approval of the primary vehicle, None when it never got one
+    try:
+        with open(conf.conf['early']['approval_cache'], 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_approval(drone_info):
+    path = conf.conf['early']['approval_cache']
+    with open(path + '.tmp', 'w') as f:
+        json.dump(drone_info, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def start_cached(fc, port_name, baudrate, drone_info):
+    """
+    The primary vehicle with a cached approval, before http_app provisioned it.
+    """
+
+    global primary
+
+    primary = Vehicle(conf.conf['ae']['name'], fc, port_name, baudrate, conf.conf['replay']['path'])
+    primary.is_primary = True
+    primary.approve(drone_info)
+    register(primary)
+
+    return primary
+
+
+def start_primary(fc, port_name, baudrate):
+    global primary
+
+    if primary is None:
+        primary = Vehicle(conf.conf['ae']['name'], fc, port_name, baudrate, conf.conf['replay']['path'])
+        primary.is_primary = True
+    primary.from_http_app()
+    register(primary)
+
+    return primary
+
+
+def start_extra(fc, ready):
+    """
+    Provisions the vehicles of conf["vehicles"] in the background and calls
+    ready(vehicle) for each one, retrying until the CSE answers.
+    """
+
+    for info in conf.conf['vehicles']:
+        v = Vehicle(info['flight'], copy.deepcopy(fc), info.get('port', '/dev/ttyAMA0'),
+                    info.get('baudrate', '115200'), info.get('replay', ''))
+
+        def provision_loop(v=v):
+            while not v.provision():
+                time.sleep(http_app.retry_interval / 1000)
+            register(v)
+            if thyme.mqtt_client is not None:
+                thyme.mqtt_client.subscribe(v.sub_gcs_topic, 0)
+            log.info('%s: provisioned as system %s in %s', v.name, v.system_id, v.parent_cnt_name)
+            ready(v)
+
+        t = threading.Thread(target=provision_loop, name='vehicle-' + v.name, daemon=True)
+        t.start()
+
+
+def system_ids():
+    return [v.system_id for v in vehicles.values()]
@@ -4,17 +4,11 @@
  Created by Wonseok Jung in KETI on 2021-03-16.
 """
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-
 import http_app
 
-import time, sys, requests, json, uuid, random, string
+import time, sys, json, uuid, random, string
+
+# selenium and requests are imported by the functions using them, they take a while to load on a Pi
 
 display_name = ''
 session_id = ''
@@ -32,6 +26,13 @@ def rand_var():
 
 
 def openWeb():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.common.by import By
+
     opt = Options()
     opt.add_argument("--disable-infobars")
     opt.add_argument("start-maximized")
@@ -71,6 +72,8 @@ def control_web(driver):
     global room_number
     global flag
 
+    from selenium.webdriver.common.keys import Keys
+
     button_id = driver.find_element_by_id('start')
     button_id.click()
 
@@ -107,6 +110,8 @@ def control_web(driver):
 
 
 def crt_room(session_id, handle_id, room_number):
+    import requests
+
     # global session_id
     # global handle_id
 
@@ -156,6 +161,8 @@ def destroy_room():
     global handle_id
     global room_number
 
+    import requests
+
     url = "http://" + http_app.drone_info["host"] + ":8088/janus"
 
     payload = json.dumps({
@@ -198,6 +205,8 @@ def get_participants():
     global room_number
     global count
 
+    import requests
+
     url = "http://" + http_app.drone_info["host"] + ":8088/janus"
 
     payload = json.dumps({